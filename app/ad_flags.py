@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Типизированные флаги AD-записей.
+
+Строковые поля (enabled, locked_out, password_never_expires, ...) хранятся
+как в источнике и используются для отображения. При загрузке они
+разбираются в булевы колонки *_flag и целочисленную маску uac_flags
+(биты userAccountControl), поэтому фильтры по флагам — обычные
+индексируемые SQL-предикаты:
+
+    ADRecord.enabled_flag.is_(True)
+    uac_match(ADRecord.uac_flags, set_bits=DONT_REQ_PREAUTH, clear_bits=ACCOUNTDISABLE)
+"""
+from collections import namedtuple
+
+from app.utils import norm, parse_bool
+
+# Биты userAccountControl (MS-ADTS 2.2.16)
+ACCOUNTDISABLE = 0x0002
+LOCKOUT = 0x0010
+PASSWD_NOTREQD = 0x0020
+PASSWD_CANT_CHANGE = 0x0040
+ENCRYPTED_TEXT_PWD_ALLOWED = 0x0080
+DONT_EXPIRE_PASSWORD = 0x10000
+SMARTCARD_REQUIRED = 0x40000
+TRUSTED_FOR_DELEGATION = 0x80000
+NOT_DELEGATED = 0x100000
+DONT_REQ_PREAUTH = 0x400000
+PASSWORD_EXPIRED = 0x800000
+TRUSTED_TO_AUTH_FOR_DELEGATION = 0x1000000
+
+# column — строковое поле ADRecord, flag — булева колонка,
+# bit — бит UAC (0, если флага в UAC нет), inverse — бит означает «ложь» (enabled ↔ ACCOUNTDISABLE)
+ADFlag = namedtuple("ADFlag", ["column", "flag", "bit", "inverse"])
+
+AD_FLAGS = (
+    ADFlag("enabled", "enabled_flag", ACCOUNTDISABLE, True),
+    ADFlag("locked_out", "locked_out_flag", LOCKOUT, False),
+    ADFlag("password_not_required", "password_not_required_flag", PASSWD_NOTREQD, False),
+    ADFlag("cannot_change_password", "cannot_change_password_flag", PASSWD_CANT_CHANGE, False),
+    ADFlag("allow_reversible_password_encryption", "reversible_encryption_flag", ENCRYPTED_TEXT_PWD_ALLOWED, False),
+    ADFlag("password_never_expires", "password_never_expires_flag", DONT_EXPIRE_PASSWORD, False),
+    ADFlag("smartcard_logon_required", "smartcard_logon_required_flag", SMARTCARD_REQUIRED, False),
+    ADFlag("trusted_for_delegation", "trusted_for_delegation_flag", TRUSTED_FOR_DELEGATION, False),
+    ADFlag("account_not_delegated", "account_not_delegated_flag", NOT_DELEGATED, False),
+    ADFlag("does_not_require_preauth", "no_preauth_flag", DONT_REQ_PREAUTH, False),
+    ADFlag("password_expired", "password_expired_flag", PASSWORD_EXPIRED, False),
+    ADFlag("trusted_to_auth_for_delegation", "protocol_transition_flag", TRUSTED_TO_AUTH_FOR_DELEGATION, False),
+    ADFlag("must_change_password", "must_change_password_flag", 0, False),
+    ADFlag("protected_from_accidental_deletion", "protected_flag", 0, False),
+)
+
+FLAG_COLUMNS = tuple(f.flag for f in AD_FLAGS)
+
+
+def parse_uac(val) -> int | None:
+    """Значение userAccountControl ("512", "66048.0") в int; None, если не число."""
+    s = norm(val)
+    if not s:
+        return None
+    try:
+        return int(s)
+    except ValueError:
+        pass
+    try:
+        return int(float(s))
+    except (ValueError, OverflowError):
+        return None
+
+
+def decode_ad_flags(row: dict) -> dict:
+    """
+    Дополняет строку AD-записи булевыми колонками *_flag и маской uac_flags.
+    Явное строковое значение флага важнее бита из userAccountControl;
+    если флаг не указан, он берётся из UAC (когда UAC есть).
+    Неизвестный флаг — None; uac_flags — None, если не известен ни один бит.
+    """
+    uac = parse_uac(row.get("user_account_control"))
+    known = uac is not None
+    mask = uac or 0
+    for f in AD_FLAGS:
+        val = parse_bool(row.get(f.column))
+        if f.bit:
+            if val is None and uac is not None:
+                val = bool(uac & f.bit) != f.inverse
+            elif val is not None:
+                mask = mask | f.bit if val != f.inverse else mask & ~f.bit
+                known = True
+        row[f.flag] = val
+    row["uac_flags"] = mask if known else None
+    return row
+
+
+def uac_match(column, set_bits: int = 0, clear_bits: int = 0):
+    """SQL-предикат: в маске column установлены все set_bits и сброшены все clear_bits."""
+    return column.op("&")(set_bits | clear_bits) == set_bits
@@ -10,6 +10,23 @@ DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DATA_DIR / 'app.db'}")
 # Максимальный размер загружаемого файла (по умолчанию 50 МБ)
 MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(50 * 1024 * 1024)))
 
+# Разбор загрузок в пуле процессов (app.parse_pool): число процессов (0 — в процессе API),
+# время на файл (с), память процесса (МБ, 0 — без ограничения), задач до перезапуска процесса
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "2"))
+PARSE_TIMEOUT = int(os.getenv("PARSE_TIMEOUT", "300"))
+PARSE_MEMORY_MB = int(os.getenv("PARSE_MEMORY_MB", "2048"))
+PARSE_MAX_TASKS = int(os.getenv("PARSE_MAX_TASKS", "20"))
+
+# Минимальный размер ответа для сжатия gzip/brotli (байт)
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+
+# Токен для опроса /metrics (Authorization: Bearer ...); без токена — только с localhost
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Пороги проверок безопасности по умолчанию (дни); рабочие значения — в app_settings
+SECURITY_INACTIVE_DAYS = 90
+SECURITY_STALE_PASSWORD_DAYS = 180
+
 # Ключ для шифрования паролей LDAP в БД (Fernet)
 APP_SECRET_KEY = os.getenv("APP_SECRET_KEY", "")
 
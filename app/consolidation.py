@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import json
 from sqlalchemy.orm import Session
-from app.database import ADRecord, MFARecord, PeopleRecord, get_setting
+from app.database import get_setting
 from app.config import AD_SOURCE_LABELS, AD_ACCOUNT_TYPE_RULES
 from app.utils import norm, norm_phone, norm_email, norm_key_login, norm_key_uuid, enabled_str, fmt_date, fmt_datetime
 
@@ -34,9 +34,8 @@ def compute_account_type(ad_source: str, dn: str, rules: dict) -> str:
     return "Unknown"
 
 
-def _to_ad(r, rules: dict):
+def _to_ad(r):
     ad_source = norm(r.ad_source)
-    dn = norm(r.distinguished_name)
     return {
         "ad_source": ad_source,
         "domain": norm(r.domain),
@@ -49,8 +48,9 @@ def _to_ad(r, rules: dict):
         "phone_ad": norm_phone(r.phone),
         "mobile_ad": norm_phone(r.mobile),
         "fio_ad": norm(r.display_name),
+        "fio_key_ad": r.fio_key or "",
         "staff_uuid": norm(r.staff_uuid),
-        "account_type": compute_account_type(ad_source, dn, rules),
+        "account_type": r.account_type,
     }
 
 
@@ -60,6 +60,7 @@ def _to_mfa(r):
         "email_mfa": norm_email(r.email),
         "phone_mfa": norm_phone(r.phones),
         "fio_mfa": norm(r.name),
+        "fio_key_mfa": r.fio_key or "",
         "last_login_mfa": fmt_datetime(r.last_login),
         "created_at_mfa": fmt_datetime(r.created_at),
         "is_enrolled": norm(r.is_enrolled),
@@ -73,6 +74,7 @@ def _to_people(r):
         "email_people": norm_email(r.email),
         "phone_people": norm_phone(r.phone),
         "fio_people": norm(r.fio),
+        "fio_key_people": r.fio_key or "",
     }
 
 
@@ -86,9 +88,10 @@ def _detect_remarks(r, mfa, people, has_mfa, has_people):
     phone_mfa = mfa.get("phone_mfa", "")
     phone_people = people.get("phone_people", "")
     ad_phones = {p for p in (phone_ad, mobile_ad) if p}
-    fio_ad = r.get("fio_ad", "")
-    fio_mfa = mfa.get("fio_mfa", "")
-    fio_people = people.get("fio_people", "")
+    # ФИО сравниваются по каноническим ключам (ё/е, порядок слов, транслитерация)
+    fio_ad = r.get("fio_key_ad", "")
+    fio_mfa = mfa.get("fio_key_mfa", "")
+    fio_people = people.get("fio_key_people", "")
 
     remarks = []
     if not has_people:
@@ -151,12 +154,11 @@ def _build_result_row(r, mfa, people, has_mfa, has_people, remarks):
     }
 
 
-def build_consolidated(db: Session) -> list[dict]:
-    """Строит сводную таблицу из записей в БД: AD + MFA + кадры."""
-    ou_rules = load_ou_rules(db)
-    rows_ad = [_to_ad(r, ou_rules) for r in db.query(ADRecord).all()]
-    rows_mfa = [_to_mfa(r) for r in db.query(MFARecord).all()]
-    rows_people = [_to_people(r) for r in db.query(PeopleRecord).all()]
+def build_consolidated(ds) -> list[dict]:
+    """Строит сводную таблицу по снимку данных (app.dataset): AD + MFA + кадры."""
+    rows_ad = [_to_ad(r) for r in ds.ad_rows]
+    rows_mfa = [_to_mfa(r) for r in ds.mfa_rows]
+    rows_people = [_to_people(r) for r in ds.people_rows]
 
     # Словари для быстрого поиска
     mfa_by_identity = {norm_key_login(r["identity"]): r for r in rows_mfa if r["identity"]}
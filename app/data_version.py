@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Глобальная версия данных для ETag и кэшей.
+
+Версия меняется после каждой записи (загрузка, синхронизация, очистка,
+изменение настроек) и хранится в файле в DATA_DIR, поэтому видна всем
+воркерам. Чтение — один os.stat(), без обращения к БД.
+"""
+import hashlib
+import os
+import threading
+import time
+from datetime import date
+
+from fastapi import Depends, HTTPException, Request, Response
+
+from app.config import DATA_DIR
+from app.auth import get_current_user
+from app.metrics import cache_hit
+
+_VERSION_FILE = DATA_DIR / "data_version"
+_lock = threading.Lock()
+_cached: tuple[int, str] = (-1, "0")   # (mtime_ns файла, версия)
+
+
+def get_data_version() -> str:
+    """Текущая версия данных ("0", если записей ещё не было)."""
+    global _cached
+    try:
+        mtime = os.stat(_VERSION_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return "0"
+    if mtime == _cached[0]:
+        return _cached[1]
+    try:
+        version = _VERSION_FILE.read_text(encoding="ascii").strip() or "0"
+    except OSError:
+        return _cached[1]
+    _cached = (mtime, version)
+    return version
+
+
+def bump_data_version() -> str:
+    """Увеличивает версию данных. Вызывается после commit любой записи."""
+    with _lock:
+        version = f"{time.time_ns():x}"
+        tmp = _VERSION_FILE.with_name(f"{_VERSION_FILE.name}.{os.getpid()}.tmp")
+        tmp.write_text(version, encoding="ascii")
+        os.replace(tmp, _VERSION_FILE)
+        return version
+
+
+_results: dict = {}   # ключ → (версия, значение)
+
+
+def cached_by_version(key, build):
+    """
+    Результат build(), закэшированный до следующего изменения версии данных.
+    Для небольших агрегатов (деревья, сводки), которые дешевле хранить,
+    чем пересчитывать на каждый запрос.
+    """
+    version = get_data_version()
+    hit = _results.get(key)
+    if hit is not None and hit[0] == version:
+        cache_hit("version", True)
+        return hit[1]
+    cache_hit("version", False)
+    value = build()
+    _results[key] = (version, value)
+    return value
+
+
+def make_etag(request: Request) -> str:
+    """
+    Сильный ETag: версия данных + текущая дата + хеш пути и параметров запроса.
+    Дата нужна ответам, зависящим от «сегодня» (проверки безопасности, days_ago):
+    после полуночи они меняются без записи данных.
+    """
+    url_hash = hashlib.sha1(str(request.url.path + "?" + request.url.query).encode()).hexdigest()[:12]
+    return f'"{get_data_version()}-{date.today():%Y%m%d}-{url_hash}"'
+
+
+async def etag_guard(request: Request, response: Response, _u: dict = Depends(get_current_user)):
+    """
+    Зависимость для read-эндпоинтов: ставит ETag и отвечает 304 на If-None-Match
+    до выполнения эндпоинта (данные не читаются, ответ не строится).
+    Авторизация проверяется до сравнения ETag.
+    """
+    if request.method != "GET":
+        return
+    etag = make_etag(request)
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match:
+        tags = {t.strip() for t in if_none_match.split(",")}
+        if etag in tags or "*" in tags:
+            raise HTTPException(304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
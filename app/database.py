@@ -1,14 +1,22 @@
 # -*- coding: utf-8 -*-
+import logging
 import re
 import secrets as _secrets
 from datetime import datetime, timezone
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Boolean, text, inspect as sa_inspect
+from sqlalchemy import (
+    create_engine, Column, Integer, String, Date, DateTime, Text, Boolean, Index, text, inspect as sa_inspect,
+)
 from sqlalchemy.orm import declarative_base, sessionmaker
 from app.config import DATABASE_URL
+from app.utils import norm_email, norm_fio_key, norm_key_login, norm_key_dn, norm_key_uuid
+from app.ad_flags import AD_FLAGS, decode_ad_flags
+
+logger = logging.getLogger(__name__)
 
 _SAFE_IDENTIFIER = re.compile(r"^[a-zA-Z_][a-zA-Z0-9_]*$")
+IS_SQLITE = "sqlite" in DATABASE_URL
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {})
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if IS_SQLITE else {})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -36,26 +44,46 @@ class AppUser(Base):
 class Upload(Base):
     __tablename__ = "uploads"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    source = Column(String(20), nullable=False)  # ad, mfa, people
+    source = Column(String(20), nullable=False)  # ad_<домен>, mfa, people
     filename = Column(String(255), nullable=False)
     uploaded_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     row_count = Column(Integer, default=0)
+    # Каталог снимков: прошлые загрузки источника остаются с active=False
+    active = Column(Boolean, nullable=False, default=True)
+    snapshot_path = Column(String(500), default="")      # Parquet-снимок относительно DATA_DIR
+    snapshot_bytes = Column(Integer, nullable=True)
+    content_hash = Column(String(64), default="")        # sha256 загруженного файла
+    # Телеметрия загрузки: объём, строки, общее время; по фазам — в telemetry (JSON)
+    bytes_read = Column(Integer, nullable=True)
+    rows_read = Column(Integer, nullable=True)
+    rows_skipped = Column(Integer, nullable=True)
+    duration_ms = Column(Integer, nullable=True)
+    telemetry = Column(Text, default="")
+
+    __table_args__ = (
+        Index("ix_uploads_source_active", "source", "active"),
+    )
 
 
 class ADRecord(Base):
     __tablename__ = "ad_records"
     id = Column(Integer, primary_key=True, autoincrement=True)
     upload_id = Column(Integer, nullable=True)
+    row_hash = Column(String(32), default="")     # хэш значений строки (app.ingest)
     ad_source = Column(String(50), default="", index=True)   # izhevsk / kostroma / moscow
     # --- основные поля ---
     domain = Column(String(255), default="")
     login = Column(String(255), default="", index=True)
+    login_key = Column(String(255), default="")   # norm_key_login(login)
     enabled = Column(String(20), default="")
     email = Column(String(255), default="", index=True)
+    email_key = Column(String(255), default="", index=True)   # norm_email(email)
     phone = Column(String(100), default="")
     mobile = Column(String(100), default="")
     display_name = Column(String(255), default="", index=True)
+    fio_key = Column(String(255), default="", index=True)   # norm_fio_key(display_name)
     staff_uuid = Column(String(100), default="", index=True)
+    uuid_key = Column(String(100), default="", index=True)   # norm_key_uuid(staff_uuid)
     # --- дополнительные основные ---
     given_name = Column(String(255), default="")
     surname_ad = Column(String(255), default="")
@@ -63,6 +91,7 @@ class ADRecord(Base):
     title = Column(String(255), default="")
     manager = Column(Text, default="")
     distinguished_name = Column(Text, default="", index=True)
+    dn_key = Column(String(500), default="", index=True)   # norm_key_dn(distinguished_name)
     company = Column(String(255), default="", index=True)
     department = Column(String(255), default="", index=True)
     description = Column(Text, default="")
@@ -120,16 +149,43 @@ class ADRecord(Base):
     direct_reports = Column(Text, default="")
     managed_objects = Column(Text, default="")
     primary_group = Column(Text, default="")
+    member_of = Column(Text, default="")   # DN прямых групп через \n (LDAP-синхронизация)
+    # --- типизированные флаги (app.ad_flags): разбираются из строковых полей при загрузке ---
+    enabled_flag = Column(Boolean, nullable=True, index=True)
+    locked_out_flag = Column(Boolean, nullable=True)
+    password_not_required_flag = Column(Boolean, nullable=True)
+    cannot_change_password_flag = Column(Boolean, nullable=True)
+    reversible_encryption_flag = Column(Boolean, nullable=True)
+    password_never_expires_flag = Column(Boolean, nullable=True)
+    smartcard_logon_required_flag = Column(Boolean, nullable=True)
+    trusted_for_delegation_flag = Column(Boolean, nullable=True)
+    account_not_delegated_flag = Column(Boolean, nullable=True)
+    no_preauth_flag = Column(Boolean, nullable=True)
+    password_expired_flag = Column(Boolean, nullable=True)
+    protocol_transition_flag = Column(Boolean, nullable=True)
+    must_change_password_flag = Column(Boolean, nullable=True)
+    protected_flag = Column(Boolean, nullable=True)
+    uac_flags = Column(Integer, nullable=True, index=True)   # биты userAccountControl
+
+    __table_args__ = (
+        Index("ix_ad_records_source_uac", "ad_source", "uac_flags"),
+        Index("ix_ad_records_login_key_source", "login_key", "ad_source"),
+        Index("ix_ad_records_company_department", "company", "department", "enabled_flag"),
+    )
 
 
 class MFARecord(Base):
     __tablename__ = "mfa_records"
     id = Column(Integer, primary_key=True, autoincrement=True)
     upload_id = Column(Integer, nullable=True)
+    row_hash = Column(String(32), default="")     # хэш значений строки (app.ingest)
     # --- основные поля ---
     identity = Column(String(255), default="", index=True)
+    identity_key = Column(String(255), default="", index=True)   # norm_key_login(identity)
     email = Column(String(255), default="")
+    email_key = Column(String(255), default="", index=True)   # norm_email(email)
     name = Column(String(255), default="")
+    fio_key = Column(String(255), default="", index=True)   # norm_fio_key(name)
     phones = Column(String(255), default="")
     last_login = Column(DateTime, nullable=True)
     created_at = Column(DateTime, nullable=True)
@@ -147,10 +203,14 @@ class PeopleRecord(Base):
     __tablename__ = "people_records"
     id = Column(Integer, primary_key=True, autoincrement=True)
     upload_id = Column(Integer, nullable=True)
+    row_hash = Column(String(32), default="")     # хэш значений строки (app.ingest)
     # --- основные поля ---
     staff_uuid = Column(String(100), default="", index=True)
+    uuid_key = Column(String(100), default="", index=True)   # norm_key_uuid(staff_uuid)
     fio = Column(String(255), default="")
+    fio_key = Column(String(255), default="", index=True)   # norm_fio_key(fio)
     email = Column(String(255), default="")
+    email_key = Column(String(255), default="", index=True)   # norm_email(email)
     phone = Column(String(100), default="")
     # --- дополнительные поля из файла People ---
     unit = Column(String(255), default="")
@@ -161,6 +221,115 @@ class PeopleRecord(Base):
     hr_bp = Column(String(255), default="")
 
 
+class SearchEntry(Base):
+    """Поисковый индекс: одна строка на запись AD / MFA / Кадры (значения нормализованы)."""
+    __tablename__ = "search_entries"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_key = Column(String(255), default="", index=True)   # ключ карточки пользователя
+    source = Column(String(20), default="")                  # ad, mfa, people
+    record_id = Column(Integer, nullable=True)
+    fio = Column(String(255), default="")
+    login = Column(String(255), default="", index=True)
+    email = Column(String(255), default="", index=True)
+    phone = Column(String(255), default="")
+    title = Column(String(255), default="")
+    department = Column(String(255), default="")
+    search_text = Column(Text, default="")
+
+
+class ManagerClosure(Base):
+    """
+    Транзитивное замыкание графа «руководитель → подчинённый» по AD (между доменами).
+    depth=1 — прямое подчинение, depth=N — N уровней вниз.
+    """
+    __tablename__ = "manager_closure"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ancestor_id = Column(Integer, nullable=False, index=True)     # ADRecord.id руководителя
+    descendant_id = Column(Integer, nullable=False, index=True)   # ADRecord.id подчинённого
+    depth = Column(Integer, nullable=False, default=1)
+
+
+class ADGroup(Base):
+    """
+    Объект группы AD (из LDAP-синхронизации). member_of — DN групп, в которые
+    входит сама группа: по ним строится граф вложенности.
+    """
+    __tablename__ = "ad_groups"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ad_source = Column(String(50), default="", index=True)
+    name = Column(String(255), default="")                     # CN
+    name_key = Column(String(255), default="", index=True)     # CN в нижнем регистре
+    distinguished_name = Column(Text, default="")
+    dn_key = Column(String(500), default="", index=True)       # norm_key_dn(distinguished_name)
+    description = Column(Text, default="")
+    member_of = Column(Text, default="")                       # DN родительских групп через \n
+
+
+class GroupClosure(Base):
+    """
+    Транзитивное замыкание вложенности групп AD: группа descendant входит
+    в группу ancestor через depth уровней (1 — напрямую).
+    """
+    __tablename__ = "group_closure"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ancestor_id = Column(Integer, nullable=False, index=True)     # ADGroup.id
+    descendant_id = Column(Integer, nullable=False, index=True)   # ADGroup.id
+    depth = Column(Integer, nullable=False, default=1)
+
+
+class GroupMembership(Base):
+    """
+    Эффективное членство AD-записей в группах с учётом вложенности.
+    depth=1 — прямое членство, depth=N — через N-1 промежуточных групп.
+    group_id пуст для групп, известных только по имени (выгрузка без объектов групп).
+    """
+    __tablename__ = "group_membership"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    record_id = Column(Integer, nullable=False, index=True)   # ADRecord.id
+    ad_source = Column(String(50), default="")                # домен группы
+    group_id = Column(Integer, nullable=True)
+    group_name = Column(String(255), default="")
+    group_key = Column(String(255), default="")               # имя группы в нижнем регистре
+    depth = Column(Integer, nullable=False, default=1)
+
+    __table_args__ = (
+        Index("ix_group_membership_group", "ad_source", "group_key"),
+    )
+
+
+class AgeHistogram(Base):
+    """
+    Распределение активных AD-УЗ по дате последнего входа / смены пароля
+    (по доменам, с точностью до дня). day=NULL — даты нет («никогда»).
+    Строится при загрузке; пороги «старше N дней» считаются по нему без обхода записей.
+    """
+    __tablename__ = "age_histograms"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ad_source = Column(String(50), default="", index=True)
+    metric = Column(String(20), nullable=False, index=True)   # last_logon / password_set
+    day = Column(Date, nullable=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class Collision(Base):
+    """
+    Коллизии ключей между источниками: одна строка на запись, попавшую в группу
+    (kind, key), где ключ принадлежит нескольким разным людям / УЗ.
+    Строится при загрузке (app.duplicates.rebuild_collisions).
+    """
+    __tablename__ = "collisions"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(20), nullable=False)            # staff_uuid / email / mfa_phone / people_uuid
+    key = Column(String(255), nullable=False)            # нормализованное значение ключа
+    source = Column(String(20), nullable=False)          # ad, mfa, people
+    record_id = Column(Integer, nullable=False)
+    owners = Column(Integer, nullable=False, default=0)  # сколько разных владельцев у ключа
+
+    __table_args__ = (
+        Index("ix_collisions_kind_key", "kind", "key"),
+    )
+
+
 def _migrate_table(insp, table_name, model_class):
     """Добавляет недостающие колонки в таблицу на основе модели."""
     if not _SAFE_IDENTIFIER.match(table_name):
@@ -177,9 +346,13 @@ def _migrate_table(insp, table_name, model_class):
                 length = getattr(col.type, "length", None)
                 col_type = f"VARCHAR({length})" if length else "TEXT"
                 default = "''"
+            elif isinstance(col.type, Boolean):
+                col_type = "BOOLEAN"
+                arg = getattr(col.default, "arg", None)
+                default = "NULL" if arg is None or callable(arg) else ("TRUE" if arg else "FALSE")
             elif isinstance(col.type, Integer):
                 col_type = "INTEGER"
-                default = "0"
+                default = "NULL" if col.nullable and col.default is None else "0"
             else:
                 col_type = "TEXT"
                 default = "''"
@@ -187,19 +360,116 @@ def _migrate_table(insp, table_name, model_class):
                 conn.execute(text(
                     f'ALTER TABLE "{table_name}" ADD COLUMN "{col.name}" {col_type} DEFAULT {default}'
                 ))
+    # Индексы для добавленных колонок (create_all не трогает существующие таблицы)
+    for idx in model_class.__table__.indexes:
+        idx.create(bind=engine, checkfirst=True)
+
+
+# Производные ключи: (модель, колонка-ключ, исходная колонка, функция нормализации)
+_DERIVED_KEYS = [
+    (ADRecord, "fio_key", "display_name", norm_fio_key),
+    (MFARecord, "fio_key", "name", norm_fio_key),
+    (PeopleRecord, "fio_key", "fio", norm_fio_key),
+    (MFARecord, "identity_key", "identity", norm_key_login),
+    (ADRecord, "dn_key", "distinguished_name", norm_key_dn),
+    (ADRecord, "login_key", "login", norm_key_login),
+    (ADRecord, "uuid_key", "staff_uuid", norm_key_uuid),
+    (PeopleRecord, "uuid_key", "staff_uuid", norm_key_uuid),
+    (ADRecord, "email_key", "email", norm_email),
+    (MFARecord, "email_key", "email", norm_email),
+    (PeopleRecord, "email_key", "email", norm_email),
+]
+
+
+def fill_derived_keys(model, rows: list[dict]):
+    """Дозаполняет производные ключи строк (например, из снимка, записанного до появления колонки)."""
+    for m, key_name, src_name, fn in _DERIVED_KEYS:
+        if m is model:
+            for r in rows:
+                if not r.get(key_name):
+                    r[key_name] = fn(r.get(src_name))
+    if model is ADRecord:
+        for r in rows:
+            if "uac_flags" not in r:
+                decode_ad_flags(r)
+
+
+def _backfill_keys():
+    """Заполняет производные ключи для записей, загруженных до появления колонок."""
+    db = SessionLocal()
+    try:
+        for model, key_name, src_name, fn in _DERIVED_KEYS:
+            key_col, src_col = getattr(model, key_name), getattr(model, src_name)
+            rows = db.query(model.id, src_col).filter(
+                (key_col == "") | (key_col.is_(None)), src_col != "",
+            ).all()
+            updates = [{"id": rid, key_name: fn(val)} for rid, val in rows]
+            updates = [u for u in updates if u[key_name]]
+            if updates:
+                db.bulk_update_mappings(model, updates)
+                logger.info("%s заполнен для %d записей %s", key_name, len(updates), model.__tablename__)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _backfill_ad_flags():
+    """Разбирает флаги AD-записей, загруженных до появления типизированных колонок."""
+    db = SessionLocal()
+    try:
+        src_cols = [getattr(ADRecord, f.column) for f in AD_FLAGS] + [ADRecord.user_account_control]
+        # а также маску uac_flags записей, у которых флаги уже есть, а маски нет
+        rows = db.query(ADRecord.id, *src_cols).filter(
+            (ADRecord.enabled_flag.is_(None) & (ADRecord.enabled != ""))
+            | (ADRecord.uac_flags.is_(None) & ADRecord.enabled_flag.isnot(None)),
+        ).all()
+        updates = [decode_ad_flags({"id": r[0], **dict(zip(r._fields[1:], r[1:]))}) for r in rows]
+        if updates:
+            db.bulk_update_mappings(ADRecord, updates)
+            logger.info("Флаги AD разобраны для %d записей", len(updates))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _init_search_index():
+    """Создаёт полнотекстовый индекс над search_entries (FTS5 / pg_trgm)."""
+    if IS_SQLITE:
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+                "fio, login, email, phone, title, department, "
+                "content='search_entries', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2')"
+            ))
+    elif "postgresql" in DATABASE_URL:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_search_entries_trgm "
+                    "ON search_entries USING gin (search_text gin_trgm_ops)"
+                ))
+        except Exception as e:
+            logger.warning("pg_trgm недоступен, поиск без триграммного индекса: %s", e)
 
 
 def init_db():
-    if "sqlite" in DATABASE_URL:
+    if IS_SQLITE:
         with engine.begin() as conn:
             conn.execute(text("PRAGMA journal_mode=WAL"))
     Base.metadata.create_all(bind=engine)
+    _init_search_index()
     insp = sa_inspect(engine)
+    _migrate_table(insp, "uploads", Upload)
     _migrate_table(insp, "ad_records", ADRecord)
     _migrate_table(insp, "mfa_records", MFARecord)
     _migrate_table(insp, "people_records", PeopleRecord)
+    _migrate_table(insp, "search_entries", SearchEntry)
     if "app_users" in insp.get_table_names():
         _migrate_table(insp, "app_users", AppUser)
+    _backfill_keys()
+    _backfill_ad_flags()
     _ensure_jwt_secret()
 
 
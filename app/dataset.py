@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Общий снимок данных AD, MFA и кадров в памяти процесса.
+
+Аналитические роутеры (сводная, группы, структура, организация, дубли,
+безопасность, список пользователей) читают данные отсюда, а не из БД.
+Снимок строится один раз на версию данных (app.data_version): после
+любой записи версия меняется, и первый же запрос строит новый снимок,
+который атомарно подменяет старый. Текущие запросы дочитывают старый.
+
+Из БД читаются только поля, которые используют роутеры (AD_FIELDS,
+MFA_FIELDS, PEOPLE_FIELDS); карточки и прочие редкие поля читаются
+запросами к БД. Для каждого источника хранятся rows — список namedtuple
+с этими полями (значения как в БД). У AD-записей есть дополнительное поле
+account_type (по правилам OU) и frame (ds.ad) — pandas DataFrame только
+из колонок векторных фильтров (_AD_FRAME_COLUMNS), построенный по rows:
+строки без None, низкокардинальные колонки — category (словарное
+кодирование), булевы флаги — bool (неизвестное значение → False).
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, Boolean, DateTime, Integer, String, Text
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal, ADRecord, MFARecord, PeopleRecord
+from app.ad_flags import FLAG_COLUMNS
+from app.consolidation import load_ou_rules, compute_account_type
+from app.data_version import get_data_version
+from app.metrics import cache_hit, pipeline_duration
+from app.utils import norm
+
+logger = logging.getLogger(__name__)
+
+# Поля записей в снимке (то, что читают роутеры)
+AD_FIELDS = (
+    "id", "ad_source", "domain", "login", "login_key", "enabled", "email", "phone", "mobile",
+    "display_name", "fio_key", "staff_uuid", "title", "department", "company", "location",
+    "distinguished_name", "groups", "password_last_set", "pwd_last_set", "must_change_password",
+    "account_expires", "last_logon_date", "last_logon_timestamp", "service_principal_names",
+) + FLAG_COLUMNS
+MFA_FIELDS = (
+    "id", "identity", "email", "name", "fio_key", "phones", "last_login", "created_at",
+    "is_enrolled", "authenticators",
+)
+PEOPLE_FIELDS = ("id", "staff_uuid", "fio", "fio_key", "email", "phone")
+
+# Колонки AD-записей в DataFrame (векторные фильтры и агрегаты)
+_AD_FRAME_COLUMNS = (
+    "id", "ad_source", "login_key", "account_type", "distinguished_name", "groups",
+    "service_principal_names", "last_logon_date", "last_logon_timestamp",
+    "password_last_set", "pwd_last_set",
+) + FLAG_COLUMNS
+
+# Колонки со словарным кодированием (мало различных значений)
+_CATEGORY_COLUMNS = {"ad_source", "account_type"}
+
+ADRow = namedtuple("ADRow", AD_FIELDS + ("account_type",))
+MFARow = namedtuple("MFARow", MFA_FIELDS)
+PeopleRow = namedtuple("PeopleRow", PEOPLE_FIELDS)
+
+
+def _frame(rows: list, fields: tuple, columns: tuple, table, categories: set) -> pd.DataFrame:
+    """DataFrame из колонок columns записей: строки без None, низкокардинальные — category."""
+    df = pd.DataFrame({c: [r[i] for r in rows] for c, i in ((c, fields.index(c)) for c in columns)},
+                      columns=list(columns))
+    text_cols = {c.name for c in table.columns if isinstance(c.type, (String, Text))} | {"account_type"}
+    date_cols = {c.name for c in table.columns if isinstance(c.type, DateTime)}
+    bool_cols = {c.name for c in table.columns if isinstance(c.type, Boolean)}
+    int_cols = {c.name for c in table.columns if isinstance(c.type, Integer) and c.nullable and not c.primary_key}
+    for col in columns:
+        if col in date_cols:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+        elif col in bool_cols:
+            df[col] = df[col].eq(True)
+        elif col in int_cols:
+            df[col] = pd.to_numeric(df[col]).astype("Int64")
+        elif col in text_cols:
+            s = df[col].fillna("").astype(object)
+            df[col] = s.astype("category") if col in categories else s
+    return df
+
+
+class Dataset:
+    """Неизменяемый снимок данных одной версии."""
+
+    def __init__(self, version: str, ou_rules: dict, ad_rows: list, mfa_rows: list, people_rows: list):
+        self.version = version
+        self.ou_rules = ou_rules
+        self.ad_rows = ad_rows
+        self.mfa_rows = mfa_rows
+        self.people_rows = people_rows
+        self.ad = _frame(ad_rows, ADRow._fields, _AD_FRAME_COLUMNS, ADRecord.__table__, _CATEGORY_COLUMNS)
+        self._memo: dict = {}
+        self._memo_lock = threading.Lock()
+
+    def memo(self, key, build):
+        """
+        Производный результат (отчёт, агрегат), вычисляемый один раз на снимок.
+        Живёт до следующей записи: новый снимок начинает с пустого кэша.
+        """
+        try:
+            value = self._memo[key]
+        except KeyError:
+            pass
+        else:
+            cache_hit("memo", True)
+            return value
+        with self._memo_lock:
+            if key not in self._memo:
+                cache_hit("memo", False)
+                self._memo[key] = build()
+            else:
+                cache_hit("memo", True)
+            return self._memo[key]
+
+    @staticmethod
+    def take(rows: list, mask) -> list:
+        """Записи rows, для которых mask (bool-массив/Series той же длины) истинна."""
+        return [rows[i] for i in np.flatnonzero(np.asarray(mask, dtype=bool))]
+
+    def ad_count_by_source(self) -> dict[str, int]:
+        """Количество AD-записей по домену (ad_source)."""
+        return {k: int(v) for k, v in self.ad["ad_source"].value_counts().items() if v}
+
+
+def _select(model, fields: tuple):
+    return select(*(model.__table__.c[f] for f in fields))
+
+
+def _load(db: Session, version: str) -> Dataset:
+    t = time.perf_counter()
+    ou_rules = load_ou_rules(db)
+    ad_rows = [
+        ADRow(*r, compute_account_type(r.ad_source or "", norm(r.distinguished_name), ou_rules))
+        for r in db.execute(_select(ADRecord, AD_FIELDS)).all()
+    ]
+    mfa_rows = [MFARow(*r) for r in db.execute(_select(MFARecord, MFA_FIELDS)).all()]
+    people_rows = [PeopleRow(*r) for r in db.execute(_select(PeopleRecord, PEOPLE_FIELDS)).all()]
+    ds = Dataset(version, ou_rules, ad_rows, mfa_rows, people_rows)
+    pipeline_duration.observe(time.perf_counter() - t, "dataset")
+    logger.info(
+        "[dataset] Снимок v%s: AD %d, MFA %d, кадры %d (%.0f мс)",
+        version, len(ad_rows), len(mfa_rows), len(people_rows), (time.perf_counter() - t) * 1000,
+    )
+    return ds
+
+
+_current: Dataset | None = None
+_lock = threading.Lock()
+
+
+def get_dataset(db: Session | None = None) -> Dataset:
+    """
+    Снимок текущей версии данных. Строится при первом обращении после
+    изменения версии; параллельные запросы ждут одну сборку.
+    db — сессия запроса (если не передана, открывается своя).
+    """
+    global _current
+    version = get_data_version()
+    ds = _current
+    if ds is not None and ds.version == version:
+        cache_hit("dataset", True)
+        return ds
+    with _lock:
+        ds = _current
+        if ds is not None and ds.version == version:
+            cache_hit("dataset", True)
+            return ds
+        cache_hit("dataset", False)
+        if db is not None:
+            ds = _load(db, version)
+        else:
+            own = SessionLocal()
+            try:
+                ds = _load(own, version)
+            finally:
+                own.close()
+        _current = ds
+        return ds
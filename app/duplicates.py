@@ -1,72 +1,336 @@
 # -*- coding: utf-8 -*-
-"""Модуль анализа дублей логинов между доменами AD."""
+"""Модуль анализа дублей логинов между доменами AD и коллизий ключей между источниками.
 
-from fastapi import APIRouter, Depends
+Дубли ищутся в БД: GROUP BY login_key (нормализованный логин, индекс
+(login_key, ad_source)) с HAVING COUNT(DISTINCT ad_source) > 1. Полные
+записи читаются только для дублирующихся ключей и только для запрошенной
+страницы; порядок страниц определяется по ключам сортировки (utils.sorted_page).
+
+Коллизии (один StaffUUID, email или телефон у разных владельцев) считаются
+при загрузке в таблицу collisions; эндпоинты только читают её.
+"""
+import logging
+from collections import defaultdict
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import func, distinct, select
 from sqlalchemy.orm import Session
 
-from app.database import get_db, ADRecord
+from app.database import get_db, ADRecord, MFARecord, PeopleRecord, Collision
 from app.config import AD_SOURCE_LABELS
 from app.consolidation import load_ou_rules, compute_account_type
-from app.utils import norm, enabled_str, norm_key_login
+from app.utils import norm, enabled_str, norm_email, norm_key_uuid, sorted_page
+from app.responses import table_response, TABLE_FORMATS
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/duplicates", tags=["duplicates"])
 
+# Поле сортировки → колонка (строки сравниваются без учёта регистра)
+_SORT_COLUMNS = {
+    "login": ADRecord.login,
+    "domain": ADRecord.ad_source,
+    "display_name": ADRecord.display_name,
+    "email": ADRecord.email,
+    "enabled": ADRecord.enabled_flag,
+    "password_last_set": ADRecord.password_last_set,
+    "title": ADRecord.title,
+    "department": ADRecord.department,
+    "company": ADRecord.company,
+}
+_SORT_FIELDS = "^(" + "|".join(["", "domains_count", *_SORT_COLUMNS]) + ")$"
+
+
+def _duplicate_keys():
+    """Подзапрос: login_key, встречающиеся более чем в одном домене, и число доменов."""
+    return (
+        select(
+            ADRecord.login_key.label("login_key"),
+            func.count(distinct(ADRecord.ad_source)).label("domains_count"),
+            func.count().label("records"),
+        )
+        .where(ADRecord.login_key != "")
+        .group_by(ADRecord.login_key)
+        .having(func.count(distinct(ADRecord.ad_source)) > 1)
+        .subquery()
+    )
+
 
 @router.get("")
-def get_duplicates(db: Session = Depends(get_db)):
+def get_duplicates(
+    response: Response,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(0, ge=0, le=5000, description="Записей на страницу (0 — все)"),
+    sort: str = Query("", pattern=_SORT_FIELDS, description="Поле сортировки (по умолчанию — логин, домен)"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    fmt: str = Query("rows", alias="format", pattern=TABLE_FORMATS, description="rows | columnar"),
+    db: Session = Depends(get_db),
+):
     """
     Находит логины, которые встречаются более чем в одном домене AD.
     Возвращает список записей с подробной информацией по каждому дублю.
     """
-    all_recs = db.query(ADRecord).all()
+    dup = _duplicate_keys()
+    unique_logins, total_records = db.execute(
+        select(func.count(), func.coalesce(func.sum(dup.c.records), 0)).select_from(dup)
+    ).one()
 
-    # Группируем по нормализованному логину → {login: [records]}
-    login_map: dict[str, list] = {}
-    for r in all_recs:
-        login = norm_key_login(r.login)
-        if not login:
-            continue
-        login_map.setdefault(login, []).append(r)
+    q = db.query(ADRecord, dup.c.domains_count).join(dup, dup.c.login_key == ADRecord.login_key)
+    if sort:
+        col = dup.c.domains_count if sort == "domains_count" else _SORT_COLUMNS[sort]
+        page_rows = sorted_page(q, ADRecord, col, order == "desc", page, page_size,
+                                then=(ADRecord.login_key, ADRecord.ad_source))
+    else:
+        page_rows = sorted_page(q, ADRecord, ADRecord.login_key, False, page, page_size, then=(ADRecord.ad_source,))
 
-    # Оставляем только те, что встречаются в >1 доменах
     ou_rules = load_ou_rules(db)
     rows = []
-    for login, recs in login_map.items():
-        domains = set(r.ad_source for r in recs)
-        if len(domains) < 2:
+    for r, domains_count in page_rows:
+        rows.append({
+            "login":             norm(r.login),
+            "domain":            AD_SOURCE_LABELS.get(r.ad_source, r.ad_source or ""),
+            "ad_source":         r.ad_source or "",
+            "display_name":      norm(r.display_name),
+            "email":             norm(r.email),
+            "phone":             norm(r.phone),
+            "mobile":            norm(r.mobile),
+            "enabled":           enabled_str(r.enabled),
+            "account_type":      compute_account_type(r.ad_source or "", norm(r.distinguished_name), ou_rules),
+            "password_last_set": norm(r.password_last_set),
+            "account_expires":   norm(r.account_expires),
+            "staff_uuid":        norm(r.staff_uuid),
+            "title":             norm(r.title),
+            "department":        norm(r.department),
+            "company":           norm(r.company),
+            "distinguished_name": norm(r.distinguished_name),
+            "domains_count":     domains_count,
+        })
+
+    payload = {
+        "rows": rows,
+        "total_records": int(total_records),
+        "unique_logins": int(unique_logins),
+    }
+    if page_size:
+        payload.update(page=page, page_size=page_size)
+    return table_response(payload, "rows", fmt, response)
+
+
+# ─── Коллизии ключей между источниками ──────────────────────
+# Индекс collisions строится при загрузке: один проход по AD, MFA и Кадрам
+# раскладывает записи по хеш-таблицам ключей (StaffUUID, email, телефон MFA),
+# в группе считаются разные владельцы. Записи с общим идентификатором
+# (UUID, логин, ФИО без UUID) считаются одним владельцем.
+
+COLLISION_KINDS = [
+    {
+        "id": "staff_uuid",
+        "title": "Один StaffUUID у нескольких активных УЗ AD",
+        "description": "Активные учётные записи AD (в любых доменах) с одинаковым StaffUUID",
+    },
+    {
+        "id": "email",
+        "title": "Один email у разных людей",
+        "description": "Email встречается в AD, MFA или Кадрах у записей, не связанных общим UUID, логином или ФИО",
+    },
+    {
+        "id": "mfa_phone",
+        "title": "Один телефон MFA у нескольких identity",
+        "description": "Номер телефона MFA привязан к нескольким разным identity",
+    },
+    {
+        "id": "people_uuid",
+        "title": "Повторяющийся UUID в Кадрах",
+        "description": "Несколько строк выгрузки Кадров с одинаковым StaffUUID",
+    },
+]
+_KINDS = {k["id"]: k for k in COLLISION_KINDS}
+
+
+def _owners(entries: list[tuple[str, int, tuple]]) -> int:
+    """Число разных владельцев в группе: записи с общим идентификатором объединяются (union-find)."""
+    parent: dict = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for _source, _rid, ids in entries:
+        root = find(ids[0])
+        for t in ids[1:]:
+            parent[find(t)] = root
+    return len({find(ids[0]) for _source, _rid, ids in entries})
+
+
+def _ids(source: str, rid: int, *tokens) -> tuple:
+    """Идентификаторы владельца записи (пустые отбрасываются); без них — сама запись."""
+    return tuple(t for t in tokens if t[1]) or ((source, rid),)
+
+
+def rebuild_collisions(db: Session) -> int:
+    """Пересобирает collisions по текущему содержимому БД (в той же транзакции)."""
+    groups: dict[tuple[str, str], list[tuple[str, int, tuple]]] = defaultdict(list)
+
+    for rid, uuid, login_key, fio_key, email, enabled in db.query(
+        ADRecord.id, ADRecord.staff_uuid, ADRecord.login_key, ADRecord.fio_key,
+        ADRecord.email, ADRecord.enabled_flag,
+    ).all():
+        uuid = norm_key_uuid(uuid)
+        if uuid and enabled:
+            groups[("staff_uuid", uuid)].append(("ad", rid, (("ad", rid),)))
+        email = norm_email(email)
+        if email:
+            ids = _ids("ad", rid, ("uuid", uuid), ("login", login_key or ""), ("fio", "" if uuid else fio_key or ""))
+            groups[("email", email)].append(("ad", rid, ids))
+
+    for rid, identity_key, fio_key, email, phones in db.query(
+        MFARecord.id, MFARecord.identity_key, MFARecord.fio_key, MFARecord.email, MFARecord.phones,
+    ).all():
+        email, phone = norm_email(email), norm(phones)
+        if email:
+            groups[("email", email)].append(("mfa", rid, _ids("mfa", rid, ("login", identity_key or ""), ("fio", fio_key or ""))))
+        if phone:
+            groups[("mfa_phone", phone)].append(("mfa", rid, _ids("mfa", rid, ("login", identity_key or ""))))
+
+    for rid, uuid, fio_key, email in db.query(
+        PeopleRecord.id, PeopleRecord.staff_uuid, PeopleRecord.fio_key, PeopleRecord.email,
+    ).all():
+        uuid = norm_key_uuid(uuid)
+        if uuid:
+            groups[("people_uuid", uuid)].append(("people", rid, (("people", rid),)))
+        email = norm_email(email)
+        if email:
+            groups[("email", email)].append(("people", rid, _ids("people", rid, ("uuid", uuid), ("fio", "" if uuid else fio_key or ""))))
+
+    entries = []
+    for (kind, key), members in groups.items():
+        if len(members) < 2:
             continue
+        owners = _owners(members)
+        if owners < 2:
+            continue
+        entries.extend(
+            {"kind": kind, "key": key[:255], "source": source, "record_id": rid, "owners": owners}
+            for source, rid, _ids_ in members
+        )
+
+    db.query(Collision).delete()
+    if entries:
+        db.bulk_insert_mappings(Collision, entries)
+    logger.info("[duplicates] Коллизий ключей: %d записей", len(entries))
+    return len(entries)
 
-        for r in recs:
-            rows.append({
-                "login":             norm(r.login),
-                "domain":            AD_SOURCE_LABELS.get(r.ad_source, r.ad_source or ""),
-                "ad_source":         r.ad_source or "",
-                "display_name":      norm(r.display_name),
-                "email":             norm(r.email),
-                "phone":             norm(r.phone),
-                "mobile":            norm(r.mobile),
-                "enabled":           enabled_str(r.enabled),
-                "account_type":      compute_account_type(r.ad_source or "", norm(r.distinguished_name), ou_rules),
-                "password_last_set": norm(r.password_last_set),
-                "account_expires":   norm(r.account_expires),
-                "staff_uuid":        norm(r.staff_uuid),
-                "title":             norm(r.title),
-                "department":        norm(r.department),
-                "company":           norm(r.company),
-                "distinguished_name": norm(r.distinguished_name),
-                "domains_count":     len(domains),
-            })
 
-    # Сортируем: сначала по логину, потом по домену
-    rows.sort(key=lambda x: (x["login"].lower(), x["domain"]))
+def _collision_rows(db: Session, members: list[tuple[str, str, int, int]]) -> list[dict]:
+    """Строки таблицы для записей групп: (key, source, record_id, owners) → данные записи."""
+    ids: dict[str, set[int]] = defaultdict(set)
+    for _key, source, rid, _owners_ in members:
+        ids[source].add(rid)
 
-    # Считаем статистику
-    unique_logins = set()
-    for r in rows:
-        unique_logins.add(r["login"].lower())
+    ad = {r.id: r for r in db.query(ADRecord).filter(ADRecord.id.in_(ids["ad"])).all()} if ids["ad"] else {}
+    mfa = {r.id: r for r in db.query(MFARecord).filter(MFARecord.id.in_(ids["mfa"])).all()} if ids["mfa"] else {}
+    people = {r.id: r for r in db.query(PeopleRecord).filter(PeopleRecord.id.in_(ids["people"])).all()} if ids["people"] else {}
 
+    # Ключ карточки для MFA — как в поиске: по логину AD, иначе _mfa_<identity>
+    mfa_logins = {r.identity_key for r in mfa.values() if r.identity_key}
+    login_to_key = {}
+    if mfa_logins:
+        for login_key, uuid, login in db.query(ADRecord.login_key, ADRecord.staff_uuid, ADRecord.login).filter(
+            ADRecord.login_key.in_(mfa_logins),
+        ).all():
+            uuid = norm_key_uuid(uuid)
+            login_to_key.setdefault(login_key, uuid or f"_login_{norm(login).lower()}")
+
+    rows = []
+    for key, source, rid, owners in members:
+        row = {"collision_key": key, "owners": owners, "source": source, "record_id": rid}
+        if source == "ad" and rid in ad:
+            r = ad[rid]
+            uuid, login = norm(r.staff_uuid), norm(r.login)
+            row.update({
+                "key": uuid.lower() if uuid else f"_login_{login.lower()}" if login else "",
+                "source_label": AD_SOURCE_LABELS.get(r.ad_source, r.ad_source or ""),
+                "login": login, "display_name": norm(r.display_name), "email": norm(r.email),
+                "phone": norm(r.mobile) or norm(r.phone), "staff_uuid": uuid, "enabled": enabled_str(r.enabled),
+            })
+        elif source == "mfa" and rid in mfa:
+            r = mfa[rid]
+            ident = r.identity_key or ""
+            row.update({
+                "key": login_to_key.get(ident) or (f"_mfa_{ident}" if ident else ""),
+                "source_label": "MFA",
+                "login": norm(r.identity), "display_name": norm(r.name), "email": norm(r.email),
+                "phone": norm(r.phones), "staff_uuid": "", "enabled": "",
+            })
+        elif source == "people" and rid in people:
+            r = people[rid]
+            uuid = norm(r.staff_uuid)
+            row.update({
+                "key": uuid.lower(),
+                "source_label": "Кадры",
+                "login": "", "display_name": norm(r.fio), "email": norm(r.email),
+                "phone": norm(r.phone), "staff_uuid": uuid, "enabled": "",
+            })
+        rows.append(row)
+    return rows
+
+
+@router.get("/collisions")
+def collisions_summary(db: Session = Depends(get_db)):
+    """Сводка коллизий: число групп (ключей) и записей по каждому виду."""
+    counts = {
+        kind: (groups, records)
+        for kind, groups, records in db.query(
+            Collision.kind, func.count(distinct(Collision.key)), func.count(Collision.id),
+        ).group_by(Collision.kind).all()
+    }
     return {
-        "rows": rows,
-        "total_records": len(rows),
-        "unique_logins": len(unique_logins),
+        "kinds": [
+            {**k, "groups": counts.get(k["id"], (0, 0))[0], "records": counts.get(k["id"], (0, 0))[1]}
+            for k in COLLISION_KINDS
+        ],
     }
+
+
+@router.get("/collisions/{kind}")
+def collisions_by_kind(
+    kind: str,
+    response: Response,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(100, ge=1, le=1000, description="Групп (ключей) на страницу"),
+    fmt: str = Query("rows", alias="format", pattern=TABLE_FORMATS, description="rows | columnar"),
+    db: Session = Depends(get_db),
+):
+    """
+    Группы коллизий одного вида: страница ключей (сначала с наибольшим числом
+    владельцев) и все записи этих ключей — по строке на запись.
+    """
+    if kind not in _KINDS:
+        raise HTTPException(404, f"Неизвестный вид коллизий: {kind}")
+
+    total_groups = db.query(func.count(distinct(Collision.key))).filter(Collision.kind == kind).scalar() or 0
+    page_keys = [
+        key for key, _owners_, _n in db.query(
+            Collision.key, func.max(Collision.owners), func.count(Collision.id),
+        ).filter(Collision.kind == kind).group_by(Collision.key).order_by(
+            func.max(Collision.owners).desc(), func.count(Collision.id).desc(), Collision.key,
+        ).offset((page - 1) * page_size).limit(page_size).all()
+    ]
+    members = []
+    if page_keys:
+        order = {k: i for i, k in enumerate(page_keys)}
+        members = db.query(Collision.key, Collision.source, Collision.record_id, Collision.owners).filter(
+            Collision.kind == kind, Collision.key.in_(page_keys),
+        ).all()
+        members.sort(key=lambda m: (order[m[0]], m[1], m[2]))
+
+    return table_response({
+        **_KINDS[kind],
+        "groups": total_groups,
+        "page": page,
+        "page_size": page_size,
+        "rows": _collision_rows(db, members),
+    }, "rows", fmt, response)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Вложенность групп AD: замыкание графа групп и эффективное членство.
+
+Объекты групп (ad_groups) приходят из LDAP-синхронизации вместе с memberOf
+самих групп. При загрузке граф «группа → родительская группа» разворачивается
+в group_closure, а членство AD-записей — в group_membership с глубиной,
+поэтому «все участники группы X» и «все группы пользователя Y» — один
+индексированный запрос без рекурсивных обращений к LDAP.
+
+Прямые группы записи берутся из member_of (DN, LDAP), иначе — из groups
+(имена CN из файла выгрузки); имя сопоставляется с объектом группы того же
+домена. Группы без объекта попадают в членство только напрямую.
+"""
+import logging
+
+from sqlalchemy.orm import Session
+
+from app.database import ADRecord, ADGroup, GroupClosure, GroupMembership
+from app.utils import norm, norm_key_dn
+
+logger = logging.getLogger(__name__)
+
+
+def split_group_names(raw: str) -> list[str]:
+    """Строка групп (разделитель ';') → список имён."""
+    if not raw or raw.strip() in ("", "nan", "None"):
+        return []
+    return [g.strip() for g in raw.split(";") if g.strip()]
+
+
+def _split_dns(raw: str) -> list[str]:
+    return [dn.strip() for dn in (raw or "").split("\n") if dn.strip()]
+
+
+def _cn(dn: str) -> str:
+    """CN из DN группы (CN=Admins,OU=... → Admins)."""
+    first = dn.split(",")[0]
+    return first[3:] if first.upper().startswith("CN=") else dn
+
+
+def rebuild_group_graph(db: Session) -> int:
+    """
+    Пересобирает group_closure и group_membership (в той же транзакции).
+    Циклы вложенности допускаются: каждая группа учитывается один раз
+    на минимальной глубине.
+    """
+    groups = db.query(
+        ADGroup.id, ADGroup.ad_source, ADGroup.name, ADGroup.name_key, ADGroup.dn_key, ADGroup.member_of,
+    ).all()
+    info: dict[int, tuple[str, str]] = {}
+    id_by_dn: dict[str, int] = {}
+    id_by_name: dict[tuple[str, str], int] = {}
+    for gid, ad_source, name, name_key, dn_key, _member_of in groups:
+        info[gid] = (ad_source or "", name or "")
+        if dn_key:
+            id_by_dn.setdefault(dn_key, gid)
+        id_by_name.setdefault((ad_source or "", name_key or ""), gid)
+
+    parents: dict[int, list[int]] = {}
+    for gid, _src, _name, _key, _dn, member_of in groups:
+        ids = [id_by_dn.get(norm_key_dn(dn)) for dn in _split_dns(member_of)]
+        parents[gid] = [p for p in ids if p and p != gid]
+
+    # Предки каждой группы с минимальной глубиной (обход в ширину)
+    ancestors: dict[int, dict[int, int]] = {}
+    closure = []
+    for gid in info:
+        dist: dict[int, int] = {}
+        frontier, depth = [gid], 0
+        while frontier:
+            depth += 1
+            nxt = []
+            for g in frontier:
+                for p in parents.get(g, ()):
+                    if p != gid and p not in dist:
+                        dist[p] = depth
+                        nxt.append(p)
+            frontier = nxt
+        ancestors[gid] = dist
+        closure.extend({"ancestor_id": a, "descendant_id": gid, "depth": d} for a, d in dist.items())
+
+    memberships = []
+    for rid, ad_source, member_of, groups_str in db.query(
+        ADRecord.id, ADRecord.ad_source, ADRecord.member_of, ADRecord.groups,
+    ).all():
+        ad_source = ad_source or ""
+        resolved: dict[int, int] = {}
+        unresolved: dict[str, str] = {}
+        dns = _split_dns(member_of)
+        if dns:
+            for dn in dns:
+                gid = id_by_dn.get(norm_key_dn(dn))
+                if gid:
+                    resolved[gid] = 1
+                else:
+                    name = _cn(dn)
+                    unresolved[name.lower()] = name
+        else:
+            for name in split_group_names(norm(groups_str)):
+                gid = id_by_name.get((ad_source, name.lower()))
+                if gid:
+                    resolved[gid] = 1
+                else:
+                    unresolved[name.lower()] = name
+
+        for gid in list(resolved):
+            for anc, d in ancestors[gid].items():
+                if d + 1 < resolved.get(anc, d + 2):
+                    resolved[anc] = d + 1
+
+        for gid, depth in resolved.items():
+            g_source, g_name = info[gid]
+            memberships.append({
+                "record_id": rid, "ad_source": g_source, "group_id": gid,
+                "group_name": g_name, "group_key": g_name.lower(), "depth": depth,
+            })
+        for key, name in unresolved.items():
+            memberships.append({
+                "record_id": rid, "ad_source": ad_source, "group_id": None,
+                "group_name": name, "group_key": key, "depth": 1,
+            })
+
+    db.query(GroupClosure).delete()
+    db.query(GroupMembership).delete()
+    if closure:
+        db.bulk_insert_mappings(GroupClosure, closure)
+    if memberships:
+        db.bulk_insert_mappings(GroupMembership, memberships)
+    logger.info(
+        "[groups] Групп: %d, связей вложенности: %d, эффективных членств: %d",
+        len(info), len(closure), len(memberships),
+    )
+    return len(memberships)
+
+
+def effective_members(db: Session, ad_source: str, group_name: str):
+    """Запрос: (ADRecord, глубина) — все участники группы с учётом вложенных групп."""
+    return db.query(ADRecord, GroupMembership.depth).join(
+        GroupMembership, GroupMembership.record_id == ADRecord.id,
+    ).filter(
+        GroupMembership.ad_source == ad_source,
+        GroupMembership.group_key == group_name.strip().lower(),
+    )
+
+
+def effective_groups(db: Session, record_ids: list[int]) -> dict[int, list[dict]]:
+    """Все группы (прямые и через вложенность) для каждой AD-записи, от прямых к дальним."""
+    result: dict[int, list[dict]] = {rid: [] for rid in record_ids}
+    if not record_ids:
+        return result
+    q = db.query(
+        GroupMembership.record_id, GroupMembership.ad_source, GroupMembership.group_name,
+        GroupMembership.depth, ADGroup.distinguished_name,
+    ).outerjoin(ADGroup, ADGroup.id == GroupMembership.group_id).filter(
+        GroupMembership.record_id.in_(record_ids),
+    )
+    rows = sorted(q.all(), key=lambda r: (r.depth, (r.group_name or "").lower()))
+    for rid, ad_source, name, depth, dn in rows:
+        result[rid].append({
+            "name": name, "ad_source": ad_source, "depth": depth,
+            "direct": depth == 1, "distinguished_name": dn or "",
+        })
+    return result
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Битовые множества участников групп AD для операций над множествами.
+
+Для снимка данных (app.dataset) каждая группа хранится как упакованный
+битсет NumPy по позициям AD-записей снимка (1 бит на запись). Выражения
+вида «в A и B, но не в C» или «в любой из 20 групп» — побитовые and/or/not
+над строками матрицы, без обхода записей. Индекс строится один раз на
+версию данных из group_membership (прямое или эффективное членство).
+Для /members строится отдельный индекс по полю groups (как в /tree):
+домен записи и точное имя группы из выгрузки.
+
+Формат выражения (JSON):
+    {"group": "G1", "domain": "izhevsk"}         — участники группы
+    {"and": [expr, ...]}, {"or": [expr, ...]}    — пересечение / объединение
+    {"not": expr}                                 — дополнение (все AD-записи минус expr)
+"""
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.database import GroupMembership
+from app.group_graph import split_group_names
+from app.utils import norm
+
+# Ограничения на размер выражения (защита от чрезмерно вложенных запросов)
+MAX_EXPR_DEPTH = 16
+MAX_EXPR_NODES = 256
+
+
+class ExpressionError(ValueError):
+    """Некорректное выражение над группами."""
+
+
+class GroupBitsets:
+    """Матрица битсетов «группа × AD-запись» для одного снимка данных."""
+
+    def __init__(self, ds, memberships: list[tuple[int, str, str, str]], exact: bool = False):
+        """memberships — (record_id, ad_source группы, ключ группы, имя группы).
+
+        exact — ключ группы равен имени (поиск с учётом регистра, без нормализации).
+        """
+        self.exact = exact
+        self.rows = ds.ad_rows
+        self.n = n = len(self.rows)
+        ids = ds.ad["id"].to_numpy(dtype=np.int64)
+        pos_of = np.full(int(ids.max()) + 1 if n else 0, -1, dtype=np.int64)
+        pos_of[ids] = np.arange(n)
+
+        self.groups: list[tuple[str, str]] = []        # gid → (ad_source, имя)
+        self._gid: dict[tuple[str, str], int] = {}     # (ad_source, ключ) → gid
+        gids, positions = [], []
+        for rid, ad_source, key, name in memberships:
+            if rid >= len(pos_of) or pos_of[rid] < 0:
+                continue
+            k = (ad_source or "", key)
+            gid = self._gid.get(k)
+            if gid is None:
+                gid = self._gid[k] = len(self.groups)
+                self.groups.append((ad_source or "", name))
+            gids.append(gid)
+            positions.append(pos_of[rid])
+        gid_arr = np.asarray(gids, dtype=np.int64)
+        pos_arr = np.asarray(positions, dtype=np.int64)
+
+        self.bits = np.zeros((len(self.groups), (n + 7) // 8), dtype=np.uint8)
+        if len(pos_arr):
+            np.bitwise_or.at(self.bits, (gid_arr, pos_arr >> 3), (0x80 >> (pos_arr & 7)).astype(np.uint8))
+        self.all = np.packbits(np.ones(n, dtype=bool)) if n else np.zeros(0, dtype=np.uint8)
+
+        # Группы каждой записи (для сравнения доступа): пары, отсортированные по позиции
+        order = np.argsort(pos_arr, kind="stable")
+        self._row_pos = pos_arr[order]
+        self._row_gid = gid_arr[order]
+
+        self._sources = ds.ad["ad_source"].to_numpy(dtype=object)
+        self._source_bits: dict[str, np.ndarray] = {}
+
+        # Порядок вывода участников: по ФИО / логину
+        self.order = np.array(
+            sorted(range(n), key=lambda i: (norm(self.rows[i].display_name) or norm(self.rows[i].login)).lower()),
+            dtype=np.int64,
+        )
+
+    def source_bits(self, ad_source: str) -> np.ndarray:
+        """Битсет AD-записей одного домена."""
+        if ad_source not in self._source_bits:
+            mask = (self._sources == ad_source) if self.n else np.zeros(0, dtype=bool)
+            self._source_bits[ad_source] = np.packbits(mask)
+        return self._source_bits[ad_source]
+
+    def group_id(self, ad_source: str, name: str) -> int | None:
+        return self._gid.get((ad_source or "", name if self.exact else norm(name).lower()))
+
+    def evaluate(self, expr, unknown: list | None = None) -> np.ndarray:
+        """Упакованный битсет записей, удовлетворяющих выражению."""
+        nodes = [0]
+
+        def walk(e, depth: int) -> np.ndarray:
+            nodes[0] += 1
+            if depth > MAX_EXPR_DEPTH or nodes[0] > MAX_EXPR_NODES:
+                raise ExpressionError("Слишком сложное выражение")
+            if not isinstance(e, dict) or len(e) == 0:
+                raise ExpressionError("Элемент выражения должен быть объектом")
+            if "group" in e:
+                if not isinstance(e["group"], str) or not isinstance(e.get("domain", ""), str):
+                    raise ExpressionError("group и domain должны быть строками")
+                gid = self.group_id(e.get("domain", ""), e["group"])
+                if gid is None:
+                    if unknown is not None:
+                        unknown.append({"group": e["group"], "domain": e.get("domain", "")})
+                    return np.zeros_like(self.all)
+                return self.bits[gid]
+            if len(e) != 1:
+                raise ExpressionError("Операция задаётся одним ключом: and, or или not")
+            op, arg = next(iter(e.items()))
+            if op == "not":
+                return np.bitwise_and(np.invert(walk(arg, depth + 1)), self.all)
+            if op in ("and", "or"):
+                if not isinstance(arg, list) or not arg:
+                    raise ExpressionError(f"Для {op} нужен непустой список операндов")
+                fn = np.bitwise_and if op == "and" else np.bitwise_or
+                acc = walk(arg[0], depth + 1).copy()
+                for sub in arg[1:]:
+                    fn(acc, walk(sub, depth + 1), out=acc)
+                return acc
+            raise ExpressionError(f"Неизвестная операция: {op}")
+
+        return walk(expr, 0)
+
+    def positions(self, bits: np.ndarray) -> np.ndarray:
+        """Позиции записей битсета в порядке вывода (по ФИО)."""
+        if not self.n:
+            return np.zeros(0, dtype=np.int64)
+        mask = np.unpackbits(bits, count=self.n).astype(bool)
+        return self.order[mask[self.order]]
+
+    def groups_of(self, pos: int) -> set[int]:
+        """Группы (gid) записи в позиции pos."""
+        lo, hi = np.searchsorted(self._row_pos, [pos, pos + 1])
+        return set(self._row_gid[lo:hi].tolist())
+
+
+def get_group_bitsets(db: Session, ds, effective: bool = False) -> GroupBitsets:
+    """Индекс битсетов снимка ds (прямое или эффективное членство), строится один раз на версию."""
+    def build():
+        q = db.query(
+            GroupMembership.record_id, GroupMembership.ad_source,
+            GroupMembership.group_key, GroupMembership.group_name,
+        )
+        if not effective:
+            q = q.filter(GroupMembership.depth == 1)
+        return GroupBitsets(ds, q.all())
+    return ds.memo(("groups.bitsets", effective), build)
+
+
+def get_listed_group_bitsets(ds) -> GroupBitsets:
+    """Индекс прямых групп по полю groups снимка: домен записи и точное имя группы (как в /tree)."""
+    def build():
+        memberships = [
+            (rid, ad_source, name, name)
+            for rid, ad_source, groups in zip(ds.ad["id"].tolist(), ds.ad["ad_source"], ds.ad["groups"])
+            if groups
+            for name in split_group_names(groups)
+        ]
+        return GroupBitsets(ds, memberships, exact=True)
+    return ds.memo("groups.bitsets.listed", build)
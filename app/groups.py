@@ -1,33 +1,34 @@
 # -*- coding: utf-8 -*-
 """API-эндпоинты для анализа групп AD."""
+import time
 from collections import defaultdict
-from fastapi import APIRouter, Depends, Query
+from typing import Any, Dict
+
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 from app.database import get_db, ADRecord
-from app.config import AD_DOMAINS
+from app.config import AD_DOMAINS, AD_SOURCE_LABELS
 from app.consolidation import load_ou_rules, compute_account_type
-from app.utils import norm, build_member_dict, sort_members
+from app.dataset import get_dataset
+from app.group_graph import split_group_names as _parse_groups, effective_members, effective_groups
+from app.group_sets import get_group_bitsets, get_listed_group_bitsets, ExpressionError
+from app.utils import norm, norm_key_login, build_member_dict, sorted_page
+from app.responses import table_response, TABLE_FORMATS
 
 router = APIRouter(prefix="/api/groups", tags=["groups"])
 
 
-def _parse_groups(raw: str) -> list[str]:
-    """Разбирает строку групп (разделитель ';') в список уникальных имён."""
-    if not raw or raw.strip() in ("", "nan", "None"):
-        return []
-    return [g.strip() for g in raw.split(";") if g.strip()]
-
-
 @router.get("/tree")
 def groups_tree(db: Session = Depends(get_db)):
     """Дерево: домен → список групп с количеством участников."""
-    records = db.query(
-        ADRecord.ad_source, ADRecord.groups
-    ).filter(ADRecord.groups != "", ADRecord.groups.isnot(None)).all()
+    ds = get_dataset(db)
+    ad = ds.ad[ds.ad["groups"] != ""]
+    counts = ds.ad_count_by_source()
 
     tree: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
-    for ad_source, groups_str in records:
+    for ad_source, groups_str in zip(ad["ad_source"], ad["groups"]):
         domain_key = ad_source or "unknown"
         for g in _parse_groups(groups_str):
             tree[domain_key][g] += 1
@@ -42,7 +43,7 @@ def groups_tree(db: Session = Depends(get_db)):
             [{"name": name, "count": cnt} for name, cnt in groups_map.items()],
             key=lambda x: x["name"].lower(),
         )
-        total_users = db.query(ADRecord).filter(ADRecord.ad_source == key).count()
+        total_users = counts.get(key, 0)
         domains.append({
             "key": key, "city": AD_DOMAINS[key],
             "groups": groups_list, "total_users": total_users,
@@ -61,22 +62,200 @@ def groups_tree(db: Session = Depends(get_db)):
 
 @router.get("/members")
 def group_members(
+    response: Response,
     group: str = Query(..., description="Имя группы"),
     domain: str = Query(..., description="Ключ домена"),
+    fmt: str = Query("rows", alias="format", pattern=TABLE_FORMATS, description="rows | columnar"),
     db: Session = Depends(get_db),
 ):
     """Список участников конкретной группы в указанном домене."""
     city = AD_DOMAINS.get(domain, domain)
-    records = db.query(ADRecord).filter(
-        ADRecord.ad_source == domain,
-        ADRecord.groups != "",
-        ADRecord.groups.isnot(None),
-    ).all()
+    ds = get_dataset(db)
+    index = get_listed_group_bitsets(ds)
+    bits = index.evaluate({"group": group, "domain": domain})
+    members = [
+        build_member_dict(ds.ad_rows[i], account_type=ds.ad_rows[i].account_type)
+        for i in index.positions(bits)
+    ]
+    return table_response(
+        {"group": group, "domain": domain, "city": city, "members": members, "count": len(members)},
+        "members", fmt, response,
+    )
+
+
+@router.get("/effective-members")
+def group_effective_members(
+    response: Response,
+    group: str = Query(..., description="Имя группы"),
+    domain: str = Query(..., description="Ключ домена"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(0, ge=0, le=5000, description="Записей на страницу (0 — все)"),
+    fmt: str = Query("rows", alias="format", pattern=TABLE_FORMATS, description="rows | columnar"),
+    db: Session = Depends(get_db),
+):
+    """
+    Участники группы с учётом вложенных групп (по замыканию, построенному при загрузке).
+    depth=1 — прямой участник, больше — через вложенные группы.
+    """
+    q = effective_members(db, domain, group)
+    count = q.count()
+    name = func.coalesce(func.nullif(ADRecord.display_name, ""), ADRecord.login)
 
     ou_rules = load_ou_rules(db)
+    members = []
+    for r, depth in sorted_page(q, ADRecord, name, page=page, page_size=page_size):
+        m = build_member_dict(
+            r, include_domain_label=AD_SOURCE_LABELS.get(r.ad_source, r.ad_source or ""),
+            account_type=compute_account_type(r.ad_source or "", norm(r.distinguished_name), ou_rules),
+        )
+        m["depth"] = depth
+        m["direct"] = depth == 1
+        members.append(m)
+
+    payload = {
+        "group": group, "domain": domain, "city": AD_DOMAINS.get(domain, domain),
+        "members": members, "count": count,
+    }
+    if page_size:
+        payload.update(page=page, page_size=page_size)
+    return table_response(payload, "members", fmt, response)
+
+
+@router.get("/effective-groups")
+def user_effective_groups(
+    login: str = Query(..., description="Логин (sAMAccountName, можно с префиксом домена)"),
+    domain: str = Query("", description="Ключ домена (по умолчанию — все домены)"),
+    db: Session = Depends(get_db),
+):
+    """Все группы учётной записи: прямые и полученные через вложенные группы."""
+    login_key = norm_key_login(login)
+    if not login_key:
+        raise HTTPException(400, "Не указан логин")
+    q = db.query(ADRecord.id, ADRecord.ad_source, ADRecord.login, ADRecord.display_name).filter(
+        ADRecord.login_key == login_key,
+    )
+    if domain:
+        q = q.filter(ADRecord.ad_source == domain)
+    accounts = q.order_by(ADRecord.ad_source, ADRecord.id).all()
+    groups = effective_groups(db, [a.id for a in accounts])
+    return {
+        "login": login,
+        "accounts": [
+            {
+                "ad_source": a.ad_source or "",
+                "domain": AD_SOURCE_LABELS.get(a.ad_source, a.ad_source or ""),
+                "login": norm(a.login),
+                "display_name": norm(a.display_name),
+                "groups": groups[a.id],
+                "direct_count": sum(1 for g in groups[a.id] if g["direct"]),
+                "total_count": len(groups[a.id]),
+            }
+            for a in accounts
+        ],
+    }
+
+
+@router.post("/query")
+def groups_query(
+    payload: Dict[str, Any] = Body(...),
+    db: Session = Depends(get_db),
+):
+    """
+    Операции над множествами участников групп (битсеты по снимку данных).
+    Тело: {"expr": {"and": [{"group": "G1", "domain": "izhevsk"}, {"not": {...}}]},
+           "effective": false, "page": 1, "page_size": 100, "format": "rows"}.
+    effective=true — с учётом вложенных групп.
+    """
+    expr = payload.get("expr")
+    effective = bool(payload.get("effective", False))
+    fmt = payload.get("format", "rows")
+    try:
+        page = int(payload.get("page", 1))
+        page_size = int(payload.get("page_size", 100))
+    except (TypeError, ValueError):
+        raise HTTPException(400, "page и page_size должны быть числами")
+    if page < 1 or not 1 <= page_size <= 1000:
+        raise HTTPException(400, "page ≥ 1, page_size — от 1 до 1000")
+    if fmt not in ("rows", "columnar"):
+        raise HTTPException(400, "format: rows или columnar")
+    if expr is None:
+        raise HTTPException(400, "Не задано выражение expr")
+
+    ds = get_dataset(db)
+    index = get_group_bitsets(db, ds, effective)
+    unknown: list[dict] = []
+    t = time.perf_counter()
+    try:
+        bits = index.evaluate(expr, unknown)
+    except ExpressionError as e:
+        raise HTTPException(400, str(e))
+    positions = index.positions(bits)
+    eval_us = int((time.perf_counter() - t) * 1_000_000)
+
+    start = (page - 1) * page_size
     members = [
-        build_member_dict(r, account_type=compute_account_type(r.ad_source or "", norm(r.distinguished_name), ou_rules))
-        for r in records if group in _parse_groups(r.groups or "")
+        build_member_dict(
+            ds.ad_rows[i], include_domain_label=AD_SOURCE_LABELS.get(ds.ad_rows[i].ad_source, ds.ad_rows[i].ad_source or ""),
+            account_type=ds.ad_rows[i].account_type,
+        )
+        for i in positions[start:start + page_size]
     ]
-    sort_members(members)
-    return {"group": group, "domain": domain, "city": city, "members": members, "count": len(members)}
+    return table_response({
+        "count": len(positions),
+        "page": page,
+        "page_size": page_size,
+        "effective": effective,
+        "unknown_groups": unknown,
+        "eval_us": eval_us,
+        "members": members,
+    }, "members", fmt)
+
+
+def _account_position(ds, login: str, domain: str) -> int:
+    """Позиция первой AD-записи с логином (и доменом, если задан) в снимке; 404, если нет."""
+    login_key = norm_key_login(login)
+    mask = ds.ad["login_key"] == login_key
+    if domain:
+        mask &= ds.ad["ad_source"] == domain
+    mask = mask.to_numpy()
+    hits = mask.nonzero()[0]
+    if not login_key or not len(hits):
+        raise HTTPException(404, f"Учётная запись не найдена: {login}")
+    return int(hits[0])
+
+
+@router.get("/compare")
+def groups_compare(
+    a: str = Query(..., description="Логин первой УЗ"),
+    b: str = Query(..., description="Логин второй УЗ"),
+    domain_a: str = Query("", description="Домен первой УЗ"),
+    domain_b: str = Query("", description="Домен второй УЗ"),
+    effective: bool = Query(False, description="С учётом вложенных групп"),
+    db: Session = Depends(get_db),
+):
+    """Сравнение доступа двух учётных записей: общие группы и группы только у одной из них."""
+    ds = get_dataset(db)
+    index = get_group_bitsets(db, ds, effective)
+    pa, pb = _account_position(ds, a, domain_a), _account_position(ds, b, domain_b)
+    ga, gb = index.groups_of(pa), index.groups_of(pb)
+
+    def listing(gids: set[int]) -> list[dict]:
+        items = [{"name": index.groups[g][1], "ad_source": index.groups[g][0]} for g in gids]
+        items.sort(key=lambda x: (x["name"].lower(), x["ad_source"]))
+        return items
+
+    def account(pos: int) -> dict:
+        r = ds.ad_rows[pos]
+        return {
+            "login": norm(r.login), "display_name": norm(r.display_name), "ad_source": r.ad_source or "",
+            "domain": AD_SOURCE_LABELS.get(r.ad_source, r.ad_source or ""),
+        }
+
+    return {
+        "effective": effective,
+        "a": account(pa),
+        "b": account(pb),
+        "common": listing(ga & gb),
+        "only_a": listing(ga - gb),
+        "only_b": listing(gb - ga),
+    }
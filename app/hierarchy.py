@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Граф подчинённости AD: построение замыкания при загрузке и запросы по нему.
+
+Рёбра берутся из ADRecord.manager (DN руководителя) и сопоставляются с
+ADRecord.dn_key по всем доменам сразу, поэтому междоменные связи тоже
+попадают в граф. Таблица manager_closure хранит все пары
+«руководитель — подчинённый» с глубиной, так что цепочка руководителей,
+все подчинённые и span of control — один индексированный запрос.
+"""
+import logging
+
+from sqlalchemy import func, case
+from sqlalchemy.orm import Session
+
+from app.database import ADRecord, ManagerClosure
+from app.config import AD_LABELS
+from app.utils import norm, norm_key_dn, enabled_str
+
+logger = logging.getLogger(__name__)
+
+
+def rebuild_manager_graph(db: Session) -> int:
+    """
+    Пересобирает manager_closure по текущим AD-записям (в той же транзакции).
+    Циклы (A → B → A) обрываются на первом повторе.
+    """
+    rows = db.query(ADRecord.id, ADRecord.dn_key, ADRecord.manager).all()
+    id_by_dn: dict[str, int] = {}
+    for rid, dn_key, _mgr in rows:
+        if dn_key:
+            id_by_dn.setdefault(dn_key, rid)
+
+    parent: dict[int, int] = {}
+    for rid, _dn, mgr in rows:
+        mgr_id = id_by_dn.get(norm_key_dn(mgr)) if mgr else None
+        if mgr_id and mgr_id != rid:
+            parent[rid] = mgr_id
+
+    closure = []
+    for rid in parent:
+        seen = {rid}
+        anc, depth = parent[rid], 1
+        while anc and anc not in seen:
+            closure.append({"ancestor_id": anc, "descendant_id": rid, "depth": depth})
+            seen.add(anc)
+            anc, depth = parent.get(anc), depth + 1
+
+    db.query(ManagerClosure).delete()
+    if closure:
+        db.bulk_insert_mappings(ManagerClosure, closure)
+    logger.info("[hierarchy] Связей руководитель→подчинённый: %d прямых, %d всего", len(parent), len(closure))
+    return len(closure)
+
+
+def person_link(r: ADRecord) -> dict:
+    """Краткая информация об AD-записи для списков руководителей/подчинённых."""
+    uuid = norm(r.staff_uuid)
+    login = norm(r.login)
+    return {
+        "key": uuid.lower() if uuid else f"_login_{login.lower()}" if login else "",
+        "login": login,
+        "display_name": norm(r.display_name),
+        "domain": AD_LABELS.get(r.ad_source, r.ad_source or ""),
+        "enabled": enabled_str(r.enabled),
+        "title": norm(r.title),
+        "department": norm(r.department),
+    }
+
+
+def manager_chains(db: Session, record_ids: list[int]) -> dict[int, list[dict]]:
+    """Цепочка руководителей (от непосредственного вверх) для каждой AD-записи."""
+    chains: dict[int, list[dict]] = {rid: [] for rid in record_ids}
+    if not record_ids:
+        return chains
+    q = db.query(ManagerClosure.descendant_id, ManagerClosure.depth, ADRecord).join(
+        ADRecord, ADRecord.id == ManagerClosure.ancestor_id,
+    ).filter(ManagerClosure.descendant_id.in_(record_ids)).order_by(ManagerClosure.depth)
+    for desc_id, depth, r in q.all():
+        chains[desc_id].append({**person_link(r), "depth": depth})
+    return chains
+
+
+def reports(db: Session, record_ids: list[int], recursive: bool = False) -> list[dict]:
+    """Подчинённые набора AD-записей: прямые или все уровни (минимальная глубина на запись)."""
+    if not record_ids:
+        return []
+    q = db.query(func.min(ManagerClosure.depth), ADRecord).join(
+        ADRecord, ADRecord.id == ManagerClosure.descendant_id,
+    ).filter(ManagerClosure.ancestor_id.in_(record_ids))
+    if not recursive:
+        q = q.filter(ManagerClosure.depth == 1)
+    rows = q.group_by(ADRecord.id).all()
+    result = [{**person_link(r), "depth": depth} for depth, r in rows]
+    result.sort(key=lambda m: (m["depth"], (m["display_name"] or m["login"]).lower()))
+    return result
+
+
+def span_of_control(db: Session, record_ids: list[int]) -> dict[int, dict]:
+    """Прямые / все подчинённые и глубина поддерева для каждой AD-записи."""
+    spans = {rid: {"direct": 0, "total": 0, "depth": 0} for rid in record_ids}
+    if not record_ids:
+        return spans
+    q = db.query(
+        ManagerClosure.ancestor_id,
+        func.sum(case((ManagerClosure.depth == 1, 1), else_=0)),
+        func.count(ManagerClosure.id),
+        func.max(ManagerClosure.depth),
+    ).filter(ManagerClosure.ancestor_id.in_(record_ids)).group_by(ManagerClosure.ancestor_id)
+    for anc_id, direct, total, depth in q.all():
+        spans[anc_id] = {"direct": int(direct or 0), "total": int(total or 0), "depth": int(depth or 0)}
+    return spans
@@ -6,7 +6,9 @@ from datetime import datetime, timezone, timedelta
 from app.config import AD_DOMAINS
 from app.database import SessionLocal, get_setting
 from app.auth import decrypt_value
-from app.utils import norm, norm_phone
+from app.utils import norm, norm_email, norm_phone, norm_fio_key, norm_key_login, norm_key_dn, norm_key_uuid
+from app.ad_flags import decode_ad_flags
+from app.metrics import ldap_duration, ldap_errors
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +33,9 @@ _AD_ATTRS = [
     "extensionAttribute1",
 ]
 
+# Атрибуты объектов групп (вложенность — по memberOf самой группы)
+_GROUP_ATTRS = ["cn", "distinguishedName", "memberOf", "description"]
+
 
 def _get_ldap_config() -> dict:
     """Возвращает LDAP-конфигурацию из БД."""
@@ -132,13 +137,45 @@ def _groups_str(member_of: list) -> str:
     return "; ".join(names)
 
 
-def sync_domain(domain_key: str) -> tuple[list[dict], str | None]:
+def _search_paged(conn, domain_key: str, search_base: str, search_filter: str, attributes: list) -> list:
+    """Поиск с постраничной выдачей (paged results control), все страницы."""
+    with ldap_duration.time(domain_key, "search"):
+        conn.search(
+            search_base=search_base,
+            search_filter=search_filter,
+            search_scope=SUBTREE,
+            attributes=attributes,
+            paged_size=1000,
+        )
+    entries = list(conn.entries)
+    cookie = conn.result.get("controls", {}).get(
+        "1.2.840.113556.1.4.319", {}
+    ).get("value", {}).get("cookie")
+    while cookie:
+        with ldap_duration.time(domain_key, "search"):
+            conn.search(
+                search_base=search_base,
+                search_filter=search_filter,
+                search_scope=SUBTREE,
+                attributes=attributes,
+                paged_size=1000,
+                paged_cookie=cookie,
+            )
+        entries.extend(conn.entries)
+        cookie = conn.result.get("controls", {}).get(
+            "1.2.840.113556.1.4.319", {}
+        ).get("value", {}).get("cookie")
+    return entries
+
+
+def sync_domain(domain_key: str) -> tuple[list[dict], list[dict], str | None]:
     """
-    Запрашивает пользователей из AD по LDAP.
-    Возвращает (rows, error) — формат rows идентичен parse_ad().
+    Запрашивает пользователей и группы из AD по LDAP.
+    Возвращает (rows, groups, error) — формат rows идентичен parse_ad(),
+    groups — строки ADGroup (memberOf групп для графа вложенности).
     """
     if not _LDAP3_AVAILABLE:
-        return [], "Библиотека ldap3 не установлена"
+        return [], [], "Библиотека ldap3 не установлена"
 
     ldap_cfg = _get_ldap_config()
     ldap_user = ldap_cfg["user"]
@@ -146,15 +183,15 @@ def sync_domain(domain_key: str) -> tuple[list[dict], str | None]:
     use_ssl = ldap_cfg["use_ssl"]
 
     if not ldap_user or not ldap_password:
-        return [], "Не заданы учётные данные LDAP в настройках"
+        return [], [], "Не заданы учётные данные LDAP в настройках"
 
     dcfg = ldap_cfg["domains"].get(domain_key)
     if not dcfg:
-        return [], f"Нет LDAP-конфигурации для домена: {domain_key}"
+        return [], [], f"Нет LDAP-конфигурации для домена: {domain_key}"
 
     server_addr = dcfg.get("server", "")
     if not server_addr:
-        return [], f"Не задан LDAP-сервер для домена {domain_key}. Настройте в Параметрах."
+        return [], [], f"Не задан LDAP-сервер для домена {domain_key}. Настройте в Параметрах."
 
     search_base = dcfg.get("search_base", "")
     city_name = AD_DOMAINS.get(domain_key, domain_key)
@@ -162,42 +199,18 @@ def sync_domain(domain_key: str) -> tuple[list[dict], str | None]:
     try:
         port = 636 if use_ssl else 389
         server = Server(server_addr, port=port, use_ssl=use_ssl, get_info=LDAP_ALL)
-        conn = Connection(server, user=ldap_user, password=ldap_password, auto_bind=True)
+        with ldap_duration.time(domain_key, "bind"):
+            conn = Connection(server, user=ldap_user, password=ldap_password, auto_bind=True)
 
         logger.info("[LDAP %s] Подключено к %s:%d, search_base=%s", domain_key, server_addr, port, search_base)
 
         try:
-            conn.search(
-                search_base=search_base,
-                search_filter="(&(objectClass=user)(objectCategory=person))",
-                search_scope=SUBTREE,
-                attributes=_AD_ATTRS,
-                paged_size=1000,
-            )
-
-            entries = list(conn.entries)
-
-            # Пагинация: дочитываем оставшиеся страницы
-            cookie = conn.result.get("controls", {}).get(
-                "1.2.840.113556.1.4.319", {}
-            ).get("value", {}).get("cookie")
-            while cookie:
-                conn.search(
-                    search_base=search_base,
-                    search_filter="(&(objectClass=user)(objectCategory=person))",
-                    search_scope=SUBTREE,
-                    attributes=_AD_ATTRS,
-                    paged_size=1000,
-                    paged_cookie=cookie,
-                )
-                entries.extend(conn.entries)
-                cookie = conn.result.get("controls", {}).get(
-                    "1.2.840.113556.1.4.319", {}
-                ).get("value", {}).get("cookie")
+            entries = _search_paged(conn, domain_key, search_base, "(&(objectClass=user)(objectCategory=person))", _AD_ATTRS)
+            group_entries = _search_paged(conn, domain_key, search_base, "(objectClass=group)", _GROUP_ATTRS)
         finally:
             conn.unbind()
 
-        logger.info("[LDAP %s] Получено записей: %d", domain_key, len(entries))
+        logger.info("[LDAP %s] Получено записей: %d, групп: %d", domain_key, len(entries), len(group_entries))
 
         rows = []
         for entry in entries:
@@ -219,35 +232,58 @@ def sync_domain(domain_key: str) -> tuple[list[dict], str | None]:
                 account_expiration_date = _filetime_to_dt(acc_raw)
                 account_expires = account_expiration_date.strftime("%d.%m.%Y") if account_expiration_date else "never"
 
-            # memberOf → groups
-            groups = _groups_str(_attr_list(entry, "memberOf"))
+            # memberOf → groups (CN для отображения) и member_of (DN для графа вложенности)
+            member_of = [str(dn) for dn in _attr_list(entry, "memberOf")]
+            groups = _groups_str(member_of)
+            display_name = norm(_attr(entry, "displayName"))
 
-            rows.append({
+            rows.append(decode_ad_flags({
                 "domain": city_name,
                 "login": norm(_attr(entry, "sAMAccountName")),
+                "login_key": norm_key_login(_attr(entry, "sAMAccountName")),
                 "enabled": enabled,
                 "password_last_set": pwd_last_set,
                 "must_change_password": must_change,
                 "account_expires": account_expires,
                 "account_expiration_date": account_expiration_date,
                 "email": norm(_attr(entry, "mail")),
+                "email_key": norm_email(_attr(entry, "mail")),
                 "phone": norm_phone(_attr(entry, "telephoneNumber")),
                 "mobile": norm_phone(_attr(entry, "mobile")),
-                "display_name": norm(_attr(entry, "displayName")),
+                "display_name": display_name,
+                "fio_key": norm_fio_key(display_name),
                 "staff_uuid": norm(_attr(entry, "extensionAttribute1")),
+                "uuid_key": norm_key_uuid(_attr(entry, "extensionAttribute1")),
                 "title": norm(_attr(entry, "title")),
                 "manager": norm(_attr(entry, "manager")),
                 "distinguished_name": norm(_attr(entry, "distinguishedName")),
+                "dn_key": norm_key_dn(_attr(entry, "distinguishedName")),
                 "company": norm(_attr(entry, "company")),
                 "department": norm(_attr(entry, "department")),
                 "location": norm(_attr(entry, "l")),
                 "employee_number": norm(_attr(entry, "employeeNumber")),
                 "info": norm(_attr(entry, "info")),
                 "groups": groups,
+                "member_of": "\n".join(member_of),
+                "user_account_control": str(uac),
+            }))
+
+        groups_rows = []
+        for entry in group_entries:
+            name = norm(_attr(entry, "cn"))
+            dn = norm(_attr(entry, "distinguishedName"))
+            groups_rows.append({
+                "name": name,
+                "name_key": name.lower(),
+                "distinguished_name": dn,
+                "dn_key": norm_key_dn(dn),
+                "description": norm(_attr(entry, "description")),
+                "member_of": "\n".join(str(p) for p in _attr_list(entry, "memberOf")),
             })
 
-        return rows, None
+        return rows, groups_rows, None
 
     except Exception as e:
+        ldap_errors.inc(domain_key)
         logger.error("[LDAP %s] Ошибка: %s", domain_key, e)
-        return [], f"LDAP-ошибка ({server_addr}): {e}"
+        return [], [], f"LDAP-ошибка ({server_addr}): {e}"
@@ -1,23 +1,30 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import io
+import json
 import logging
+import os
+import tempfile
+import time
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from typing import Dict, Any
 
 import pandas as pd
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Body
-from fastapi.responses import HTMLResponse, StreamingResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Body, Query, Request, Response
+from fastapi.responses import HTMLResponse, StreamingResponse, FileResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
 from pathlib import Path
 
 from app.database import (
-    init_db, get_db, Upload, ADRecord, MFARecord, PeopleRecord,
-    AppUser, is_auth_configured, is_ldap_configured, has_local_users,
+    init_db, get_db, get_setting, set_setting, engine, SessionLocal, Upload, ADRecord, ADGroup, MFARecord,
+    PeopleRecord, AppUser, fill_derived_keys, is_auth_configured, is_ldap_configured, has_local_users,
 )
-from app.parsers import parse_ad, parse_mfa, parse_people, get_last_parse_info
+from app.parsers import preview_upload
+from app.parse_pool import run_parser, shutdown as shutdown_parse_pool
 from app.consolidation import build_consolidated
+from app.dataset import get_dataset
 from app.ldap_sync import sync_domain as ldap_sync_domain, is_available as ldap_is_available
 from app.config import AD_DOMAINS, AD_DOMAIN_DN, MAX_UPLOAD_SIZE
 from app.auth import authenticate_ad, authenticate_local, create_jwt, get_current_user, require_admin
@@ -25,29 +32,170 @@ from app.settings_api import router as settings_router
 from app.groups import router as groups_router
 from app.structure import router as structure_router
 from app.users import router as users_router
-from app.duplicates import router as duplicates_router
+from app.duplicates import router as duplicates_router, rebuild_collisions
 from app.org import router as org_router
-from app.security import router as security_router
+from app.security import router as security_router, rebuild_age_histograms
+from app.search import router as search_router, rebuild_search_index
+from app.hierarchy import rebuild_manager_graph
+from app.group_graph import rebuild_group_graph
+from app.ingest import content_hasher, apply_rows, phase
+from app.snapshots import write_snapshot, read_snapshot, snapshot_file, is_available as snapshots_available
+from app.data_version import bump_data_version, etag_guard
+from app.responses import FastJSONResponse, CompressionMiddleware, table_response, TABLE_FORMATS
+from app import metrics
+from app.profiler import ProfilerMiddleware
 
 logger = logging.getLogger(__name__)
 
+_READ_CHUNK = 1024 * 1024
+
 
 # ─── Хелперы ────────────────────────────────────────────────
 
 DIST_DIR = Path(__file__).resolve().parent.parent / "frontend" / "dist"
 
 
-async def _read_upload(file: UploadFile) -> bytes:
-    """Читает загруженный файл с проверкой размера."""
-    content = await file.read()
-    if len(content) > MAX_UPLOAD_SIZE:
-        size_mb = len(content) / (1024 * 1024)
-        limit_mb = MAX_UPLOAD_SIZE / (1024 * 1024)
-        raise HTTPException(
-            413,
-            f"Файл слишком большой ({size_mb:.1f} МБ). Максимум: {limit_mb:.0f} МБ",
-        )
-    return content
+@asynccontextmanager
+async def _spooled_upload(file: UploadFile, stats: dict | None = None):
+    """
+    Сохраняет загруженный файл во временный файл по частям (с проверкой размера
+    и sha256 содержимого). Отдаёт (путь, хэш); файл удаляется после разбора.
+    """
+    hasher = content_hasher()
+    size = 0
+    tmp = tempfile.NamedTemporaryFile(prefix="upload-", suffix=Path(file.filename or "").suffix, delete=False)
+    try:
+        with tmp, phase({} if stats is None else stats, "receive"):
+            while chunk := await file.read(_READ_CHUNK):
+                size += len(chunk)
+                if size > MAX_UPLOAD_SIZE:
+                    limit_mb = MAX_UPLOAD_SIZE / (1024 * 1024)
+                    raise HTTPException(413, f"Файл слишком большой. Максимум: {limit_mb:.0f} МБ")
+                hasher.update(chunk)
+                tmp.write(chunk)
+        yield tmp.name, hasher.hexdigest()
+    finally:
+        os.unlink(tmp.name)
+
+
+def _unchanged_upload(db: Session, source: str, content_hash: str) -> Upload | None:
+    """Активная загрузка источника с тем же содержимым файла (повторная загрузка)."""
+    return db.query(Upload).filter(
+        Upload.source == source, Upload.active.is_(True), Upload.content_hash == content_hash,
+    ).first()
+
+
+def _unchanged_result(upload: Upload) -> dict:
+    return {
+        "ok": True, "unchanged": True, "rows": upload.row_count, "filename": upload.filename,
+        "message": f"Файл не изменился с загрузки {upload.uploaded_at:%d.%m.%Y %H:%M}, данные не перезаписаны",
+    }
+
+
+# Версия набора производных индексов. Увеличивается при добавлении нового индекса,
+# чтобы при старте он был построен для уже загруженных данных.
+INDEX_SCHEMA_VERSION = "5"
+
+
+def _replace_ad_groups(db: Session, domain_key: str, groups: list[dict]):
+    """Заменяет объекты групп домена результатом LDAP-синхронизации."""
+    db.query(ADGroup).filter(ADGroup.ad_source == domain_key).delete()
+    for g in groups:
+        g["ad_source"] = domain_key
+    if groups:
+        db.bulk_insert_mappings(ADGroup, groups)
+
+
+def _new_upload(db: Session, source: str, filename: str, rows: list[dict], content_hash: str = "") -> Upload:
+    """Регистрирует загрузку источника; прошлые загрузки остаются в каталоге неактивными."""
+    db.query(Upload).filter(Upload.source == source, Upload.active.is_(True)).update({"active": False})
+    upload = Upload(source=source, filename=filename, row_count=len(rows), content_hash=content_hash)
+    db.add(upload)
+    db.flush()
+    return upload
+
+
+def _save_telemetry(upload: Upload, stats: dict):
+    """Телеметрия загрузки в строке uploads (время по фазам — в JSON telemetry)."""
+    phases = stats.get("phases_ms", {})
+    upload.bytes_read = stats.get("bytes")
+    upload.rows_read = stats.get("rows_read", upload.row_count)
+    upload.rows_skipped = stats.get("rows_skipped", 0)
+    upload.duration_ms = round(sum(phases.values()))
+    upload.telemetry = json.dumps(stats, ensure_ascii=False, default=str)
+    metrics.observe_ingest(upload.source, stats)
+
+
+def _archive(db: Session, items: list[tuple]):
+    """
+    После фиксации данных: Parquet-снимки загрузок и их телеметрия.
+    items — [(upload, rows, модель, stats), ...].
+    """
+    for upload, rows, model, stats in items:
+        with phase(stats, "snapshot"):
+            write_snapshot(upload, rows, model)
+        _save_telemetry(upload, stats)
+    db.commit()
+
+
+def _timed_commit(db: Session, stats_list: list[dict]):
+    """Пересборка индексов и фиксация с замером (общие фазы для всех загрузок транзакции)."""
+    t = time.perf_counter()
+    _rebuild_indexes(db)
+    rebuild_ms = (time.perf_counter() - t) * 1000
+    t = time.perf_counter()
+    db.commit()
+    commit_ms = (time.perf_counter() - t) * 1000
+    for stats in stats_list:
+        phases = stats.setdefault("phases_ms", {})
+        phases["index_rebuild"] = round(rebuild_ms, 1)
+        phases["commit"] = round(commit_ms, 1)
+
+
+def _store_upload(db: Session, source: str, filename: str, rows: list[dict], model, stats: dict,
+                  content_hash: str = "", scope=None, ad_source: str | None = None) -> dict:
+    """
+    Запись разобранной загрузки: строки, пересборка индексов, фиксация и
+    Parquet-снимок. Синхронная — обработчики загрузок вызывают её через
+    asyncio.to_thread, чтобы не занимать цикл событий. Возвращает изменения.
+    """
+    try:
+        with phase(stats, "db_write"):
+            upload = _new_upload(db, source, filename, rows, content_hash)
+            for r in rows:
+                r["upload_id"] = upload.id
+                if ad_source is not None:
+                    r["ad_source"] = ad_source
+            changes = apply_rows(db, model, rows, scope)
+        _timed_commit(db, [stats])
+        bump_data_version()
+    except Exception:
+        db.rollback()
+        raise
+    stats["changes"] = changes
+    _archive(db, [(upload, rows, model, stats)])
+    return changes
+
+
+def _rebuild_indexes(db: Session):
+    """Пересобирает производные индексы после изменения данных (в той же транзакции)."""
+    rebuild_search_index(db)
+    rebuild_manager_graph(db)
+    rebuild_group_graph(db)
+    rebuild_age_histograms(db)
+    rebuild_collisions(db)
+
+
+def _ensure_indexes():
+    """При старте перестраивает индексы, если их набор изменился с прошлого запуска."""
+    db = SessionLocal()
+    try:
+        if get_setting(db, "index.schema_version") != INDEX_SCHEMA_VERSION:
+            _rebuild_indexes(db)
+            set_setting(db, "index.schema_version", INDEX_SCHEMA_VERSION)
+            db.commit()
+    finally:
+        db.close()
 
 
 # ─── Приложение ──────────────────────────────────────────────
@@ -55,17 +203,26 @@ async def _read_upload(file: UploadFile) -> bytes:
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
+    _ensure_indexes()
+    # Новый код может отдавать другие ответы — сбрасываем ETag клиентов
+    bump_data_version()
     yield
+    shutdown_parse_pool()
 
 
-app = FastAPI(title="Девелоника Пользователи", lifespan=lifespan)
+app = FastAPI(title="Девелоника Пользователи", lifespan=lifespan, default_response_class=FastJSONResponse)
+app.add_middleware(ProfilerMiddleware)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_engine(engine)
 app.include_router(settings_router)
-app.include_router(groups_router,    dependencies=[Depends(get_current_user)])
-app.include_router(structure_router, dependencies=[Depends(get_current_user)])
-app.include_router(users_router,     dependencies=[Depends(get_current_user)])
-app.include_router(duplicates_router,dependencies=[Depends(get_current_user)])
-app.include_router(org_router,       dependencies=[Depends(get_current_user)])
-app.include_router(security_router,  dependencies=[Depends(get_current_user)])
+app.include_router(groups_router,    dependencies=[Depends(get_current_user), Depends(etag_guard)])
+app.include_router(structure_router, dependencies=[Depends(get_current_user), Depends(etag_guard)])
+app.include_router(users_router,     dependencies=[Depends(get_current_user), Depends(etag_guard)])
+app.include_router(duplicates_router,dependencies=[Depends(get_current_user), Depends(etag_guard)])
+app.include_router(org_router,       dependencies=[Depends(get_current_user), Depends(etag_guard)])
+app.include_router(security_router,  dependencies=[Depends(get_current_user), Depends(etag_guard)])
+app.include_router(search_router,    dependencies=[Depends(get_current_user), Depends(etag_guard)])
 
 _assets_dir = DIST_DIR / "assets"
 if _assets_dir.exists():
@@ -175,31 +332,27 @@ async def upload_ad(domain_key: str, file: UploadFile = File(...), db: Session =
     city_name = AD_DOMAINS[domain_key]
     if not file.filename:
         raise HTTPException(400, "Нет имени файла")
-    content = await _read_upload(file)
-    dn_suffix = AD_DOMAIN_DN.get(domain_key, "")
-    rows, err, skipped = parse_ad(content, file.filename, override_domain=city_name, expected_dn_suffix=dn_suffix)
+    stats = {}
+    async with _spooled_upload(file, stats) as (path, content_hash):
+        prev = _unchanged_upload(db, f"ad_{domain_key}", content_hash)
+        if prev:
+            return {**_unchanged_result(prev), "domain": city_name}
+        dn_suffix = AD_DOMAIN_DN.get(domain_key, "")
+        rows, err, skipped = await run_parser(
+            "ad", path, file.filename, stats=stats, override_domain=city_name, expected_dn_suffix=dn_suffix,
+        )
     if err:
         raise HTTPException(400, f"Ошибка разбора файла: {err}")
     if not rows and skipped > 0:
         raise HTTPException(400, f"В файле нет записей для домена {city_name} (отфильтровано {skipped} записей других доменов)")
 
-    # Удаляем только записи этого домена
-    try:
-        db.query(ADRecord).filter(ADRecord.ad_source == domain_key).delete()
-        db.query(Upload).filter(Upload.source == f"ad_{domain_key}").delete()
-        upload = Upload(source=f"ad_{domain_key}", filename=file.filename, row_count=len(rows))
-        db.add(upload)
-        db.flush()
-        for r in rows:
-            r["upload_id"] = upload.id
-            r["ad_source"] = domain_key
-        db.bulk_insert_mappings(ADRecord, rows)
-        db.commit()
-    except Exception:
-        db.rollback()
-        raise
+    # Меняются только записи этого домена, отличающиеся от загруженных
+    changes = await asyncio.to_thread(
+        _store_upload, db, f"ad_{domain_key}", file.filename, rows, ADRecord, stats, content_hash,
+        ADRecord.ad_source == domain_key, domain_key,
+    )
 
-    result = {"ok": True, "rows": len(rows), "filename": file.filename, "domain": city_name}
+    result = {"ok": True, "rows": len(rows), "filename": file.filename, "domain": city_name, "changes": changes}
     if skipped > 0:
         result["skipped"] = skipped
         result["message"] = f"Загружено {len(rows)} записей {city_name}, пропущено {skipped} записей других доменов"
@@ -210,51 +363,77 @@ async def upload_ad(domain_key: str, file: UploadFile = File(...), db: Session =
 async def upload_mfa(file: UploadFile = File(...), db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
     if not file.filename:
         raise HTTPException(400, "Нет имени файла")
-    content = await _read_upload(file)
-    rows, err = parse_mfa(content, file.filename)
+    stats = {}
+    async with _spooled_upload(file, stats) as (path, content_hash):
+        prev = _unchanged_upload(db, "mfa", content_hash)
+        if prev:
+            return _unchanged_result(prev)
+        rows, err = await run_parser("mfa", path, file.filename, stats=stats)
     if err:
         raise HTTPException(400, f"Ошибка разбора файла: {err}")
-    try:
-        db.query(MFARecord).delete()
-        db.query(Upload).filter(Upload.source == "mfa").delete()
-        upload = Upload(source="mfa", filename=file.filename, row_count=len(rows))
-        db.add(upload)
-        db.flush()
-        for r in rows:
-            r["upload_id"] = upload.id
-        db.bulk_insert_mappings(MFARecord, rows)
-        db.commit()
-    except Exception:
-        db.rollback()
-        raise
-    return {"ok": True, "rows": len(rows), "filename": file.filename}
+    changes = await asyncio.to_thread(_store_upload, db, "mfa", file.filename, rows, MFARecord, stats, content_hash)
+    return {"ok": True, "rows": len(rows), "filename": file.filename, "changes": changes}
 
 
 @app.post("/api/upload/people")
 async def upload_people(file: UploadFile = File(...), db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
     if not file.filename:
         raise HTTPException(400, "Нет имени файла")
-    content = await _read_upload(file)
-    rows, err = parse_people(content, file.filename)
+    stats = {}
+    async with _spooled_upload(file, stats) as (path, content_hash):
+        prev = _unchanged_upload(db, "people", content_hash)
+        if prev:
+            return _unchanged_result(prev)
+        rows, err = await run_parser("people", path, file.filename, stats=stats)
     if err:
         raise HTTPException(400, f"Ошибка разбора файла: {err}")
-    try:
-        db.query(PeopleRecord).delete()
-        db.query(Upload).filter(Upload.source == "people").delete()
-        upload = Upload(source="people", filename=file.filename, row_count=len(rows))
-        db.add(upload)
-        db.flush()
-        for r in rows:
-            r["upload_id"] = upload.id
-        db.bulk_insert_mappings(PeopleRecord, rows)
-        db.commit()
-    except Exception:
-        db.rollback()
-        raise
-    return {"ok": True, "rows": len(rows), "filename": file.filename}
+    changes = await asyncio.to_thread(_store_upload, db, "people", file.filename, rows, PeopleRecord, stats, content_hash)
+    return {"ok": True, "rows": len(rows), "filename": file.filename, "changes": changes}
+
+
+@app.post("/api/upload/{source}/preview")
+async def upload_preview(
+    source: str,
+    file: UploadFile = File(...),
+    nrows: int = Query(1000, ge=1, le=20000, description="Строк файла для оценки"),
+    sample: int = Query(20, ge=1, le=200, description="Нормализованных строк в ответе"),
+    db: Session = Depends(get_db),
+    _u: dict = Depends(require_admin),
+):
+    """
+    Пробный разбор файла без записи в БД (source: ad_<домен>, mfa, people):
+    сопоставление колонок, доля записей, проходящих фильтр по DN-суффиксу,
+    и образец нормализованных строк. Читаются только первые nrows строк.
+    """
+    kwargs = {}
+    if source.startswith("ad_") and source[3:] in AD_DOMAINS:
+        kind, domain_key = "ad", source[3:]
+        kwargs = {"override_domain": AD_DOMAINS[domain_key], "expected_dn_suffix": AD_DOMAIN_DN.get(domain_key, "")}
+    elif source in ("mfa", "people"):
+        kind = source
+    else:
+        raise HTTPException(400, f"Неизвестный источник: {source}")
+    if not file.filename:
+        raise HTTPException(400, "Нет имени файла")
+
+    t = time.perf_counter()
+    async with _spooled_upload(file) as (path, content_hash):
+        size = os.path.getsize(path)
+        try:
+            preview = await asyncio.to_thread(preview_upload, kind, path, file.filename, nrows, sample, **kwargs)
+        except Exception as e:
+            raise HTTPException(400, f"Ошибка разбора файла: {e}")
+    return {
+        "source": source, "filename": file.filename, "bytes": size,
+        "unchanged": _unchanged_upload(db, source, content_hash) is not None,
+        **preview,
+        "elapsed_ms": round((time.perf_counter() - t) * 1000, 1),
+    }
 
 
 # ─── Синхронизация из AD по LDAP ─────────────────────────────
+# Обработчики синхронизации и восстановления — обычные def: LDAP и запись
+# в БД блокирующие, FastAPI выполняет их в пуле потоков.
 
 @app.get("/api/sync/status")
 async def sync_status(_u: dict = Depends(get_current_user)):
@@ -263,96 +442,241 @@ async def sync_status(_u: dict = Depends(get_current_user)):
 
 
 @app.post("/api/sync/ad/{domain_key}")
-async def sync_ad_domain(domain_key: str, db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
+def sync_ad_domain(domain_key: str, db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
     """Синхронизирует один домен AD по LDAP."""
     if domain_key not in AD_DOMAINS:
         raise HTTPException(400, f"Неизвестный домен: {domain_key}")
     city_name = AD_DOMAINS[domain_key]
 
-    rows, err = ldap_sync_domain(domain_key)
+    stats = {}
+    with phase(stats, "ldap"):
+        rows, groups, err = ldap_sync_domain(domain_key)
     if err:
         raise HTTPException(400, f"Ошибка синхронизации {city_name}: {err}")
     if not rows:
         raise HTTPException(400, f"Нет записей для домена {city_name}")
 
     try:
-        db.query(ADRecord).filter(ADRecord.ad_source == domain_key).delete()
-        db.query(Upload).filter(Upload.source == f"ad_{domain_key}").delete()
-        upload = Upload(source=f"ad_{domain_key}", filename="LDAP sync", row_count=len(rows))
-        db.add(upload)
-        db.flush()
-        for r in rows:
-            r["upload_id"] = upload.id
-            r["ad_source"] = domain_key
-        db.bulk_insert_mappings(ADRecord, rows)
-        db.commit()
+        with phase(stats, "db_write"):
+            upload = _new_upload(db, f"ad_{domain_key}", "LDAP sync", rows)
+            for r in rows:
+                r["upload_id"] = upload.id
+                r["ad_source"] = domain_key
+            changes = apply_rows(db, ADRecord, rows, ADRecord.ad_source == domain_key)
+            _replace_ad_groups(db, domain_key, groups)
+        _timed_commit(db, [stats])
+        bump_data_version()
     except Exception:
         db.rollback()
         raise
+    stats["changes"] = changes
+    _archive(db, [(upload, rows, ADRecord, stats)])
 
-    return {"ok": True, "rows": len(rows), "domain": city_name, "source": "ldap"}
+    return {"ok": True, "rows": len(rows), "domain": city_name, "source": "ldap", "changes": changes}
 
 
 @app.post("/api/sync/ad")
-async def sync_ad_all(db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
+def sync_ad_all(db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
     """Синхронизирует все настроенные домены AD по LDAP."""
     results = {}
     errors = []
+    archive = []
     for domain_key, city_name in AD_DOMAINS.items():
         cfg = (ldap_is_available()).get("domains", {}).get(domain_key, {})
         if not cfg.get("configured"):
             results[domain_key] = {"city": city_name, "skipped": True, "reason": "Сервер не настроен"}
             continue
 
-        rows, err = ldap_sync_domain(domain_key)
+        stats = {}
+        with phase(stats, "ldap"):
+            rows, groups, err = ldap_sync_domain(domain_key)
         if err:
             results[domain_key] = {"city": city_name, "error": err}
             errors.append(f"{city_name}: {err}")
             continue
 
-        db.query(ADRecord).filter(ADRecord.ad_source == domain_key).delete()
-        db.query(Upload).filter(Upload.source == f"ad_{domain_key}").delete()
-        upload = Upload(source=f"ad_{domain_key}", filename="LDAP sync", row_count=len(rows))
-        db.add(upload)
-        db.flush()
-        for r in rows:
-            r["upload_id"] = upload.id
-            r["ad_source"] = domain_key
-        db.bulk_insert_mappings(ADRecord, rows)
+        with phase(stats, "db_write"):
+            upload = _new_upload(db, f"ad_{domain_key}", "LDAP sync", rows)
+            for r in rows:
+                r["upload_id"] = upload.id
+                r["ad_source"] = domain_key
+            changes = apply_rows(db, ADRecord, rows, ADRecord.ad_source == domain_key)
+            _replace_ad_groups(db, domain_key, groups)
+        stats["changes"] = changes
+        archive.append((upload, rows, ADRecord, stats))
 
-        results[domain_key] = {"city": city_name, "rows": len(rows)}
+        results[domain_key] = {"city": city_name, "rows": len(rows), "changes": changes}
 
     try:
-        db.commit()
+        _timed_commit(db, [item[3] for item in archive])
+        bump_data_version()
     except Exception:
         db.rollback()
         raise
+    _archive(db, archive)
     return {"ok": not errors, "domains": results, "errors": errors}
 
 
+# ─── Архив загрузок ─────────────────────────────────────────
+
+def _upload_model(source: str):
+    if source.startswith("ad_"):
+        return ADRecord
+    return {"mfa": MFARecord, "people": PeopleRecord}.get(source)
+
+
+def _upload_dict(u: Upload) -> dict:
+    return {
+        "id": u.id, "source": u.source, "filename": u.filename,
+        "uploaded_at": u.uploaded_at.isoformat() if u.uploaded_at else None,
+        "rows": u.row_count, "active": bool(u.active),
+        "snapshot": bool(u.snapshot_path), "snapshot_bytes": u.snapshot_bytes,
+        "bytes": u.bytes_read, "rows_read": u.rows_read, "rows_skipped": u.rows_skipped,
+        "duration_ms": u.duration_ms,
+    }
+
+
+def _telemetry(u: Upload) -> dict:
+    try:
+        return json.loads(u.telemetry) if u.telemetry else {}
+    except ValueError:
+        return {}
+
+
+@app.get("/api/uploads")
+async def list_uploads(
+    source: str = Query("", description="Источник: ad_<домен>, mfa, people"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db),
+    _u: dict = Depends(require_admin),
+):
+    """Каталог загрузок и их Parquet-снимков (новые сверху)."""
+    q = db.query(Upload)
+    if source:
+        q = q.filter(Upload.source == source)
+    count = q.count()
+    items = q.order_by(Upload.uploaded_at.desc(), Upload.id.desc()).offset((page - 1) * page_size).limit(page_size).all()
+    return {
+        "uploads": [_upload_dict(u) for u in items], "count": count,
+        "page": page, "page_size": page_size, "snapshots": snapshots_available(),
+    }
+
+
+@app.get("/api/uploads/telemetry")
+async def uploads_telemetry(
+    source: str = Query("", description="Источник: ad_<домен>, mfa, people"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    _u: dict = Depends(require_admin),
+):
+    """
+    История телеметрии загрузок (от старых к новым): объём, строки и время
+    по фазам — receive, read, map, normalize, transfer, ldap, db_write,
+    index_rebuild, commit, snapshot.
+    """
+    q = db.query(Upload).filter(Upload.telemetry != "")
+    if source:
+        q = q.filter(Upload.source == source)
+    items = q.order_by(Upload.uploaded_at.desc(), Upload.id.desc()).limit(limit).all()
+    history, phases = [], []
+    for u in reversed(items):
+        t = _telemetry(u)
+        for name in t.get("phases_ms", {}):
+            if name not in phases:
+                phases.append(name)
+        history.append({
+            **_upload_dict(u),
+            "phases_ms": t.get("phases_ms", {}),
+            "changes": t.get("changes"),
+        })
+    return {"phases": phases, "history": history}
+
+
+def _get_snapshot_upload(db: Session, upload_id: int) -> Upload:
+    upload = db.get(Upload, upload_id)
+    if not upload:
+        raise HTTPException(404, "Загрузка не найдена")
+    if snapshot_file(upload) is None:
+        raise HTTPException(404, "Снимок загрузки отсутствует")
+    return upload
+
+
+@app.get("/api/uploads/{upload_id}/snapshot")
+async def download_snapshot(upload_id: int, db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
+    """Parquet-файл снимка загрузки."""
+    path = snapshot_file(_get_snapshot_upload(db, upload_id))
+    return FileResponse(str(path), media_type="application/vnd.apache.parquet", filename=path.name)
+
+
+@app.post("/api/uploads/{upload_id}/restore")
+def restore_upload(upload_id: int, db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
+    """Повторный импорт источника из снимка загрузки (без разбора исходного файла)."""
+    upload = _get_snapshot_upload(db, upload_id)
+    model = _upload_model(upload.source)
+    if model is None:
+        raise HTTPException(400, f"Неизвестный источник: {upload.source}")
+    if not snapshots_available():
+        raise HTTPException(500, "pyarrow не установлена")
+    stats = {}
+    try:
+        with phase(stats, "snapshot_read"):
+            rows = read_snapshot(upload)
+    except Exception as e:
+        raise HTTPException(400, f"Ошибка чтения снимка: {e}")
+
+    try:
+        with phase(stats, "db_write"):
+            db.query(Upload).filter(Upload.source == upload.source, Upload.id != upload.id).update({"active": False})
+            upload.active = True
+            fill_derived_keys(model, rows)
+            for r in rows:
+                r["upload_id"] = upload.id
+            scope = ADRecord.ad_source == upload.source[3:] if model is ADRecord else None
+            changes = apply_rows(db, model, rows, scope)
+        _timed_commit(db, [stats])
+        bump_data_version()
+    except Exception:
+        db.rollback()
+        raise
+    # Телеметрия восстановления заменяет телеметрию исходной загрузки (как у повторной загрузки)
+    stats["changes"] = changes
+    _save_telemetry(upload, stats)
+    db.commit()
+    logger.info("[uploads] Загрузка %d восстановлена из снимка: %s", upload.id, stats)
+    return {"ok": True, "rows": len(rows), "upload": _upload_dict(upload), "changes": changes}
+
+
 # ─── Сводная ────────────────────────────────────────────────
 
-@app.get("/api/consolidated")
-async def get_consolidated(db: Session = Depends(get_db), _u: dict = Depends(get_current_user)):
-    rows = build_consolidated(db)
-    return {"rows": rows, "total": len(rows)}
+@app.get("/api/consolidated", dependencies=[Depends(etag_guard)])
+async def get_consolidated(
+    response: Response,
+    fmt: str = Query("rows", alias="format", pattern=TABLE_FORMATS, description="rows | columnar"),
+    db: Session = Depends(get_db),
+    _u: dict = Depends(get_current_user),
+):
+    ds = get_dataset(db)
+    with metrics.pipeline_duration.time("consolidated"):
+        rows = build_consolidated(ds)
+    return table_response({"rows": rows, "total": len(rows)}, "rows", fmt, response)
 
 
 # ─── Статистика ─────────────────────────────────────────────
 
-@app.get("/api/stats")
+@app.get("/api/stats", dependencies=[Depends(etag_guard)])
 async def get_stats(db: Session = Depends(get_db), _u: dict = Depends(get_current_user)):
     mfa = db.query(MFARecord).count()
     people = db.query(PeopleRecord).count()
-    last_mfa = db.query(Upload).filter(Upload.source == "mfa").order_by(Upload.uploaded_at.desc()).first()
-    last_people = db.query(Upload).filter(Upload.source == "people").order_by(Upload.uploaded_at.desc()).first()
+    last_mfa = db.query(Upload).filter(Upload.source == "mfa", Upload.active.is_(True)).order_by(Upload.uploaded_at.desc()).first()
+    last_people = db.query(Upload).filter(Upload.source == "people", Upload.active.is_(True)).order_by(Upload.uploaded_at.desc()).first()
 
     ad_info = {}
     ad_total = 0
     for key, city in AD_DOMAINS.items():
         cnt = db.query(ADRecord).filter(ADRecord.ad_source == key).count()
         ad_total += cnt
-        last = db.query(Upload).filter(Upload.source == f"ad_{key}").order_by(Upload.uploaded_at.desc()).first()
+        last = db.query(Upload).filter(Upload.source == f"ad_{key}", Upload.active.is_(True)).order_by(Upload.uploaded_at.desc()).first()
         ad_info[key] = {
             "city": city, "rows": cnt,
             "last": {"filename": last.filename, "at": last.uploaded_at.isoformat(), "rows": last.row_count} if last else None,
@@ -369,18 +693,23 @@ async def get_stats(db: Session = Depends(get_db), _u: dict = Depends(get_curren
 
 
 # ─── Очистка БД ─────────────────────────────────────────────
+# Обычные def: удаление и пересборка индексов блокирующие, FastAPI выполняет
+# их в пуле потоков.
 
 @app.delete("/api/clear/all")
-async def clear_all(db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
+def clear_all(db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
     ad = db.query(ADRecord).count()
     mfa = db.query(MFARecord).count()
     people = db.query(PeopleRecord).count()
     try:
         db.query(ADRecord).delete()
+        db.query(ADGroup).delete()
         db.query(MFARecord).delete()
         db.query(PeopleRecord).delete()
-        db.query(Upload).delete()
+        db.query(Upload).update({"active": False})
+        _rebuild_indexes(db)
         db.commit()
+        bump_data_version()
     except Exception:
         db.rollback()
         raise
@@ -388,31 +717,38 @@ async def clear_all(db: Session = Depends(get_db), _u: dict = Depends(require_ad
 
 
 @app.delete("/api/clear/ad/{domain_key}")
-async def clear_ad(domain_key: str, db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
+def clear_ad(domain_key: str, db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
     if domain_key not in AD_DOMAINS:
         raise HTTPException(400, f"Неизвестный домен: {domain_key}")
     count = db.query(ADRecord).filter(ADRecord.ad_source == domain_key).count()
     db.query(ADRecord).filter(ADRecord.ad_source == domain_key).delete()
-    db.query(Upload).filter(Upload.source == f"ad_{domain_key}").delete()
+    db.query(ADGroup).filter(ADGroup.ad_source == domain_key).delete()
+    db.query(Upload).filter(Upload.source == f"ad_{domain_key}").update({"active": False})
+    _rebuild_indexes(db)
     db.commit()
+    bump_data_version()
     return {"ok": True, "deleted": count, "domain": AD_DOMAINS[domain_key]}
 
 
 @app.delete("/api/clear/mfa")
-async def clear_mfa(db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
+def clear_mfa(db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
     count = db.query(MFARecord).count()
     db.query(MFARecord).delete()
-    db.query(Upload).filter(Upload.source == "mfa").delete()
+    db.query(Upload).filter(Upload.source == "mfa").update({"active": False})
+    _rebuild_indexes(db)
     db.commit()
+    bump_data_version()
     return {"ok": True, "deleted": count}
 
 
 @app.delete("/api/clear/people")
-async def clear_people(db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
+def clear_people(db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
     count = db.query(PeopleRecord).count()
     db.query(PeopleRecord).delete()
-    db.query(Upload).filter(Upload.source == "people").delete()
+    db.query(Upload).filter(Upload.source == "people").update({"active": False})
+    _rebuild_indexes(db)
     db.commit()
+    bump_data_version()
     return {"ok": True, "deleted": count}
 
 
@@ -421,7 +757,9 @@ async def clear_people(db: Session = Depends(get_db), _u: dict = Depends(require
 @app.get("/api/export/xlsx")
 async def export_xlsx(db: Session = Depends(get_db), _u: dict = Depends(get_current_user)):
     """Выгружает сводную таблицу в Excel (все данные)."""
-    rows = build_consolidated(db)
+    ds = get_dataset(db)
+    with metrics.pipeline_duration.time("consolidated"):
+        rows = build_consolidated(ds)
     if not rows:
         raise HTTPException(400, "Нет данных для выгрузки")
 
@@ -490,8 +828,28 @@ async def export_table(payload: Dict[str, Any] = Body(...), _u: dict = Depends(g
 # ─── Диагностика ────────────────────────────────────────────
 
 @app.get("/api/debug/columns")
-async def debug_columns(_u: dict = Depends(require_admin)):
-    return get_last_parse_info()
+async def debug_columns(db: Session = Depends(get_db), _u: dict = Depends(require_admin)):
+    """Колонки последнего разбора каждого источника (из телеметрии загрузок)."""
+    result = {}
+    for u in db.query(Upload).filter(Upload.telemetry != "").order_by(Upload.uploaded_at.desc(), Upload.id.desc()):
+        kind = "ad" if u.source.startswith("ad_") else u.source
+        parse = _telemetry(u).get("parse")
+        if parse and kind not in result:
+            result[kind] = {**parse, "rows": u.row_count, "source": u.source, "upload_id": u.id}
+        if len(result) == 3:
+            break
+    return result
+
+
+# ─── Метрики ───────────────────────────────────────────────
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    """Метрики процесса в формате Prometheus (опрос с localhost или по METRICS_TOKEN)."""
+    client = request.client.host if request.client else None
+    if not metrics.scrape_allowed(client, request.headers.get("authorization", "")):
+        raise HTTPException(403, "Доступ к метрикам запрещён")
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 # ─── SPA catch-all ────────────────────────────────────────────
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""Метрики процесса в текстовом формате Prometheus (GET /metrics).
+
+Без внешних зависимостей и сервисов: счётчики и гистограммы хранятся в
+памяти процесса API и отдаются при опросе. Собираются:
+
+  - usersbi_http_request_duration_seconds — время ответа по роутеру
+    (users, groups, structure, org, security, duplicates, consolidated,
+    export, …), методу и коду ответа;
+  - usersbi_db_query_duration_seconds — запросы к БД по типу (select,
+    insert, …), через события SQLAlchemy;
+  - usersbi_pipeline_duration_seconds — сборка снимка данных и сводной;
+  - usersbi_ingest_phase_duration_seconds — фазы загрузок (из телеметрии);
+  - usersbi_ldap_request_duration_seconds — обращения к LDAP по домену;
+  - usersbi_cache_requests_total / usersbi_cache_hit_ratio — попадания
+    в кэши (снимок данных, memo снимка, cached_by_version, ETag).
+
+Значения — с момента запуска процесса (при нескольких воркерах uvicorn
+каждый отдаёт свои).
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import METRICS_TOKEN
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы гистограмм (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+PIPELINE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_LOOPBACK = {"127.0.0.1", "::1", "localhost"}
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Монотонный счётчик."""
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in items
+        ]
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами (сумма, число, счётчики по корзинам)."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][i] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, *labels)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self._values.items())
+        lines = self._header()
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_number(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+_REGISTRY: list[_Metric] = []
+
+http_duration = Histogram(
+    "usersbi_http_request_duration_seconds", "Время обработки HTTP-запроса",
+    ("router", "method", "status"), LATENCY_BUCKETS,
+)
+db_query_duration = Histogram(
+    "usersbi_db_query_duration_seconds", "Время выполнения запроса к БД",
+    ("operation",), QUERY_BUCKETS,
+)
+pipeline_duration = Histogram(
+    "usersbi_pipeline_duration_seconds", "Время этапов обработки данных (снимок, сводная)",
+    ("stage",), PIPELINE_BUCKETS,
+)
+ingest_phase_duration = Histogram(
+    "usersbi_ingest_phase_duration_seconds", "Время фаз загрузки источника",
+    ("source", "phase"), PIPELINE_BUCKETS,
+)
+ldap_duration = Histogram(
+    "usersbi_ldap_request_duration_seconds", "Время обращения к LDAP-серверу",
+    ("domain", "operation"), LATENCY_BUCKETS,
+)
+ldap_errors = Counter("usersbi_ldap_errors_total", "Ошибки синхронизации LDAP", ("domain",))
+cache_requests = Counter("usersbi_cache_requests_total", "Обращения к кэшам", ("cache", "result"))
+
+
+def cache_hit(cache: str, hit: bool):
+    cache_requests.inc(cache, "hit" if hit else "miss")
+
+
+def observe_ingest(source: str, stats: dict):
+    """Фазы загрузки из телеметрии (stats["phases_ms"])."""
+    for name, ms in stats.get("phases_ms", {}).items():
+        ingest_phase_duration.observe(ms / 1000, source, name)
+
+
+def _cache_ratios() -> list[str]:
+    caches = sorted({k[0] for k in list(cache_requests._values)})
+    lines = [
+        "# HELP usersbi_cache_hit_ratio Доля попаданий в кэш с момента запуска",
+        "# TYPE usersbi_cache_hit_ratio gauge",
+    ]
+    for cache in caches:
+        hits, misses = cache_requests.value(cache, "hit"), cache_requests.value(cache, "miss")
+        if hits + misses:
+            lines.append(f'usersbi_cache_hit_ratio{{cache="{_escape(cache)}"}} {_number(hits / (hits + misses))}')
+    return lines
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus 0.0.4."""
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(_cache_ratios())
+    return "\n".join(lines) + "\n"
+
+
+def scrape_allowed(client_host: str | None, authorization: str) -> bool:
+    """Опрос разрешён с локального адреса или (если задан METRICS_TOKEN) по токену."""
+    if METRICS_TOKEN:
+        return authorization == f"Bearer {METRICS_TOKEN}"
+    return client_host in _LOOPBACK
+
+
+# ─── База данных ────────────────────────────────────────────
+
+def instrument_engine(engine):
+    """Замер запросов SQLAlchemy (before/after_cursor_execute)."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("metrics_started")
+        if not started:
+            return
+        operation = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "other"
+        if operation not in ("select", "insert", "update", "delete"):
+            operation = "other"
+        db_query_duration.observe(time.perf_counter() - started.pop(), operation)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        started = context.connection.info.get("metrics_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+
+# ─── HTTP ───────────────────────────────────────────────────
+
+def _router(scope: Scope) -> str:
+    """/api/users/... → users; прочие маршруты (SPA, статика, /metrics) → other."""
+    route = scope.get("route")
+    path = getattr(route, "path", "") or ""
+    if path.startswith("/api/"):
+        return path.split("/")[2] or "other"
+    return "other"
+
+
+class MetricsMiddleware:
+    """Время ответа по роутеру: от получения запроса до отправки последнего байта."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if status == 304:
+                cache_hit("etag", True)
+            elif Headers(scope=scope).get("if-none-match"):
+                cache_hit("etag", False)
+            http_duration.observe(time.perf_counter() - started, _router(scope), scope["method"], str(status))
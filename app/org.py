@@ -1,86 +1,105 @@
 # -*- coding: utf-8 -*-
-"""API-эндпоинты для модуля «Организация» (Company → Department → пользователи)."""
-from collections import defaultdict
-from fastapi import APIRouter, Depends, Query
+"""API-эндпоинты для модуля «Организация» (Company → Department → пользователи).
+
+Дерево — один GROUP BY company, department по AD-записям (значения
+нормализуются при загрузке, флаг активности — enabled_flag), результат
+кэшируется до следующего изменения данных. Список участников фильтруется
+в SQL; сортируются только (id, ключ), полные записи читаются для страницы.
+"""
+from fastapi import APIRouter, Depends, Query, Response
+from sqlalchemy import func, case
 from sqlalchemy.orm import Session
 
 from app.database import get_db, ADRecord
 from app.config import AD_SOURCE_LABELS
 from app.consolidation import load_ou_rules, compute_account_type
-from app.utils import norm, enabled_str, build_member_dict, sort_members
+from app.data_version import cached_by_version
+from app.utils import norm, build_member_dict, sorted_page
+from app.responses import table_response, TABLE_FORMATS
 
 router = APIRouter(prefix="/api/org", tags=["org"])
 
+_NO_COMPANY = "(без компании)"
+_NO_DEPARTMENT = "(без отдела)"
+
+# Поле сортировки участников → выражение (по умолчанию — ФИО, при его отсутствии логин);
+# строки сравниваются без учёта регистра (utils.sorted_page)
+_SORT_COLUMNS = {
+    "display_name": func.coalesce(func.nullif(ADRecord.display_name, ""), ADRecord.login),
+    "login": ADRecord.login,
+    "email": ADRecord.email,
+    "domain": ADRecord.ad_source,
+    "enabled": ADRecord.enabled_flag,
+    "password_last_set": ADRecord.password_last_set,
+    "title": ADRecord.title,
+    "department": ADRecord.department,
+    "company": ADRecord.company,
+    "location": ADRecord.location,
+}
+_SORT_FIELDS = "^(" + "|".join(_SORT_COLUMNS) + ")$"
 
-@router.get("/tree")
-def org_tree(db: Session = Depends(get_db)):
-    """
-    Дерево: company → department (со всех доменов, без группировки по домену).
-    Возвращает count (всего) и enabled_count (активных) для каждого узла.
-    """
-    records = db.query(
-        ADRecord.ad_source, ADRecord.company, ADRecord.department, ADRecord.enabled
-    ).all()
 
-    # company → department → {count, enabled_count}
-    tree: dict[str, dict[str, dict[str, int]]] = defaultdict(
-        lambda: defaultdict(lambda: {"count": 0, "enabled_count": 0})
-    )
+def _build_tree(db: Session) -> dict:
+    rows = db.query(
+        ADRecord.company, ADRecord.department,
+        func.count(ADRecord.id),
+        func.sum(case((ADRecord.enabled_flag.is_(True), 1), else_=0)),
+    ).group_by(ADRecord.company, ADRecord.department).all()
 
-    for ad_source, company, department, enabled_val in records:
-        comp = norm(company) or "(без компании)"
-        dept = norm(department) or "(без отдела)"
-        tree[comp][dept]["count"] += 1
-        if enabled_str(enabled_val) == "Да":
-            tree[comp][dept]["enabled_count"] += 1
+    # company → department → {name, count, enabled_count}
+    tree: dict[str, dict[str, dict]] = {}
+    total = 0
+    for comp, dept, count, enabled_count in rows:
+        total += count
+        name = dept or _NO_DEPARTMENT
+        node = tree.setdefault(comp or _NO_COMPANY, {}).setdefault(
+            name, {"name": name, "count": 0, "enabled_count": 0},
+        )
+        node["count"] += int(count)
+        node["enabled_count"] += int(enabled_count or 0)
 
     companies = []
     for comp_name in sorted(tree.keys(), key=str.lower):
-        depts = tree[comp_name]
-        dept_list = sorted(
-            [
-                {
-                    "name": d,
-                    "count": info["count"],
-                    "enabled_count": info["enabled_count"],
-                }
-                for d, info in depts.items()
-            ],
-            key=lambda x: x["name"].lower(),
-        )
+        dept_list = sorted(tree[comp_name].values(), key=lambda x: x["name"].lower())
         companies.append({
             "name": comp_name,
             "departments": dept_list,
             "count": sum(d["count"] for d in dept_list),
             "enabled_count": sum(d["enabled_count"] for d in dept_list),
         })
-
-    total = db.query(ADRecord).count()
     return {"companies": companies, "total_users": total}
 
 
+@router.get("/tree")
+def org_tree(db: Session = Depends(get_db)):
+    """
+    Дерево: company → department (со всех доменов, без группировки по домену).
+    Возвращает count (всего) и enabled_count (активных) для каждого узла.
+    """
+    return cached_by_version("org.tree", lambda: _build_tree(db))
+
+
 @router.get("/members")
 def org_members(
+    response: Response,
     company: str = Query("", description="Компания"),
     department: str = Query("", description="Отдел"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(0, ge=0, le=5000, description="Записей на страницу (0 — все)"),
+    sort: str = Query("display_name", pattern=_SORT_FIELDS, description="Поле сортировки"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    fmt: str = Query("rows", alias="format", pattern=TABLE_FORMATS, description="rows | columnar"),
     db: Session = Depends(get_db),
 ):
-    """Список пользователей по компании и/или отделу."""
+    """Список пользователей по компании и/или отделу (страница, сортировка)."""
     q = db.query(ADRecord)
-
     if company:
-        if company == "(без компании)":
-            q = q.filter((ADRecord.company == "") | (ADRecord.company.is_(None)))
-        else:
-            q = q.filter(ADRecord.company == company)
-
+        q = q.filter(ADRecord.company == ("" if company == _NO_COMPANY else company))
     if department:
-        if department == "(без отдела)":
-            q = q.filter((ADRecord.department == "") | (ADRecord.department.is_(None)))
-        else:
-            q = q.filter(ADRecord.department == department)
+        q = q.filter(ADRecord.department == ("" if department == _NO_DEPARTMENT else department))
 
-    records = q.all()
+    count = q.count()
+    records = sorted_page(q, ADRecord, _SORT_COLUMNS[sort], order == "desc", page, page_size)
 
     ou_rules = load_ou_rules(db)
     members = [
@@ -89,8 +108,10 @@ def org_members(
                           account_type=compute_account_type(r.ad_source or "", norm(r.distinguished_name), ou_rules))
         for r in records
     ]
-    sort_members(members)
-    return {
+    payload = {
         "company": company, "department": department,
-        "members": members, "count": len(members),
+        "members": members, "count": count,
     }
+    if page_size:
+        payload.update(page=page, page_size=page_size)
+    return table_response(payload, "members", fmt, response)
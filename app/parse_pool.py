@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Разбор загруженных файлов в отдельных процессах.
+
+parse_ad / parse_mfa / parse_people (pandas + нормализация строк) держат
+GIL секундами; в процессе API это останавливает ответы всем пользователям.
+Поэтому разбор выполняется в пуле процессов:
+
+  - рабочий процесс получает путь к временному файлу загрузки (а не байты);
+  - строки возвращаются по колонкам (имена колонок один раз, без словаря
+    на каждую строку) и собираются обратно в API, вместе с телеметрией разбора;
+  - число процессов, время на файл и память процесса задаются в config.
+
+При превышении времени пул перезапускается (зависший процесс убивается),
+а загрузка завершается ошибкой разбора. PARSE_WORKERS=0 — разбор в потоке
+процесса API, как раньше.
+"""
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # не Unix — без ограничения памяти
+    resource = None
+
+from app import parsers
+from app.config import PARSE_WORKERS, PARSE_TIMEOUT, PARSE_MEMORY_MB, PARSE_MAX_TASKS
+
+logger = logging.getLogger(__name__)
+
+_PARSERS = {
+    "ad": parsers.parse_ad,
+    "mfa": parsers.parse_mfa,
+    "people": parsers.parse_people,
+}
+
+
+class ParseAborted(Exception):
+    """Разбор прерван: пул процессов перезапущен."""
+
+
+# ─── Рабочий процесс ────────────────────────────────────────
+
+def _init_worker(memory_mb: int):
+    if resource is not None and memory_mb > 0:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _pack(rows: list[dict]) -> tuple[list[str], list[list]]:
+    """Строки → (колонки, значения по колонкам)."""
+    if not rows:
+        return [], []
+    columns = list(rows[0])
+    return columns, [[r.get(c) for r in rows] for c in columns]
+
+
+def _unpack(packed: tuple[list[str], list[list]]) -> list[dict]:
+    columns, values = packed
+    return [dict(zip(columns, vals)) for vals in zip(*values)]
+
+
+def _run(kind: str, path: str, filename: str, kwargs: dict):
+    with open(path, "rb") as f:
+        content = f.read()
+    stats = {}
+    result = _PARSERS[kind](content, filename, stats=stats, **kwargs)
+    return (_pack(result[0]),) + tuple(result[1:]), stats
+
+
+# ─── Пул ────────────────────────────────────────────────────
+
+def _resolve(fut: asyncio.Future, value, exc):
+    if fut.done():
+        return
+    if exc is not None:
+        fut.set_exception(exc)
+    else:
+        fut.set_result(value)
+
+
+class _Workers:
+    """Пул процессов и незавершённые задачи (для отмены при перезапуске)."""
+
+    def __init__(self):
+        ctx = multiprocessing.get_context("spawn")
+        self.pool = ctx.Pool(
+            PARSE_WORKERS, initializer=_init_worker, initargs=(PARSE_MEMORY_MB,),
+            maxtasksperchild=PARSE_MAX_TASKS or None,
+        )
+        self.pending: set[asyncio.Future] = set()
+
+    def submit(self, args: tuple) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self.pending.add(fut)
+        fut.add_done_callback(self.pending.discard)
+        self.pool.apply_async(
+            _run, args,
+            callback=lambda value: loop.call_soon_threadsafe(_resolve, fut, value, None),
+            error_callback=lambda exc: loop.call_soon_threadsafe(_resolve, fut, None, exc),
+        )
+        return fut
+
+    def abort(self, reason: str):
+        """Завершает ожидающие задачи ошибкой (вызывается в цикле событий)."""
+        for fut in list(self.pending):
+            _resolve(fut, None, ParseAborted(reason))
+
+
+_workers: _Workers | None = None
+_lock = threading.Lock()
+
+
+def _get_workers() -> _Workers:
+    global _workers
+    with _lock:
+        if _workers is None:
+            _workers = _Workers()
+            logger.info("[parse] Пул разбора: %d процессов, %d с, %d МБ", PARSE_WORKERS, PARSE_TIMEOUT, PARSE_MEMORY_MB)
+        return _workers
+
+
+def _take_workers(workers: _Workers | None = None) -> _Workers | None:
+    """Отсоединяет пул (весь или только указанный), чтобы следующая задача создала новый."""
+    global _workers
+    with _lock:
+        if workers is None or _workers is workers:
+            workers, _workers = _workers, None
+        return workers
+
+
+def shutdown():
+    """Останавливает пул (при завершении приложения)."""
+    workers = _take_workers()
+    if workers is not None:
+        workers.abort("Приложение останавливается")
+        workers.pool.terminate()
+
+
+def _failed(kind: str, error: str) -> tuple:
+    return ([], error, 0) if kind == "ad" else ([], error)
+
+
+async def run_parser(kind: str, path: str, filename: str, stats: dict | None = None, **kwargs) -> tuple:
+    """
+    Разбирает файл path парсером kind ("ad", "mfa", "people").
+    Возвращает то же, что парсер: (rows, error) или для AD (rows, error, skipped);
+    телеметрия разбора (объём, строки, фазы read/map/normalize) — в stats.
+    """
+    stats = {} if stats is None else stats
+    if PARSE_WORKERS <= 0:
+        def local():
+            with open(path, "rb") as f:
+                return _PARSERS[kind](f.read(), filename, stats=stats, **kwargs)
+        return await asyncio.to_thread(local)
+
+    workers = _get_workers()
+    started = time.perf_counter()
+    try:
+        result, worker_stats = await asyncio.wait_for(workers.submit((kind, path, filename, kwargs)), PARSE_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error("[parse] %s: разбор %s не завершился за %d с, пул перезапускается", kind, filename, PARSE_TIMEOUT)
+        stale = _take_workers(workers)
+        if stale is not None:
+            stale.abort("Пул разбора перезапущен после превышения времени")
+            await asyncio.to_thread(stale.pool.terminate)
+        return _failed(kind, f"Разбор файла не завершился за {PARSE_TIMEOUT} с")
+    except (ParseAborted, MemoryError) as e:
+        return _failed(kind, str(e) or "Недостаточно памяти для разбора файла")
+    for key, value in worker_stats.items():
+        if isinstance(value, dict):
+            stats.setdefault(key, {}).update(value)
+        else:
+            stats[key] = value
+    # Очередь пула и передача результата между процессами
+    phases = stats.setdefault("phases_ms", {})
+    wall = (time.perf_counter() - started) * 1000
+    phases["transfer"] = round(max(wall - sum(worker_stats.get("phases_ms", {}).values()), 0), 1)
+    return (_unpack(result[0]),) + tuple(result[1:])
@@ -2,11 +2,19 @@
 import io
 import logging
 import re
-import threading
 
+import openpyxl
 import pandas as pd
 from app.config import AD_COLUMNS, MFA_COLUMNS, PEOPLE_COLUMNS
-from app.utils import norm, norm_phone, safe_datetime
+from app.utils import norm, norm_email, norm_phone, norm_fio_key, norm_key_login, norm_key_dn, norm_key_uuid, safe_datetime
+from app.ad_flags import decode_ad_flags
+from app.ingest import phase
+
+try:
+    import python_calamine  # noqa: F401 — движок pandas "calamine"
+    _HAS_CALAMINE = True
+except ImportError:
+    _HAS_CALAMINE = False
 
 logger = logging.getLogger(__name__)
 
@@ -19,22 +27,98 @@ def _extract_domain_from_dn(dn: str) -> str:
     return ".".join(parts) if parts else ""
 
 
-def _map_columns(df: pd.DataFrame, primary: dict) -> pd.DataFrame:
-    """Маппинг колонок DataFrame по именам из config (case-insensitive)."""
-    rename_map = {}
-    col_lower = {c.lower(): c for c in df.columns}
+def _column_mapping(columns, primary: dict) -> dict:
+    """Поле → колонка файла по именам из config (case-insensitive); ненайденные поля пропускаются."""
+    col_lower = {str(c).lower(): c for c in columns}
+    found = {}
     for target, expected in primary.items():
         if not expected:
             continue
         real_col = col_lower.get(expected.lower())
         if real_col is not None:
-            rename_map[real_col] = target
+            found[target] = real_col
+    return found
+
+
+def _map_columns(df: pd.DataFrame, primary: dict) -> pd.DataFrame:
+    """Маппинг колонок DataFrame по именам из config (case-insensitive)."""
+    rename_map = {real_col: target for target, real_col in _column_mapping(df.columns, primary).items()}
     if rename_map:
         df = df.rename(columns=rename_map)
     return df
 
 
-def _read_file(content: bytes, filename: str) -> pd.DataFrame:
+def _excel_header(values) -> list:
+    """Имена колонок как у pd.read_excel: пустые → "Unnamed: N", повторы → "имя.1"."""
+    names, seen = [], {}
+    for i, v in enumerate(values):
+        name = f"Unnamed: {i}" if v is None or v == "" else v
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _excel_cell(v):
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    return v
+
+
+def _source(content: bytes | str):
+    """Байты файла → поток для читателей pandas/openpyxl; путь к файлу передаётся как есть."""
+    return io.BytesIO(content) if isinstance(content, bytes) else content
+
+
+def _first_line(content: bytes | str) -> str:
+    if isinstance(content, bytes):
+        nl = content.find(b"\n")
+        line = content[:nl if nl >= 0 else len(content)]
+    else:
+        with open(content, "rb") as f:
+            line = f.readline().rstrip(b"\n")
+    return line.decode("utf-8-sig", errors="replace")
+
+
+def _read_xlsx_rows(content: bytes | str, nrows: int | None = None) -> pd.DataFrame:
+    """Первый лист XLSX построчно (openpyxl read_only, без промежуточных объектов ячеек)."""
+    wb = openpyxl.load_workbook(_source(content), read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True, max_row=nrows + 1 if nrows else None)
+        header = next(rows, None)
+        data = [r for r in rows]
+    finally:
+        wb.close()
+    if header is None:
+        return pd.DataFrame()
+    while data and all(v is None for v in data[-1]):
+        data.pop()
+    width = max([len(header)] + [len(r) for r in data])
+    header = tuple(header) + (None,) * (width - len(header))
+    data = [[_excel_cell(v) for v in r] + [""] * (width - len(r)) for r in data]
+    return pd.DataFrame(data, columns=_excel_header(header))
+
+
+def read_excel(content: bytes | str, filename: str = "", nrows: int | None = None) -> pd.DataFrame:
+    """
+    Первый лист книги Excel — тот же DataFrame, что pd.read_excel(sheet_name=0,
+    keep_default_na=False). Движок calamine (python-calamine), если установлен;
+    иначе XLSX читается потоково через openpyxl read_only, XLS — через pandas.
+    nrows — прочитать только первые nrows строк данных; content — байты или путь к файлу.
+    """
+    if _HAS_CALAMINE:
+        return pd.read_excel(_source(content), sheet_name=0, keep_default_na=False, nrows=nrows, engine="calamine")
+    if (filename or "").lower().endswith(".xls"):
+        return pd.read_excel(_source(content), sheet_name=0, keep_default_na=False, nrows=nrows)
+    return _read_xlsx_rows(content, nrows)
+
+
+def _read_file(content: bytes | str, filename: str, nrows: int | None = None) -> pd.DataFrame:
     """Читает CSV или Excel файл в DataFrame.
 
     CSV: автоматически определяет разделитель (; или ,) по первой строке.
@@ -42,218 +126,320 @@ def _read_file(content: bytes, filename: str) -> pd.DataFrame:
     """
     ext = (filename or "").lower().split(".")[-1]
     if ext in ("xlsx", "xls"):
-        return pd.read_excel(io.BytesIO(content), sheet_name=0, keep_default_na=False)
-    first_line = content.decode("utf-8-sig", errors="replace").split("\n", 1)[0]
+        return read_excel(content, filename, nrows)
+    first_line = _first_line(content)
     sep = ";" if first_line.count(";") > first_line.count(",") else ","
-    return pd.read_csv(io.BytesIO(content), encoding="utf-8-sig", sep=sep,
-                       on_bad_lines="skip", keep_default_na=False)
+    return pd.read_csv(_source(content), encoding="utf-8-sig", sep=sep,
+                       on_bad_lines="skip", keep_default_na=False, nrows=nrows)
 
 
-# Хранит информацию о последнем парсинге для диагностики
-_last_parse_info = {}
-_parse_info_lock = threading.Lock()
+def _read_mfa(content: bytes | str, nrows: int | None = None) -> pd.DataFrame:
+    return pd.read_csv(_source(content), encoding="utf-8", sep=";",
+                       on_bad_lines="skip", keep_default_na=False, nrows=nrows)
 
 
-def get_last_parse_info() -> dict:
-    with _parse_info_lock:
-        return dict(_last_parse_info)
+def _error_text(e: Exception) -> str:
+    """Текст ошибки разбора (никогда не пустой: пустая ошибка выглядела бы как успех)."""
+    if isinstance(e, MemoryError):
+        return "Недостаточно памяти для разбора файла"
+    return str(e) or type(e).__name__
+
+
+def _ad_row(r: dict, override_domain: str = "") -> dict:
+    """Строка выгрузки AD (после маппинга колонок) → запись ad_records."""
+    domain_val = override_domain if override_domain else norm(r.get("domain", ""))
+    pwd_ts = norm(r.get("pwd_last_set", ""))
+    display_name = norm(r.get("display_name", ""))
+    return decode_ad_flags({
+        "domain": domain_val,
+        # --- основные ---
+        "login": norm(r.get("login", "")),
+        "login_key": norm_key_login(r.get("login", "")),
+        "enabled": norm(r.get("enabled", "")),
+        "display_name": display_name,
+        "fio_key": norm_fio_key(display_name),
+        "given_name": norm(r.get("given_name", "")),
+        "surname_ad": norm(r.get("surname_ad", "")),
+        "email": norm(r.get("email", "")),
+        "email_key": norm_email(r.get("email", "")),
+        "upn": norm(r.get("upn", "")),
+        "phone": norm_phone(r.get("phone", "")),
+        "mobile": norm_phone(r.get("mobile", "")),
+        "title": norm(r.get("title", "")),
+        "manager": norm(r.get("manager", "")),
+        "distinguished_name": norm(r.get("distinguished_name", "")),
+        "dn_key": norm_key_dn(r.get("distinguished_name", "")),
+        "company": norm(r.get("company", "")),
+        "department": norm(r.get("department", "")),
+        "description": norm(r.get("description", "")),
+        "employee_type": norm(r.get("employee_type", "")),
+        "employee_number": norm(r.get("employee_number", "")),
+        "location": norm(r.get("location", "")),
+        "street_address": norm(r.get("street_address", "")),
+        "staff_uuid": norm(r.get("staff_uuid", "")),
+        "uuid_key": norm_key_uuid(r.get("staff_uuid", "")),
+        "info": norm(r.get("info", "")),
+        # --- пароль и сроки ---
+        "password_last_set": safe_datetime(r.get("password_last_set")),
+        "pwd_last_set": pwd_ts,
+        "must_change_password": "Да" if not pwd_ts else "Нет",
+        "password_expired": norm(r.get("password_expired", "")),
+        "password_never_expires": norm(r.get("password_never_expires", "")),
+        "password_not_required": norm(r.get("password_not_required", "")),
+        "cannot_change_password": norm(r.get("cannot_change_password", "")),
+        "account_expiration_date": safe_datetime(r.get("account_expiration_date")),
+        "account_expires": norm(r.get("account_expires", "")),
+        # --- аудит активности ---
+        "last_logon_date": safe_datetime(r.get("last_logon_date")),
+        "last_logon_timestamp": norm(r.get("last_logon_timestamp", "")),
+        "logon_count": norm(r.get("logon_count", "")),
+        "last_bad_password_attempt": safe_datetime(r.get("last_bad_password_attempt")),
+        "bad_logon_count": norm(r.get("bad_logon_count", "")),
+        "locked_out": norm(r.get("locked_out", "")),
+        # --- жизненный цикл ---
+        "created_date": safe_datetime(r.get("created_date")),
+        "modified_date": safe_datetime(r.get("modified_date")),
+        "when_created": safe_datetime(r.get("when_created")),
+        "when_changed": safe_datetime(r.get("when_changed")),
+        "exported_at": safe_datetime(r.get("exported_at")),
+        # --- безопасность ---
+        "trusted_for_delegation": norm(r.get("trusted_for_delegation", "")),
+        "trusted_to_auth_for_delegation": norm(r.get("trusted_to_auth_for_delegation", "")),
+        "account_not_delegated": norm(r.get("account_not_delegated", "")),
+        "does_not_require_preauth": norm(r.get("does_not_require_preauth", "")),
+        "allow_reversible_password_encryption": norm(r.get("allow_reversible_password_encryption", "")),
+        "smartcard_logon_required": norm(r.get("smartcard_logon_required", "")),
+        "protected_from_accidental_deletion": norm(r.get("protected_from_accidental_deletion", "")),
+        "user_account_control": norm(r.get("user_account_control", "")),
+        "service_principal_names": norm(r.get("service_principal_names", "")),
+        "account_lockout_time": safe_datetime(r.get("account_lockout_time")),
+        # --- идентификаторы ---
+        "object_guid": norm(r.get("object_guid", "")),
+        "sid": norm(r.get("sid", "")),
+        "canonical_name": norm(r.get("canonical_name", "")),
+        # --- профиль ---
+        "logon_workstations": norm(r.get("logon_workstations", "")),
+        "home_drive": norm(r.get("home_drive", "")),
+        "home_directory": norm(r.get("home_directory", "")),
+        "profile_path": norm(r.get("profile_path", "")),
+        "script_path": norm(r.get("script_path", "")),
+        # --- связи ---
+        "groups": norm(r.get("groups", "")),
+        "direct_reports": norm(r.get("direct_reports", "")),
+        "managed_objects": norm(r.get("managed_objects", "")),
+        "primary_group": norm(r.get("primary_group", "")),
+    })
+
+
+def _prepare_ad(df: pd.DataFrame, expected_dn_suffix: str = "") -> tuple[pd.DataFrame, str | None, int]:
+    """
+    Домен из distinguishedName (если нет колонки domain) и фильтр по DN-суффиксу.
+    Возвращает (df, колонка DN, число отфильтрованных записей других доменов).
+    """
+    # Найти колонку distinguishedName
+    dn_col = None
+    for c in df.columns:
+        if str(c).strip().lower() in ("distinguishedname", "distinguished_name"):
+            dn_col = c
+            break
+
+    # Домен: извлечь из distinguishedName
+    if "domain" not in df.columns:
+        if dn_col:
+            df["domain"] = df[dn_col].apply(
+                lambda x: _extract_domain_from_dn(str(x) if pd.notna(x) else "")
+            )
+        else:
+            df["domain"] = ""
+
+    # Фильтрация по DN-суффиксу
+    total_before = len(df)
+    dn_suffix_lower = expected_dn_suffix.lower().replace(" ", "") if expected_dn_suffix else ""
+    if dn_suffix_lower and dn_col:
+        df = df[df[dn_col].apply(
+            lambda x: dn_suffix_lower in str(x).lower().replace(" ", "") if pd.notna(x) else False
+        )]
+    return df, dn_col, total_before - len(df)
+
+
+def _parse_stats(stats: dict, content: bytes, original_cols: list, mapped_cols: list, rows_read: int):
+    """Объём и колонки файла в телеметрии разбора."""
+    stats["bytes"] = len(content)
+    stats["rows_read"] = rows_read
+    stats.setdefault("parse", {}).update({
+        "original_columns": [str(c) for c in original_cols],
+        "mapped_columns": [str(c) for c in mapped_cols],
+    })
 
 
 def parse_ad(content: bytes, filename: str, override_domain: str = "",
-             expected_dn_suffix: str = "") -> tuple[list[dict], str | None, int]:
+             expected_dn_suffix: str = "", stats: dict | None = None) -> tuple[list[dict], str | None, int]:
     """
     Парсит CSV или Excel выгрузку AD.
-    Возвращает (rows, error, skipped_count).
+    Возвращает (rows, error, skipped_count); телеметрия разбора — в stats.
     """
+    stats = {} if stats is None else stats
     try:
-        df = _read_file(content, filename)
-        original_cols = list(df.columns)
-        df = _map_columns(df, AD_COLUMNS)
-        mapped_cols = list(df.columns)
-
-        # Найти колонку distinguishedName
-        dn_col = None
-        for c in df.columns:
-            if str(c).strip().lower() in ("distinguishedname", "distinguished_name"):
-                dn_col = c
-                break
-
-        # Домен: извлечь из distinguishedName
-        if "domain" not in df.columns:
-            if dn_col:
-                df["domain"] = df[dn_col].apply(
-                    lambda x: _extract_domain_from_dn(str(x) if pd.notna(x) else "")
-                )
-            else:
-                df["domain"] = ""
-
-        # Фильтрация по DN-суффиксу
-        total_before = len(df)
-        dn_suffix_lower = expected_dn_suffix.lower().replace(" ", "") if expected_dn_suffix else ""
-        if dn_suffix_lower and dn_col:
-            df = df[df[dn_col].apply(
-                lambda x: dn_suffix_lower in str(x).lower().replace(" ", "") if pd.notna(x) else False
-            )]
-        skipped = total_before - len(df)
-
-        # Диагностика
-        with _parse_info_lock:
-            _last_parse_info["ad"] = {
-                "original_columns": original_cols,
-                "mapped_columns": mapped_cols,
-                "domain_source": "distinguishedName" if "domain" not in mapped_cols else "column",
-                "sample_login": norm(df["login"].iloc[0]) if "login" in df.columns and len(df) > 0 else "NOT FOUND",
-                "sample_domain": norm(df["domain"].iloc[0]) if "domain" in df.columns and len(df) > 0 else "NOT FOUND",
-                "rows": len(df),
-                "skipped_wrong_domain": skipped,
-            }
+        with phase(stats, "read"):
+            df = _read_file(content, filename)
+        with phase(stats, "map"):
+            original_cols = list(df.columns)
+            df = _map_columns(df, AD_COLUMNS)
+            mapped_cols = list(df.columns)
+            total_before = len(df)
+            df, _dn_col, skipped = _prepare_ad(df, expected_dn_suffix)
+
+        _parse_stats(stats, content, original_cols, mapped_cols, total_before)
+        stats["rows_skipped"] = skipped
+        stats["parse"].update({
+            "domain_source": "distinguishedName" if "domain" not in mapped_cols else "column",
+            "sample_login": norm(df["login"].iloc[0]) if "login" in df.columns and len(df) > 0 else "NOT FOUND",
+            "sample_domain": norm(df["domain"].iloc[0]) if "domain" in df.columns and len(df) > 0 else "NOT FOUND",
+        })
         logger.info("[AD] Original columns: %s", original_cols)
         logger.info("[AD] Mapped columns:   %s", mapped_cols)
         logger.info("[AD] Total in file: %d, accepted: %d, skipped: %d", total_before, len(df), skipped)
 
         # Используем to_dict вместо iterrows для скорости
-        records = df.to_dict("records")
-        rows = []
-        for r in records:
-            domain_val = override_domain if override_domain else norm(r.get("domain", ""))
-            pwd_ts = norm(r.get("pwd_last_set", ""))
-            rows.append({
-                "domain": domain_val,
-                # --- основные ---
-                "login": norm(r.get("login", "")),
-                "enabled": norm(r.get("enabled", "")),
-                "display_name": norm(r.get("display_name", "")),
-                "given_name": norm(r.get("given_name", "")),
-                "surname_ad": norm(r.get("surname_ad", "")),
-                "email": norm(r.get("email", "")),
-                "upn": norm(r.get("upn", "")),
-                "phone": norm_phone(r.get("phone", "")),
-                "mobile": norm_phone(r.get("mobile", "")),
-                "title": norm(r.get("title", "")),
-                "manager": norm(r.get("manager", "")),
-                "distinguished_name": norm(r.get("distinguished_name", "")),
-                "company": norm(r.get("company", "")),
-                "department": norm(r.get("department", "")),
-                "description": norm(r.get("description", "")),
-                "employee_type": norm(r.get("employee_type", "")),
-                "employee_number": norm(r.get("employee_number", "")),
-                "location": norm(r.get("location", "")),
-                "street_address": norm(r.get("street_address", "")),
-                "staff_uuid": norm(r.get("staff_uuid", "")),
-                "info": norm(r.get("info", "")),
-                # --- пароль и сроки ---
-                "password_last_set": safe_datetime(r.get("password_last_set")),
-                "pwd_last_set": pwd_ts,
-                "must_change_password": "Да" if not pwd_ts else "Нет",
-                "password_expired": norm(r.get("password_expired", "")),
-                "password_never_expires": norm(r.get("password_never_expires", "")),
-                "password_not_required": norm(r.get("password_not_required", "")),
-                "cannot_change_password": norm(r.get("cannot_change_password", "")),
-                "account_expiration_date": safe_datetime(r.get("account_expiration_date")),
-                "account_expires": norm(r.get("account_expires", "")),
-                # --- аудит активности ---
-                "last_logon_date": safe_datetime(r.get("last_logon_date")),
-                "last_logon_timestamp": norm(r.get("last_logon_timestamp", "")),
-                "logon_count": norm(r.get("logon_count", "")),
-                "last_bad_password_attempt": safe_datetime(r.get("last_bad_password_attempt")),
-                "bad_logon_count": norm(r.get("bad_logon_count", "")),
-                "locked_out": norm(r.get("locked_out", "")),
-                # --- жизненный цикл ---
-                "created_date": safe_datetime(r.get("created_date")),
-                "modified_date": safe_datetime(r.get("modified_date")),
-                "when_created": safe_datetime(r.get("when_created")),
-                "when_changed": safe_datetime(r.get("when_changed")),
-                "exported_at": safe_datetime(r.get("exported_at")),
-                # --- безопасность ---
-                "trusted_for_delegation": norm(r.get("trusted_for_delegation", "")),
-                "trusted_to_auth_for_delegation": norm(r.get("trusted_to_auth_for_delegation", "")),
-                "account_not_delegated": norm(r.get("account_not_delegated", "")),
-                "does_not_require_preauth": norm(r.get("does_not_require_preauth", "")),
-                "allow_reversible_password_encryption": norm(r.get("allow_reversible_password_encryption", "")),
-                "smartcard_logon_required": norm(r.get("smartcard_logon_required", "")),
-                "protected_from_accidental_deletion": norm(r.get("protected_from_accidental_deletion", "")),
-                "user_account_control": norm(r.get("user_account_control", "")),
-                "service_principal_names": norm(r.get("service_principal_names", "")),
-                "account_lockout_time": safe_datetime(r.get("account_lockout_time")),
-                # --- идентификаторы ---
-                "object_guid": norm(r.get("object_guid", "")),
-                "sid": norm(r.get("sid", "")),
-                "canonical_name": norm(r.get("canonical_name", "")),
-                # --- профиль ---
-                "logon_workstations": norm(r.get("logon_workstations", "")),
-                "home_drive": norm(r.get("home_drive", "")),
-                "home_directory": norm(r.get("home_directory", "")),
-                "profile_path": norm(r.get("profile_path", "")),
-                "script_path": norm(r.get("script_path", "")),
-                # --- связи ---
-                "groups": norm(r.get("groups", "")),
-                "direct_reports": norm(r.get("direct_reports", "")),
-                "managed_objects": norm(r.get("managed_objects", "")),
-                "primary_group": norm(r.get("primary_group", "")),
-            })
+        with phase(stats, "normalize"):
+            rows = [_ad_row(r, override_domain) for r in df.to_dict("records")]
         return rows, None, skipped
     except Exception as e:
         logger.error("Ошибка парсинга AD: %s", e, exc_info=True)
-        return [], str(e), 0
+        return [], _error_text(e), 0
 
 
-def parse_mfa(content: bytes, filename: str) -> tuple[list[dict], str | None]:
+def _mfa_row(r: dict) -> dict:
+    """Строка выгрузки MFA → запись mfa_records."""
+    name = norm(r.get("name", ""))
+    identity = norm(r.get("identity", ""))
+    return {
+        "identity": identity,
+        "identity_key": norm_key_login(identity),
+        "email": norm(r.get("email", "")),
+        "email_key": norm_email(r.get("email", "")),
+        "name": name,
+        "fio_key": norm_fio_key(name),
+        "phones": norm_phone(r.get("phones", "")),
+        "last_login": safe_datetime(r.get("last_login")),
+        "created_at": safe_datetime(r.get("created_at")),
+        "status": norm(r.get("status", "")),
+        "is_enrolled": norm(r.get("is_enrolled", "")),
+        "authenticators": norm(r.get("authenticators", "")),
+        "mfa_groups": norm(r.get("mfa_groups", "")),
+        "is_spammer": norm(r.get("is_spammer", "")),
+        "mfa_id": norm(r.get("mfa_id", "")),
+        "ldap": norm(r.get("ldap", "")),
+    }
+
+
+def parse_mfa(content: bytes, filename: str, stats: dict | None = None) -> tuple[list[dict], str | None]:
+    stats = {} if stats is None else stats
     try:
-        df = pd.read_csv(io.BytesIO(content), encoding="utf-8", sep=";",
-                         on_bad_lines="skip", keep_default_na=False)
-        original_cols = list(df.columns)
-        df = _map_columns(df, MFA_COLUMNS)
-        with _parse_info_lock:
-            _last_parse_info["mfa"] = {"original_columns": original_cols, "mapped_columns": list(df.columns), "rows": len(df)}
+        with phase(stats, "read"):
+            df = _read_mfa(content)
+        with phase(stats, "map"):
+            original_cols = list(df.columns)
+            df = _map_columns(df, MFA_COLUMNS)
+        _parse_stats(stats, content, original_cols, list(df.columns), len(df))
         logger.info("[MFA] Original columns: %s", original_cols)
 
-        rows = []
-        for r in df.to_dict("records"):
-            rows.append({
-                "identity": norm(r.get("identity", "")),
-                "email": norm(r.get("email", "")),
-                "name": norm(r.get("name", "")),
-                "phones": norm_phone(r.get("phones", "")),
-                "last_login": safe_datetime(r.get("last_login")),
-                "created_at": safe_datetime(r.get("created_at")),
-                "status": norm(r.get("status", "")),
-                "is_enrolled": norm(r.get("is_enrolled", "")),
-                "authenticators": norm(r.get("authenticators", "")),
-                "mfa_groups": norm(r.get("mfa_groups", "")),
-                "is_spammer": norm(r.get("is_spammer", "")),
-                "mfa_id": norm(r.get("mfa_id", "")),
-                "ldap": norm(r.get("ldap", "")),
-            })
+        with phase(stats, "normalize"):
+            rows = [_mfa_row(r) for r in df.to_dict("records")]
         return rows, None
     except Exception as e:
         logger.error("Ошибка парсинга MFA: %s", e, exc_info=True)
-        return [], str(e)
+        return [], _error_text(e)
+
 
+def _people_row(r: dict) -> dict:
+    """Строка выгрузки «Кадры» → запись people_records."""
+    fio = norm(r.get("fio", ""))
+    return {
+        "staff_uuid": norm(r.get("staff_uuid", "")),
+        "uuid_key": norm_key_uuid(r.get("staff_uuid", "")),
+        "fio": fio,
+        "fio_key": norm_fio_key(fio),
+        "email": norm(r.get("email", "")),
+        "email_key": norm_email(r.get("email", "")),
+        "phone": norm_phone(r.get("phone", "")),
+        "unit": norm(r.get("unit", "")),
+        "hub": norm(r.get("hub", "")),
+        "employment_status": norm(r.get("employment_status", "")),
+        "unit_manager": norm(r.get("unit_manager", "")),
+        "work_format": norm(r.get("work_format", "")),
+        "hr_bp": norm(r.get("hr_bp", "")),
+    }
 
-def parse_people(content: bytes, filename: str) -> tuple[list[dict], str | None]:
+
+def parse_people(content: bytes, filename: str, stats: dict | None = None) -> tuple[list[dict], str | None]:
+    stats = {} if stats is None else stats
     try:
-        df = pd.read_excel(io.BytesIO(content), sheet_name=0, keep_default_na=False)
-        original_cols = list(df.columns)
-        df = _map_columns(df, PEOPLE_COLUMNS)
-        with _parse_info_lock:
-            _last_parse_info["people"] = {"original_columns": original_cols, "mapped_columns": list(df.columns), "rows": len(df)}
+        with phase(stats, "read"):
+            df = read_excel(content, filename)
+        with phase(stats, "map"):
+            original_cols = list(df.columns)
+            df = _map_columns(df, PEOPLE_COLUMNS)
+        _parse_stats(stats, content, original_cols, list(df.columns), len(df))
         logger.info("[People] Original columns: %s", original_cols)
 
-        rows = []
-        for r in df.to_dict("records"):
-            rows.append({
-                "staff_uuid": norm(r.get("staff_uuid", "")),
-                "fio": norm(r.get("fio", "")),
-                "email": norm(r.get("email", "")),
-                "phone": norm_phone(r.get("phone", "")),
-                "unit": norm(r.get("unit", "")),
-                "hub": norm(r.get("hub", "")),
-                "employment_status": norm(r.get("employment_status", "")),
-                "unit_manager": norm(r.get("unit_manager", "")),
-                "work_format": norm(r.get("work_format", "")),
-                "hr_bp": norm(r.get("hr_bp", "")),
-            })
+        with phase(stats, "normalize"):
+            rows = [_people_row(r) for r in df.to_dict("records")]
         return rows, None
     except Exception as e:
         logger.error("Ошибка парсинга People: %s", e, exc_info=True)
-        return [], str(e)
+        return [], _error_text(e)
+
+
+def preview_upload(kind: str, path: str, filename: str, nrows: int = 1000, sample: int = 20,
+                   override_domain: str = "", expected_dn_suffix: str = "") -> dict:
+    """
+    Пробный разбор без записи в БД: из файла path читаются только заголовок
+    и первые nrows строк (файл целиком в память не загружается).
+    Возвращает сопоставление колонок, оценку фильтра по DN-суффиксу (AD)
+    и первые sample нормализованных строк.
+    """
+    primary = {"ad": AD_COLUMNS, "mfa": MFA_COLUMNS, "people": PEOPLE_COLUMNS}[kind]
+    if kind == "mfa":
+        df = _read_mfa(path, nrows)
+    elif kind == "people":
+        df = read_excel(path, filename, nrows)
+    else:
+        df = _read_file(path, filename, nrows)
+
+    original_cols = list(df.columns)
+    found = _column_mapping(original_cols, primary)
+    used = set(found.values())
+    result = {
+        "columns": [str(c) for c in original_cols],
+        "mapping": [
+            {"field": field, "expected": expected, "column": found.get(field)}
+            for field, expected in primary.items() if expected
+        ],
+        "missing_fields": [field for field, expected in primary.items() if expected and field not in found],
+        "unmapped_columns": [str(c) for c in original_cols if c not in used],
+        "rows_read": len(df),
+        "truncated": len(df) >= nrows,
+    }
+    df = _map_columns(df, primary)
+
+    if kind == "ad":
+        has_domain = "domain" in df.columns
+        read = len(df)
+        df, dn_col, skipped = _prepare_ad(df, expected_dn_suffix)
+        result["domain_source"] = "column" if has_domain else ("distinguishedName" if dn_col else "none")
+        result["dn_filter"] = {
+            "suffix": expected_dn_suffix,
+            "column": str(dn_col) if dn_col else None,
+            "matched": read - skipped,
+            "skipped": skipped,
+            "match_ratio": round((read - skipped) / read, 4) if read else None,
+        }
+
+    records = df.head(sample).to_dict("records")
+    if kind == "ad":
+        result["sample"] = [_ad_row(r, override_domain) for r in records]
+    else:
+        to_row = _mfa_row if kind == "mfa" else _people_row
+        result["sample"] = [to_row(r) for r in records]
+    return result
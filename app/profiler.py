@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""Профилирование отдельного запроса по требованию администратора.
+
+К любому запросу API администратор добавляет ?__profile=1 — вместо ответа
+эндпоинта возвращается отчёт:
+
+  - functions / app_functions — самые затратные функции по собственному
+    времени и функции app/ по времени с вызовами (сэмплирующий
+    профилировщик: раз в PROFILE_INTERVAL снимаются стеки всех потоков,
+    учитываются только стеки, проходящие через код app/ — эндпоинты
+    выполняются в пуле потоков, поэтому cProfile одного потока их не видит);
+  - sql — выполненные запросы (время, число повторов, загруженные строки).
+
+Для остальных пользователей параметр игнорируется. Запрос без __profile
+проверяется одним поиском подстроки в query string; обработчики событий
+SQLAlchemy подключаются при первом профилировании и без активного отчёта
+ничего не собирают.
+
+Сэмплы берутся со всех потоков процесса: параллельные запросы в то же
+время тоже попадут в отчёт.
+"""
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.auth import get_current_user_optional, require_admin
+from app.database import SessionLocal, engine
+
+PROFILE_PARAM = b"__profile"
+PROFILE_INTERVAL = 0.001   # секунды между снимками стеков
+TOP_FUNCTIONS = 30
+TOP_STATEMENTS = 50
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_ROOT_DIR = os.path.dirname(_APP_DIR)
+_SELF_FILE = __file__
+
+_current: contextvars.ContextVar["_Report | None"] = contextvars.ContextVar("profile_report", default=None)
+_hooks_lock = threading.Lock()
+_hooks_installed = False
+
+
+def _requested(scope: Scope) -> bool:
+    for part in scope.get("query_string", b"").split(b"&"):
+        name, _, value = part.partition(b"=")
+        if name == PROFILE_PARAM:
+            return value not in (b"", b"0", b"false")
+    return False
+
+
+async def _is_admin(scope: Scope) -> bool:
+    """Администратор по токену запроса (те же правила, что у require_admin)."""
+    scheme, _, token = Headers(scope=scope).get("authorization", "").partition(" ")
+    creds = HTTPAuthorizationCredentials(scheme=scheme, credentials=token) if token else None
+    db = SessionLocal()
+    try:
+        user = await get_current_user_optional(creds, db)
+        if user is None:
+            return False
+        await require_admin(user)
+        return True
+    except HTTPException:
+        return False
+    finally:
+        db.close()
+
+
+# ─── SQL ────────────────────────────────────────────────────
+
+def _install_hooks():
+    """Подключает сбор SQL к движку и сессиям (один раз, при первом отчёте)."""
+    global _hooks_installed
+    with _hooks_lock:
+        if _hooks_installed:
+            return
+        event.listen(engine, "before_cursor_execute", _before_execute)
+        event.listen(engine, "after_cursor_execute", _after_execute)
+        event.listen(Session, "do_orm_execute", _count_rows)
+        _hooks_installed = True
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    report = _current.get()
+    started = conn.info.get("profile_started")
+    if report is None or not started:
+        return
+    report.add_statement(" ".join(statement.split()), (time.perf_counter() - started.pop()) * 1000)
+
+
+def _count_rows(orm_execute_state):
+    """Строки SELECT через сессию: результат буферизуется и считается (только во время отчёта)."""
+    report = _current.get()
+    if report is None or not orm_execute_state.is_select:
+        return None
+    frozen = orm_execute_state.invoke_statement().freeze()
+    report.add_rows(len(frozen.data))
+    return frozen()
+
+
+# ─── Сэмплер стеков ─────────────────────────────────────────
+
+def _where(code) -> str:
+    path = code.co_filename
+    if path.startswith(_ROOT_DIR + os.sep):
+        path = os.path.relpath(path, _ROOT_DIR)
+    elif "site-packages" in path:
+        path = path.split("site-packages" + os.sep, 1)[1]
+    else:
+        path = os.path.basename(path)
+    return f"{path}:{code.co_firstlineno}({code.co_name})"
+
+
+class _Sampler(threading.Thread):
+    """Периодически снимает стеки потоков, проходящие через код приложения."""
+
+    def __init__(self, interval: float):
+        super().__init__(name="request-profiler", daemon=True)
+        self.interval = interval
+        self.ticks = 0
+        self.samples = 0
+        self.own: Counter = Counter()
+        self.total: Counter = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        while not self._done.wait(self.interval):
+            self.ticks += 1
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                codes = []
+                while frame is not None:
+                    if frame.f_code.co_filename != _SELF_FILE:
+                        codes.append(frame.f_code)
+                    frame = frame.f_back
+                if not any(c.co_filename.startswith(_APP_DIR) for c in codes):
+                    continue   # простаивающие потоки и цикл событий в ожидании
+                self.samples += 1
+                self.own[codes[0]] += 1
+                self.total.update(set(codes))
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+# ─── Отчёт ──────────────────────────────────────────────────
+
+class _Report:
+    def __init__(self):
+        self.statements: dict[str, list] = {}   # SQL → [число, мс, строки]
+        self.order: list[str] = []
+        self.rows_loaded = 0
+        self._last: str | None = None
+        self._lock = threading.Lock()
+
+    def add_statement(self, sql: str, ms: float):
+        with self._lock:
+            entry = self.statements.get(sql)
+            if entry is None:
+                entry = self.statements[sql] = [0, 0.0, 0]
+                self.order.append(sql)
+            entry[0] += 1
+            entry[1] += ms
+            self._last = sql
+
+    def add_rows(self, n: int):
+        with self._lock:
+            self.rows_loaded += n
+            if self._last is not None:
+                self.statements[self._last][2] += n
+
+    def sql(self) -> dict:
+        items = sorted(self.statements.items(), key=lambda kv: kv[1][1], reverse=True)
+        return {
+            "queries": sum(e[0] for e in self.statements.values()),
+            "distinct": len(self.statements),
+            "duration_ms": round(sum(e[1] for e in self.statements.values()), 2),
+            "rows_loaded": self.rows_loaded,
+            "statements": [
+                {"sql": sql, "count": e[0], "ms": round(e[1], 2), "rows": e[2], "first": self.order.index(sql) + 1}
+                for sql, e in items[:TOP_STATEMENTS]
+            ],
+        }
+
+
+def _functions(sampler: _Sampler, elapsed: float, app_only: bool) -> list[dict]:
+    """Функции по собственному времени или (app_only) функции app/ по времени с вызовами."""
+    tick_ms = elapsed * 1000 / sampler.ticks if sampler.ticks else 0
+    if app_only:
+        ranked = [(c, n) for c, n in sampler.total.most_common() if c.co_filename.startswith(_APP_DIR)]
+    else:
+        ranked = sampler.own.most_common()
+    return [
+        {
+            "function": _where(code),
+            "self_ms": round(sampler.own.get(code, 0) * tick_ms, 1),
+            "total_ms": round(sampler.total.get(code, 0) * tick_ms, 1),
+            "self_samples": sampler.own.get(code, 0),
+            "total_samples": sampler.total.get(code, 0),
+        }
+        for code, _ in ranked[:TOP_FUNCTIONS]
+    ]
+
+
+class ProfilerMiddleware:
+    """Отчёт профилировщика вместо ответа для запросов администратора с ?__profile=1."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or PROFILE_PARAM not in scope.get("query_string", b"") \
+                or not _requested(scope) or not await _is_admin(scope):
+            await self.app(scope, receive, send)
+            return
+
+        _install_hooks()
+        # Без If-None-Match: эндпоинт должен выполниться, а не ответить 304
+        scope["headers"] = [(k, v) for k, v in scope["headers"] if k != b"if-none-match"]
+        status, size = 500, 0
+
+        async def discard(message: Message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+
+        report = _Report()
+        token = _current.set(report)
+        sampler = _Sampler(PROFILE_INTERVAL)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            elapsed = time.perf_counter() - started
+            sampler.stop()
+            _current.reset(token)
+
+        body = json.dumps({
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "status": status,
+            "response_bytes": size,
+            "duration_ms": round(elapsed * 1000, 1),
+            "sampling": {
+                "interval_ms": PROFILE_INTERVAL * 1000,
+                "ticks": sampler.ticks,
+                "samples": sampler.samples,
+            },
+            "functions": _functions(sampler, elapsed, app_only=False),
+            "app_functions": _functions(sampler, elapsed, app_only=True),
+            "sql": report.sql(),
+        }, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"cache-control", b"no-store"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
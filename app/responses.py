@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Быстрая сериализация JSON и сжатие ответов.
+
+FastJSONResponse кодирует через orjson (если установлен), иначе — через
+стандартный json. Для больших выборок (сводная, безопасность, список
+пользователей) эндпоинты возвращают fast_json(...) с уже «плоскими»
+dict/list/str/int, минуя jsonable_encoder.
+
+to_columnar / table_response — колоночный формат (?format=columnar) для
+больших таблиц: список колонок, строки-массивы и словари значений для
+низкокардинальных полей.
+
+CompressionMiddleware сжимает ответы от COMPRESS_MIN_SIZE байт: brotli,
+если клиент его принимает и установлен пакет brotli, иначе gzip.
+"""
+import gzip
+import json
+
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import COMPRESS_MIN_SIZE
+
+try:
+    import orjson
+    _HAS_ORJSON = True
+except ImportError:
+    _HAS_ORJSON = False
+
+try:
+    import brotli
+    _HAS_BROTLI = True
+except ImportError:
+    _HAS_BROTLI = False
+
+# Заголовки, которые зависимости (etag_guard) выставляют во временный Response
+_PASSTHROUGH_HEADERS = ("etag", "cache-control")
+
+_COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+# Низкокардинальные поля: в колоночном формате передаются индексами в словарь значений
+DICT_COLUMNS = frozenset({
+    "source", "domain", "ad_source", "account_type", "uz_active", "enabled",
+    "mfa_enabled", "company", "department", "title",
+})
+
+# Значения параметра format у табличных эндпоинтов
+TABLE_FORMATS = "^(rows|columnar)$"
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse на orjson (UTF-8 без экранирования, datetime и numpy — нативно)."""
+
+    def render(self, content) -> bytes:
+        if _HAS_ORJSON:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def fast_json(content, response: Response | None = None) -> FastJSONResponse:
+    """
+    Ответ без прохода через jsonable_encoder. content должен состоять из
+    dict/list/str/int/float/bool/None/datetime.
+    response — временный Response эндпоинта: из него переносятся ETag и
+    Cache-Control, выставленные зависимостями (при прямом возврате Response
+    FastAPI их не применяет).
+    """
+    headers = None
+    if response is not None:
+        headers = {k: v for k, v in response.headers.items() if k in _PASSTHROUGH_HEADERS}
+    return FastJSONResponse(content, headers=headers)
+
+
+def to_columnar(rows: list[dict]) -> dict:
+    """
+    [{"a": 1, "domain": "AD izh"}, ...] →
+    {"columns": ["a", "domain"], "data": [[1, 0], ...], "dicts": {"domain": ["AD izh"]}}
+
+    Колонки — объединение ключей в порядке появления (отсутствующие → null).
+    Значения колонок из DICT_COLUMNS заменяются индексами в dicts[колонка].
+    """
+    columns = list(dict.fromkeys(k for r in rows for k in r))
+    dicts: dict[str, list] = {}
+    encoders: list[dict | None] = []
+    for c in columns:
+        if c in DICT_COLUMNS:
+            dicts[c] = []
+            encoders.append({})
+        else:
+            encoders.append(None)
+
+    data = []
+    for r in rows:
+        out = []
+        for c, enc in zip(columns, encoders):
+            v = r.get(c)
+            if enc is not None:
+                idx = enc.get(v)
+                if idx is None:
+                    idx = enc[v] = len(dicts[c])
+                    dicts[c].append(v)
+                v = idx
+            out.append(v)
+        data.append(out)
+    return {"columns": columns, "data": data, "dicts": dicts}
+
+
+def table_response(payload: dict, rows_key: str, fmt: str, response: Response | None = None) -> FastJSONResponse:
+    """Ответ табличного эндпоинта: payload[rows_key] в колоночном формате, если fmt == "columnar"."""
+    if fmt == "columnar":
+        payload = {**payload, rows_key: to_columnar(payload[rows_key]), "format": "columnar"}
+    return fast_json(payload, response)
+
+
+def _accepted_encodings(accept: str) -> set[str]:
+    """Разбор Accept-Encoding с учётом q=0 (кодировка запрещена)."""
+    result = set()
+    for part in accept.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            result.add(name.strip())
+    return result
+
+
+class CompressionMiddleware:
+    """
+    Сжатие br/gzip для ответов, отданных одним куском (JSON, HTML).
+    Потоковые ответы (выгрузки xlsx, статика) передаются без изменений.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESS_MIN_SIZE, gzip_level: int = 6,
+                 brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accepted = _accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        if _HAS_BROTLI and "br" in accepted:
+            encoding = "br"
+        elif "gzip" in accepted:
+            encoding = "gzip"
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        start: Message | None = None
+
+        async def send_wrapper(message: Message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+
+            pending, start = start, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=pending["headers"])
+            compress = (
+                not message.get("more_body", False)
+                and len(body) >= self.minimum_size
+                and "content-encoding" not in headers
+                and headers.get("content-type", "").startswith(_COMPRESSIBLE_TYPES)
+            )
+            if compress:
+                if encoding == "br":
+                    body = brotli.compress(body, quality=self.brotli_quality)
+                else:
+                    body = gzip.compress(body, compresslevel=self.gzip_level)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+                message = {**message, "body": body}
+            await send(pending)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
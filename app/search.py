@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""Серверный поиск по людям и учётным записям (AD, MFA, Кадры).
+
+Индекс `search_entries` пересобирается после каждой загрузки/синхронизации.
+На SQLite поверх него работает FTS5 (`search_fts`), на других СУБД —
+поиск по подстроке в `search_text` (для Postgres — GIN-индекс pg_trgm).
+"""
+import logging
+import re
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import text, func
+from sqlalchemy.orm import Session
+
+from app.database import get_db, ADRecord, MFARecord, PeopleRecord, SearchEntry, IS_SQLITE
+from app.config import AD_LABELS
+from app.utils import norm, norm_key_login
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/search", tags=["search"])
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Приоритет источника при выборе ФИО для результата
+_SOURCE_PRIORITY = {"people": 0, "ad": 1, "mfa": 2}
+
+
+def _fold(s: str) -> str:
+    """Приводит строку к виду для индекса: нижний регистр, ё→е."""
+    return s.lower().replace("ё", "е")
+
+
+def _phone_tokens(phones) -> str:
+    """
+    Номера (уже нормализованные, +<цифры>) → токены индекса, каждый номер
+    отдельно: +79121234567 → '79121234567 9121234567' (поиск и с кодом
+    страны, и без). Несколько номеров в одном значении разделяются пробелом,
+    запятой или точкой с запятой.
+    """
+    tokens = []
+    for value in phones:
+        for number in re.split(r"[\s,;]+", value or ""):
+            digits = re.sub(r"\D", "", number)
+            if len(digits) == 11 and digits[0] in "78":
+                tokens += [digits, digits[1:]]
+            elif digits:
+                tokens.append(digits)
+    return " ".join(dict.fromkeys(tokens))
+
+
+def _entry(user_key: str, source: str, record_id: int, *, fio="", login="", email="",
+           phones=(), title="", department="") -> dict:
+    fio, login, email = _fold(fio), _fold(login), _fold(email)
+    title, department = _fold(title), _fold(department)
+    phone = _phone_tokens(phones)
+    return {
+        "user_key": user_key, "source": source, "record_id": record_id,
+        "fio": fio, "login": login, "email": email, "phone": phone,
+        "title": title, "department": department,
+        "search_text": " ".join(v for v in (fio, login, email, phone, title, department) if v),
+    }
+
+
+def rebuild_search_index(db: Session) -> int:
+    """
+    Пересобирает поисковый индекс по текущему содержимому БД.
+    Вызывается из конвейеров загрузки и синхронизации в той же транзакции.
+    Ключи пользователей совпадают с /api/users/list.
+    """
+    entries: list[dict] = []
+    login_to_key: dict[str, str] = {}
+
+    ad_rows = db.query(
+        ADRecord.id, ADRecord.ad_source, ADRecord.staff_uuid, ADRecord.login,
+        ADRecord.display_name, ADRecord.email, ADRecord.phone, ADRecord.mobile,
+        ADRecord.title, ADRecord.department,
+    ).all()
+    for rid, ad_source, uuid, login, display_name, email, phone, mobile, title, dept in ad_rows:
+        uuid, login = norm(uuid), norm(login)
+        key = uuid.lower() if uuid else f"_login_{login.lower()}" if login else ""
+        if not key:
+            continue
+        if login:
+            login_to_key[login.lower()] = key
+        entries.append(_entry(
+            key, "ad", rid, fio=norm(display_name), login=login, email=norm(email),
+            phones=(norm(phone), norm(mobile)),
+            title=norm(title), department=norm(dept),
+        ))
+
+    for rid, uuid, fio, email, phone, unit in db.query(
+        PeopleRecord.id, PeopleRecord.staff_uuid, PeopleRecord.fio,
+        PeopleRecord.email, PeopleRecord.phone, PeopleRecord.unit,
+    ).all():
+        uuid = norm(uuid)
+        if not uuid:
+            continue
+        entries.append(_entry(
+            uuid.lower(), "people", rid, fio=norm(fio), email=norm(email),
+            phones=(norm(phone),), department=norm(unit),
+        ))
+
+    for rid, identity, name, email, phones in db.query(
+        MFARecord.id, MFARecord.identity, MFARecord.name, MFARecord.email, MFARecord.phones,
+    ).all():
+        ident_key = norm_key_login(identity)
+        if not ident_key:
+            continue
+        key = login_to_key.get(ident_key) or f"_mfa_{ident_key}"
+        entries.append(_entry(
+            key, "mfa", rid, fio=norm(name), login=ident_key, email=norm(email), phones=(norm(phones),),
+        ))
+
+    db.query(SearchEntry).delete()
+    if entries:
+        db.bulk_insert_mappings(SearchEntry, entries)
+    if IS_SQLITE:
+        db.execute(text("INSERT INTO search_fts(search_fts) VALUES('rebuild')"))
+    logger.info("[search] Индекс пересобран: %d записей", len(entries))
+    return len(entries)
+
+
+def _match_keys(db: Session, tokens: list[str], limit: int) -> list[str]:
+    """Возвращает ключи пользователей, отсортированные по релевантности."""
+    if IS_SQLITE:
+        # Все токены обязательны, каждый — как префикс ("иван"* AND "петр"*)
+        fts_query = " AND ".join(f'"{t}"*' for t in tokens)
+        rows = db.execute(text(
+            "SELECT e.user_key, MIN(f.rank) AS score "
+            "FROM search_fts f JOIN search_entries e ON e.id = f.rowid "
+            "WHERE search_fts MATCH :q "
+            "GROUP BY e.user_key ORDER BY score LIMIT :n"
+        ), {"q": fts_query, "n": limit}).all()
+        return [r[0] for r in rows]
+
+    q = db.query(SearchEntry.user_key)
+    for t in tokens:
+        q = q.filter(SearchEntry.search_text.like(f"%{t}%"))
+    rows = q.group_by(SearchEntry.user_key).order_by(func.min(SearchEntry.fio)).limit(limit).all()
+    return [r[0] for r in rows]
+
+
+@router.get("")
+def search(
+    q: str = Query(..., description="Строка поиска: ФИО, логин, email, телефон, должность, отдел"),
+    limit: int = Query(20, ge=1, le=100, description="Максимум результатов"),
+    db: Session = Depends(get_db),
+):
+    """Поиск пользователей по префиксам слов. Возвращает top-N ключей для карточки."""
+    tokens = [_fold(t) for t in _TOKEN_RE.findall(q)]
+    if not tokens:
+        return {"query": q, "results": [], "total": 0}
+
+    keys = _match_keys(db, tokens, limit)
+    if not keys:
+        return {"query": q, "results": [], "total": 0}
+
+    recs = db.query(
+        SearchEntry.user_key, SearchEntry.source, SearchEntry.record_id,
+    ).filter(SearchEntry.user_key.in_(keys)).all()
+    ids_by_source: dict[str, set[int]] = {"ad": set(), "mfa": set(), "people": set()}
+    for _k, source, rid in recs:
+        ids_by_source[source].add(rid)
+
+    # Исходные (ненормализованные) значения для отображения
+    ad_info = {
+        r[0]: r for r in db.query(
+            ADRecord.id, ADRecord.ad_source, ADRecord.login, ADRecord.display_name,
+            ADRecord.email, ADRecord.title, ADRecord.department,
+        ).filter(ADRecord.id.in_(ids_by_source["ad"])).all()
+    } if ids_by_source["ad"] else {}
+    people_info = {
+        r[0]: r for r in db.query(
+            PeopleRecord.id, PeopleRecord.fio, PeopleRecord.email, PeopleRecord.unit,
+        ).filter(PeopleRecord.id.in_(ids_by_source["people"])).all()
+    } if ids_by_source["people"] else {}
+    mfa_info = {
+        r[0]: r for r in db.query(
+            MFARecord.id, MFARecord.identity, MFARecord.name, MFARecord.email,
+        ).filter(MFARecord.id.in_(ids_by_source["mfa"])).all()
+    } if ids_by_source["mfa"] else {}
+
+    results: dict[str, dict] = {
+        k: {"key": k, "fio": "", "logins": [], "emails": [], "title": "", "department": "",
+            "sources": set(), "_prio": 99}
+        for k in keys
+    }
+    for key, source, rid in recs:
+        res = results[key]
+        fio = email = ""
+        if source == "ad" and rid in ad_info:
+            _id, ad_source, login, fio, email, title, dept = ad_info[rid]
+            login = norm(login)
+            if login and login not in res["logins"]:
+                res["logins"].append(login)
+            res["title"] = res["title"] or norm(title)
+            res["department"] = res["department"] or norm(dept)
+            res["sources"].add(AD_LABELS.get(ad_source, "AD"))
+        elif source == "people" and rid in people_info:
+            _id, fio, email, unit = people_info[rid]
+            res["department"] = res["department"] or norm(unit)
+            res["sources"].add("Кадры")
+        elif source == "mfa" and rid in mfa_info:
+            _id, identity, fio, email = mfa_info[rid]
+            identity = norm(identity)
+            if key.startswith("_mfa_") and identity not in res["logins"]:
+                res["logins"].append(identity)
+            res["sources"].add("MFA")
+        fio, email = norm(fio), norm(email)
+        if fio and _SOURCE_PRIORITY[source] < res["_prio"]:
+            res["fio"], res["_prio"] = fio, _SOURCE_PRIORITY[source]
+        if email and email.lower() not in {e.lower() for e in res["emails"]}:
+            res["emails"].append(email)
+
+    out = []
+    for k in keys:
+        res = results[k]
+        res.pop("_prio")
+        res["sources"] = sorted(res["sources"])
+        out.append(res)
+    return {"query": q, "results": out, "total": len(out)}
@@ -1,20 +1,43 @@
 # -*- coding: utf-8 -*-
 """Модуль аналитики безопасности учётных записей AD."""
-import re
-from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from itertools import accumulate
+
+import numpy as np
+import pandas as pd
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
 
-from app.database import get_db, ADRecord
-from app.config import AD_LABELS, AD_DOMAINS
-from app.consolidation import load_ou_rules, compute_account_type
+from app.database import get_db, get_setting, ADRecord, AgeHistogram
+from app.config import AD_LABELS, AD_DOMAINS, SECURITY_INACTIVE_DAYS, SECURITY_STALE_PASSWORD_DAYS
+from app.dataset import get_dataset
 from app.utils import norm, enabled_str
+from app.responses import fast_json, to_columnar, table_response, TABLE_FORMATS
 
 router = APIRouter(prefix="/api/security", tags=["security"])
 
-# Пороги (дни)
-INACTIVE_DAYS = 90
-STALE_PASSWORD_DAYS = 180
+# Пороги (дни): ключ → (настройка в app_settings, значение по умолчанию)
+THRESHOLDS = {
+    "inactive_days": ("security.inactive_days", SECURITY_INACTIVE_DAYS),
+    "stale_password_days": ("security.stale_password_days", SECURITY_STALE_PASSWORD_DAYS),
+}
+
+# Наибольший порог «что если» для /age-stats (дни, ~100 лет)
+MAX_AGE_DAYS = 36500
+
+
+def load_thresholds(db: Session) -> dict[str, int]:
+    """Пороги проверок из настроек, fallback на config."""
+    result = {}
+    for key, (setting, default) in THRESHOLDS.items():
+        try:
+            result[key] = int(get_setting(db, setting) or default)
+        except ValueError:
+            result[key] = default
+    return result
+
 
 def _to_dt(val) -> datetime | None:
     """Извлекает datetime из значения поля. Поддерживает datetime и строки."""
@@ -33,20 +56,11 @@ def _to_dt(val) -> datetime | None:
     return None
 
 
-def _is_true(val: str) -> bool:
-    return norm(val).lower() in ("true", "1", "да", "yes")
-
-
-def _is_enabled(r: ADRecord) -> bool:
-    return enabled_str(r.enabled) == "Да"
-
-
-def _user_link(r: ADRecord, ou_rules: dict | None = None) -> dict:
+def _user_link(r) -> dict:
     """Минимальный словарь для отображения в таблице."""
     uuid = norm(r.staff_uuid)
     login = norm(r.login)
     key = uuid.lower() if uuid else f"_login_{login.lower()}" if login else ""
-    at = compute_account_type(r.ad_source or "", norm(r.distinguished_name), ou_rules) if ou_rules else ""
     return {
         "key": key,
         "login": login,
@@ -54,130 +68,250 @@ def _user_link(r: ADRecord, ou_rules: dict | None = None) -> dict:
         "ad_source": r.ad_source or "",
         "domain": AD_LABELS.get(r.ad_source, r.ad_source or ""),
         "enabled": enabled_str(r.enabled),
-        "account_type": at,
+        "account_type": r.account_type,
         "distinguished_name": norm(r.distinguished_name),
     }
 
 
-# ─── Категории проверок ──────────────────────────────────────
+# ─── Движок проверок ─────────────────────────────────────────
+# Все категории считаются за один проход по колонкам снимка (app.dataset):
+# булевы маски строятся векторно, флаги берутся из типизированных колонок
+# (app.ad_flags), разобранных при загрузке. Результат — позиции записей по категориям; строки
+# отчёта формируются только при выдаче.
+
+def _flag(df: pd.DataFrame, col: str) -> np.ndarray:
+    """Булева маска по типизированной колонке флага (app.ad_flags; неизвестно → False)."""
+    return df[col].to_numpy(dtype=bool)
+
+
+def _dates(df: pd.DataFrame, dt_col: str, fallback_col: str) -> np.ndarray:
+    """Дата из DateTime-колонки, при её отсутствии — из строковой (разбор по уникальным значениям)."""
+    dt = pd.to_datetime(df[dt_col], errors="coerce").to_numpy(dtype="datetime64[us]", copy=True)
+    missing = np.isnat(dt)
+    if missing.any():
+        codes, uniques = pd.factorize(df[fallback_col].to_numpy()[missing])
+        parsed = np.array([_to_dt(v) or np.datetime64("NaT") for v in uniques], dtype="datetime64[us]")
+        if len(parsed):
+            dt[missing] = parsed[codes]
+    return dt
+
+
+class _Findings:
+    """Результат всех проверок для одного снимка данных."""
+
+    def __init__(self, ds, today: date, thresholds: dict[str, int]):
+        ad = ds.ad
+        self.rows = ds.ad_rows
+        n = len(ad)
+        enabled = _flag(ad, "enabled_flag")
+        self.enabled = enabled
+
+        spn = ad["service_principal_names"].map(norm).to_numpy(dtype=object)
+        # Возраст считается в календарных днях — так же, как в AgeHistogram
+        logon = _dates(ad, "last_logon_date", "last_logon_timestamp").astype("datetime64[D]")
+        pwd_set = _dates(ad, "password_last_set", "pwd_last_set").astype("datetime64[D]")
+        today64 = np.datetime64(today, "D")
+        inactive_cutoff = today64 - thresholds["inactive_days"]
+        stale_cutoff = today64 - thresholds["stale_password_days"]
+
+        group_count = np.zeros(n, dtype=np.int64)
+        disabled_in_groups = ~enabled & (ad["groups"] != "").to_numpy()
+        for i in np.flatnonzero(disabled_in_groups):
+            group_count[i] = len([g for g in norm(self.rows[i].groups).split(";") if g.strip()])
+
+        masks = {
+            "pwd_never_expires": enabled & _flag(ad, "password_never_expires_flag"),
+            "pwd_not_required": enabled & _flag(ad, "password_not_required_flag"),
+            "reversible_encryption": _flag(ad, "reversible_encryption_flag"),
+            "no_preauth": enabled & _flag(ad, "no_preauth_flag"),
+            "unconstrained_delegation": _flag(ad, "trusted_for_delegation_flag"),
+            "protocol_transition": _flag(ad, "protocol_transition_flag"),
+            "spn_kerberoasting": enabled & (spn != ""),
+            "locked_out": _flag(ad, "locked_out_flag"),
+            "must_change_password": enabled & _flag(ad, "must_change_password_flag"),
+            "password_expired": enabled & _flag(ad, "password_expired_flag"),
+            "inactive_accounts": enabled & (np.isnat(logon) | (logon < inactive_cutoff)),
+            "stale_passwords": enabled & ~np.isnat(pwd_set) & (pwd_set < stale_cutoff),
+            "disabled_with_groups": disabled_in_groups & (group_count > 1),
+        }
+        self.positions = {cid: np.flatnonzero(m) for cid, m in masks.items()}
+        self._items: dict[str, list[dict]] = {}
+        self._sort_keys: dict[str, np.ndarray] = {}
+        # Числовые ключи сортировки доп. колонок («никогда» — бесконечно давно)
+        self._numeric_keys = {
+            "inactive_accounts": {"days_ago": _age_days(logon, today64)},
+            "stale_passwords": {"days_ago": _age_days(pwd_set, today64)},
+            "disabled_with_groups": {"group_count": group_count},
+        }
+
+        # Доп. колонки категорий (вычисляются при выдаче строк)
+        def days_ago(day64) -> str:
+            return str(int((today64 - day64).astype(int)))
+
+        self._extra = {
+            "spn_kerberoasting": lambda i: {"spn": spn[i]},
+            "inactive_accounts": lambda i: (
+                {"last_logon": "никогда", "days_ago": "∞"} if np.isnat(logon[i])
+                else {"last_logon": _fmt_day(logon[i]), "days_ago": days_ago(logon[i])}
+            ),
+            "stale_passwords": lambda i: {
+                "password_last_set": _fmt_day(pwd_set[i]), "days_ago": days_ago(pwd_set[i]),
+            },
+            "disabled_with_groups": lambda i: {"group_count": int(group_count[i])},
+        }
+
+    def count(self, cat_id: str, mask: np.ndarray | None = None) -> int:
+        pos = self.positions[cat_id]
+        return int(mask[pos].sum()) if mask is not None else len(pos)
+
+    def select(self, cat_id: str, mask: np.ndarray | None = None, sort: str = "", desc: bool = False) -> np.ndarray:
+        """Позиции записей категории с учётом фильтра и сортировки."""
+        pos = self.positions[cat_id]
+        if mask is not None:
+            pos = pos[mask[pos]]
+        if sort:
+            keys = self._numeric_keys.get(cat_id, {}).get(sort)
+            if keys is None:
+                keys = self._sort_key(sort)
+            order = np.argsort(keys[pos], kind="stable")
+            pos = pos[order[::-1] if desc else order]
+        return pos
+
+    def _sort_key(self, field: str) -> np.ndarray:
+        """Строковый ключ сортировки по полю строки отчёта (строится один раз)."""
+        if field not in self._sort_keys:
+            if field == "display_name":
+                vals = [(norm(r.display_name) or norm(r.login)).lower() for r in self.rows]
+            elif field == "domain":
+                vals = [AD_LABELS.get(r.ad_source, r.ad_source or "") for r in self.rows]
+            elif field == "enabled":
+                vals = [enabled_str(r.enabled) for r in self.rows]
+            elif field in ("days_ago", "group_count"):
+                vals = [0] * len(self.rows)
+            else:
+                vals = [norm(getattr(r, field)).lower() for r in self.rows]
+            self._sort_keys[field] = np.array(vals, dtype=object)
+        return self._sort_keys[field]
+
+    def items(self, cat_id: str, positions=None) -> list[dict]:
+        """Строки отчёта категории (по умолчанию — все найденные записи, кэшируются)."""
+        if positions is None:
+            if cat_id not in self._items:
+                self._items[cat_id] = self.items(cat_id, self.positions[cat_id])
+            return self._items[cat_id]
+        extra = self._extra.get(cat_id)
+        result = []
+        for i in positions:
+            item = _user_link(self.rows[i])
+            if extra:
+                item.update(extra(i))
+            result.append(item)
+        return result
 
-def _check_password_never_expires(records: list[ADRecord], ou_rules: dict) -> list[dict]:
-    return [_user_link(r, ou_rules) for r in records
-            if _is_enabled(r) and _is_true(getattr(r, "password_never_expires", ""))]
 
+def _age_days(days: np.ndarray, today64) -> np.ndarray:
+    """Возраст даты (datetime64[D]) в днях; для отсутствующей — бесконечность."""
+    out = np.full(len(days), np.inf)
+    known = ~np.isnat(days)
+    out[known] = (today64 - days[known]).astype(int)
+    return out
 
-def _check_password_not_required(records: list[ADRecord], ou_rules: dict) -> list[dict]:
-    return [_user_link(r, ou_rules) for r in records
-            if _is_enabled(r) and _is_true(getattr(r, "password_not_required", ""))]
 
+def _fmt_day(dt64) -> str:
+    return pd.Timestamp(dt64).strftime("%d.%m.%Y")
 
-def _check_reversible_encryption(records: list[ADRecord], ou_rules: dict) -> list[dict]:
-    return [_user_link(r, ou_rules) for r in records
-            if _is_true(getattr(r, "allow_reversible_password_encryption", ""))]
 
+def _split(value: str) -> list[str]:
+    """'a, b,c' → ['a', 'b', 'c']"""
+    return [v.strip() for v in value.split(",") if v.strip()]
 
-def _check_no_preauth(records: list[ADRecord], ou_rules: dict) -> list[dict]:
-    return [_user_link(r, ou_rules) for r in records
-            if _is_enabled(r) and _is_true(getattr(r, "does_not_require_preauth", ""))]
 
+def _filter_mask(ds, domains: str, types: str) -> np.ndarray | None:
+    """Маска AD-записей по доменам (ad_source) и типам УЗ; None — без фильтра."""
+    mask = None
+    for col, value in (("ad_source", domains), ("account_type", types)):
+        wanted = _split(value)
+        if wanted:
+            m = ds.ad[col].isin(wanted).to_numpy()
+            mask = m if mask is None else mask & m
+    return mask
 
-def _check_unconstrained_delegation(records: list[ADRecord], ou_rules: dict) -> list[dict]:
-    return [_user_link(r, ou_rules) for r in records
-            if _is_true(getattr(r, "trusted_for_delegation", ""))]
 
+def _get_findings(ds, thresholds: dict[str, int]) -> _Findings:
+    """Проверки кэшируются на снимок данных (до следующей записи), календарный день и пороги."""
+    today = date.today()
+    key = ("security.findings", today, tuple(sorted(thresholds.items())))
+    return ds.memo(key, lambda: _Findings(ds, today, thresholds))
 
-def _check_protocol_transition(records: list[ADRecord], ou_rules: dict) -> list[dict]:
-    return [_user_link(r, ou_rules) for r in records
-            if _is_true(getattr(r, "trusted_to_auth_for_delegation", ""))]
 
+# ─── Гистограммы возраста ───────────────────────────────────
+# Для активных УЗ по каждому домену хранится число записей на каждую дату
+# последнего входа / смены пароля. Любой порог «старше N дней» — префиксная
+# сумма по отсортированным датам, без обхода записей.
 
-def _check_spn_kerberoasting(records: list[ADRecord], ou_rules: dict) -> list[dict]:
-    """Пользовательские УЗ с SPN (потенциальный Kerberoasting)."""
-    result = []
-    for r in records:
-        if not _is_enabled(r):
-            continue
-        spn = norm(getattr(r, "service_principal_names", ""))
-        if spn:
-            item = _user_link(r, ou_rules)
-            item["spn"] = spn
-            result.append(item)
-    return result
+AGE_METRICS = ("last_logon", "password_set")
 
 
-def _check_locked_out(records: list[ADRecord], ou_rules: dict) -> list[dict]:
-    return [_user_link(r, ou_rules) for r in records
-            if _is_true(getattr(r, "locked_out", ""))]
+def rebuild_age_histograms(db: Session) -> int:
+    """Пересобирает age_histograms по текущим AD-записям (в той же транзакции)."""
+    counts: Counter = Counter()
+    for ad_source, lld, llt, pls, pwd in db.query(
+        ADRecord.ad_source, ADRecord.last_logon_date, ADRecord.last_logon_timestamp,
+        ADRecord.password_last_set, ADRecord.pwd_last_set,
+    ).filter(ADRecord.enabled_flag.is_(True)).all():
+        logon = _to_dt(lld) or _to_dt(llt)
+        pwd_set = _to_dt(pls) or _to_dt(pwd)
+        counts[(ad_source or "", "last_logon", logon.date() if logon else None)] += 1
+        counts[(ad_source or "", "password_set", pwd_set.date() if pwd_set else None)] += 1
 
+    db.query(AgeHistogram).delete()
+    if counts:
+        db.bulk_insert_mappings(AgeHistogram, [
+            {"ad_source": src, "metric": metric, "day": day, "count": n}
+            for (src, metric, day), n in counts.items()
+        ])
+    return len(counts)
 
-def _check_must_change_password(records: list[ADRecord], ou_rules: dict) -> list[dict]:
-    return [_user_link(r, ou_rules) for r in records
-            if _is_enabled(r) and norm(r.must_change_password).lower() in ("да", "true", "yes", "1")]
 
+class _AgeIndex:
+    """Гистограмма одного домена и метрики: отсортированные даты и накопленные суммы."""
 
-def _check_password_expired(records: list[ADRecord], ou_rules: dict) -> list[dict]:
-    return [_user_link(r, ou_rules) for r in records
-            if _is_enabled(r) and _is_true(getattr(r, "password_expired", ""))]
+    def __init__(self):
+        self.never = 0
+        self.days: list[date] = []
+        self.cumulative: list[int] = []
 
+    def add(self, day: date | None, count: int):
+        if day is None:
+            self.never += count
+        else:
+            self.days.append(day)
+            self.cumulative.append(count)
 
-def _check_inactive_accounts(records: list[ADRecord], days: int, ou_rules: dict) -> list[dict]:
-    """Активные УЗ, последний вход которых был более N дней назад."""
-    cutoff = datetime.now() - timedelta(days=days)
-    result = []
-    for r in records:
-        if not _is_enabled(r):
-            continue
-        dt = _to_dt(getattr(r, "last_logon_date", None))
-        if dt is None:
-            dt = _to_dt(getattr(r, "last_logon_timestamp", None))
-        if dt is None:
-            item = _user_link(r, ou_rules)
-            item["last_logon"] = "никогда"
-            item["days_ago"] = "∞"
-            result.append(item)
-        elif dt < cutoff:
-            item = _user_link(r, ou_rules)
-            item["last_logon"] = dt.strftime("%d.%m.%Y")
-            item["days_ago"] = str((datetime.now() - dt).days)
-            result.append(item)
-    return result
+    def finish(self):
+        order = sorted(range(len(self.days)), key=self.days.__getitem__)
+        self.days = [self.days[i] for i in order]
+        self.cumulative = list(accumulate(self.cumulative[i] for i in order))
 
+    @property
+    def total(self) -> int:
+        return self.never + (self.cumulative[-1] if self.cumulative else 0)
 
-def _check_stale_passwords(records: list[ADRecord], days: int, ou_rules: dict) -> list[dict]:
-    """Активные УЗ, пароль которых не менялся более N дней."""
-    cutoff = datetime.now() - timedelta(days=days)
-    result = []
-    for r in records:
-        if not _is_enabled(r):
-            continue
-        dt = _to_dt(r.password_last_set)
-        if dt is None:
-            dt = _to_dt(getattr(r, "pwd_last_set", None))
-        if dt is None:
-            continue
-        if dt < cutoff:
-            item = _user_link(r, ou_rules)
-            item["password_last_set"] = dt.strftime("%d.%m.%Y")
-            item["days_ago"] = str((datetime.now() - dt).days)
-            result.append(item)
-    return result
+    def older_than(self, cutoff: date) -> int:
+        """Записей с датой строго раньше cutoff."""
+        i = bisect_left(self.days, cutoff)
+        return self.cumulative[i - 1] if i else 0
 
 
-def _check_disabled_with_groups(records: list[ADRecord], ou_rules: dict) -> list[dict]:
-    """Отключённые УЗ, всё ещё состоящие в группах безопасности."""
-    result = []
-    for r in records:
-        if _is_enabled(r):
-            continue
-        groups = norm(r.groups)
-        if not groups:
-            continue
-        count = len([g for g in groups.split(";") if g.strip()])
-        if count > 1:
-            item = _user_link(r, ou_rules)
-            item["group_count"] = count
-            result.append(item)
-    return result
+def _load_age_index(db: Session, metric: str) -> dict[str, _AgeIndex]:
+    index: dict[str, _AgeIndex] = defaultdict(_AgeIndex)
+    for ad_source, day, count in db.query(
+        AgeHistogram.ad_source, AgeHistogram.day, AgeHistogram.count,
+    ).filter(AgeHistogram.metric == metric).all():
+        index[ad_source].add(day, count)
+    for h in index.values():
+        h.finish()
+    return index
 
 
 # ─── API ─────────────────────────────────────────────────────
@@ -255,9 +389,9 @@ CATEGORIES = [
     },
     {
         "id": "inactive_accounts",
-        "title": f"Неактивные УЗ (>{INACTIVE_DAYS} дней)",
+        "title": "Неактивные УЗ (>{inactive_days} дней)",
         "severity": "medium",
-        "description": f"Активные УЗ без входа более {INACTIVE_DAYS} дней. Кандидаты на отключение.",
+        "description": "Активные УЗ без входа более {inactive_days} дней. Кандидаты на отключение.",
         "columns": [
             {"key": "last_logon", "label": "Последний вход"},
             {"key": "days_ago", "label": "Дней назад"},
@@ -265,9 +399,9 @@ CATEGORIES = [
     },
     {
         "id": "stale_passwords",
-        "title": f"Старые пароли (>{STALE_PASSWORD_DAYS} дней)",
+        "title": "Старые пароли (>{stale_password_days} дней)",
         "severity": "medium",
-        "description": f"Активные УЗ, пароль которых не менялся более {STALE_PASSWORD_DAYS} дней.",
+        "description": "Активные УЗ, пароль которых не менялся более {stale_password_days} дней.",
         "columns": [
             {"key": "password_last_set", "label": "Пароль изменён"},
             {"key": "days_ago", "label": "Дней назад"},
@@ -282,30 +416,28 @@ CATEGORIES = [
     },
 ]
 
-_CHECK_FN = {
-    "pwd_never_expires": _check_password_never_expires,
-    "pwd_not_required": _check_password_not_required,
-    "reversible_encryption": _check_reversible_encryption,
-    "no_preauth": _check_no_preauth,
-    "unconstrained_delegation": _check_unconstrained_delegation,
-    "protocol_transition": _check_protocol_transition,
-    "spn_kerberoasting": _check_spn_kerberoasting,
-    "locked_out": _check_locked_out,
-    "must_change_password": _check_must_change_password,
-    "password_expired": _check_password_expired,
-    "inactive_accounts": lambda recs, rules: _check_inactive_accounts(recs, INACTIVE_DAYS, rules),
-    "stale_passwords": lambda recs, rules: _check_stale_passwords(recs, STALE_PASSWORD_DAYS, rules),
-    "disabled_with_groups": _check_disabled_with_groups,
-}
+
+def _category_info(cat: dict, thresholds: dict[str, int]) -> dict:
+    """Описание категории для ответа (пороги подставляются в заголовок и описание)."""
+    return {
+        "id": cat["id"],
+        "title": cat["title"].format(**thresholds),
+        "severity": cat["severity"],
+        "description": cat["description"].format(**thresholds),
+        "extra_columns": cat["columns"],
+    }
 
 
 @router.get("/findings")
-def security_findings(db: Session = Depends(get_db)):
+def security_findings(
+    response: Response,
+    fmt: str = Query("rows", alias="format", pattern=TABLE_FORMATS, description="rows | columnar"),
+    db: Session = Depends(get_db),
+):
     """Полный отчёт по всем категориям безопасности."""
-    records = db.query(ADRecord).all()
-    ou_rules = load_ou_rules(db)
-    total_accounts = len(records)
-    total_enabled = sum(1 for r in records if _is_enabled(r))
+    ds = get_dataset(db)
+    thresholds = load_thresholds(db)
+    f = _get_findings(ds, thresholds)
 
     findings = []
     total_issues = 0
@@ -313,37 +445,173 @@ def security_findings(db: Session = Depends(get_db)):
     high_count = 0
 
     for cat in CATEGORIES:
-        fn = _CHECK_FN[cat["id"]]
-        items = fn(records, ou_rules)
-        count = len(items)
+        count = f.count(cat["id"])
         total_issues += count
         if cat["severity"] == "critical":
             critical_count += count
         elif cat["severity"] == "high":
             high_count += count
+        items = f.items(cat["id"])
         findings.append({
-            "id": cat["id"],
-            "title": cat["title"],
-            "severity": cat["severity"],
-            "description": cat["description"],
-            "extra_columns": cat["columns"],
+            **_category_info(cat, thresholds),
             "count": count,
-            "items": items,
+            "items": to_columnar(items) if fmt == "columnar" else items,
         })
 
     # Доступные домены (только те, для которых есть записи)
-    loaded_sources = sorted({r.ad_source for r in records if r.ad_source})
+    loaded_sources = sorted(ds.ad_count_by_source())
     available_domains = [
         {"key": s, "label": AD_DOMAINS.get(s, s)}
-        for s in loaded_sources
+        for s in loaded_sources if s
     ]
 
-    return {
-        "total_accounts": total_accounts,
-        "total_enabled": total_enabled,
+    result = {
+        "total_accounts": len(ds.ad),
+        "total_enabled": int(f.enabled.sum()),
         "total_issues": total_issues,
         "critical_count": critical_count,
         "high_count": high_count,
         "findings": findings,
         "available_domains": available_domains,
     }
+    if fmt == "columnar":
+        result["format"] = "columnar"
+    return fast_json(result, response)
+
+
+# Поля строки отчёта, по которым возможна серверная сортировка
+_SORT_FIELDS = "^(|display_name|login|domain|enabled|account_type|days_ago|group_count)$"
+
+
+@router.get("/summary")
+def security_summary(
+    domains: str = Query("", description="Домены (ad_source) через запятую"),
+    types: str = Query("", description="Типы УЗ через запятую"),
+    severity: str = Query("", description="Уровни критичности через запятую"),
+    db: Session = Depends(get_db),
+):
+    """Сводка без строк: количество замечаний по категориям с учётом фильтров."""
+    ds = get_dataset(db)
+    thresholds = load_thresholds(db)
+    f = _get_findings(ds, thresholds)
+    mask = _filter_mask(ds, domains, types)
+    severities = set(_split(severity))
+
+    findings = []
+    total_issues = critical_count = high_count = 0
+    for cat in CATEGORIES:
+        if severities and cat["severity"] not in severities:
+            continue
+        count = f.count(cat["id"], mask)
+        total_issues += count
+        if cat["severity"] == "critical":
+            critical_count += count
+        elif cat["severity"] == "high":
+            high_count += count
+        findings.append({**_category_info(cat, thresholds), "count": count})
+
+    return {
+        "total_accounts": int(mask.sum()) if mask is not None else len(ds.ad),
+        "total_enabled": int((f.enabled & mask).sum()) if mask is not None else int(f.enabled.sum()),
+        "total_issues": total_issues,
+        "critical_count": critical_count,
+        "high_count": high_count,
+        "findings": findings,
+        "available_domains": [
+            {"key": s, "label": AD_DOMAINS.get(s, s)} for s in sorted(ds.ad_count_by_source()) if s
+        ],
+        "account_types": sorted(t for t in ds.ad["account_type"].unique() if t),
+    }
+
+
+@router.get("/findings/{finding_id}")
+def security_finding(
+    finding_id: str,
+    response: Response,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(100, ge=1, le=1000),
+    sort: str = Query("", pattern=_SORT_FIELDS, description="Поле сортировки (по умолчанию — порядок загрузки)"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    domains: str = Query("", description="Домены (ad_source) через запятую"),
+    types: str = Query("", description="Типы УЗ через запятую"),
+    severity: str = Query("", description="Уровни критичности через запятую"),
+    fmt: str = Query("rows", alias="format", pattern=TABLE_FORMATS, description="rows | columnar"),
+    db: Session = Depends(get_db),
+):
+    """Строки одной категории: страница с сортировкой и фильтрами по домену, типу УЗ и критичности."""
+    cat = next((c for c in CATEGORIES if c["id"] == finding_id), None)
+    if cat is None:
+        raise HTTPException(404, f"Неизвестная категория: {finding_id}")
+
+    ds = get_dataset(db)
+    thresholds = load_thresholds(db)
+    f = _get_findings(ds, thresholds)
+    severities = set(_split(severity))
+    if severities and cat["severity"] not in severities:
+        positions = np.empty(0, dtype=np.int64)
+    else:
+        positions = f.select(finding_id, _filter_mask(ds, domains, types), sort, order == "desc")
+
+    start = (page - 1) * page_size
+    items = f.items(finding_id, positions[start:start + page_size])
+    return table_response({
+        **_category_info(cat, thresholds),
+        "count": len(positions),
+        "page": page,
+        "page_size": page_size,
+        "items": items,
+    }, "items", fmt, response)
+
+
+@router.get("/age-stats")
+def security_age_stats(
+    metric: str = Query("last_logon", pattern="^(last_logon|password_set)$",
+                        description="last_logon — давность входа, password_set — давность смены пароля"),
+    days: str = Query("", description="Пороги в днях через запятую (по умолчанию — текущий порог)"),
+    domains: str = Query("", description="Домены (ad_source) через запятую"),
+    db: Session = Depends(get_db),
+):
+    """
+    Сколько активных УЗ старше каждого из порогов («что если 60/120/365 дней»).
+    Считается по гистограммам, построенным при загрузке. Для last_logon УЗ без
+    входов («никогда») входят в каждый порог, для password_set — не входят.
+    """
+    thresholds = load_thresholds(db)
+    current = thresholds["inactive_days" if metric == "last_logon" else "stale_password_days"]
+    try:
+        day_list = sorted({int(d) for d in _split(days)}) or [current]
+    except ValueError:
+        raise HTTPException(400, "Пороги должны быть целыми числами дней")
+    if any(d < 0 for d in day_list):
+        raise HTTPException(400, "Пороги не могут быть отрицательными")
+    if day_list[-1] > MAX_AGE_DAYS:
+        raise HTTPException(400, f"Порог не может превышать {MAX_AGE_DAYS} дней")
+
+    index = _load_age_index(db, metric)
+    wanted = set(_split(domains))
+    today = date.today()
+    cutoffs = {d: today - timedelta(days=d) for d in day_list}
+
+    def counts(h_list: list[_AgeIndex]) -> dict:
+        never = sum(h.never for h in h_list)
+        extra = never if metric == "last_logon" else 0
+        return {
+            "total_enabled": sum(h.total for h in h_list),
+            "never": never,
+            "older_than": {str(d): sum(h.older_than(c) for h in h_list) + extra for d, c in cutoffs.items()},
+        }
+
+    result_domains = []
+    for key in sorted(index):
+        if wanted and key not in wanted:
+            continue
+        result_domains.append({"key": key, "label": AD_DOMAINS.get(key, key), **counts([index[key]])})
+
+    return {
+        "metric": metric,
+        "as_of": today.isoformat(),
+        "current_threshold": current,
+        "days": day_list,
+        "domains": result_domains,
+        "total": counts([index[k] for k in index if not wanted or k in wanted]),
+    }
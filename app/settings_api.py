@@ -9,6 +9,8 @@ from sqlalchemy.orm import Session
 
 from app.database import get_db, get_setting, set_setting, AppSetting, AppUser
 from app.auth import require_admin, encrypt_value, decrypt_value, hash_password
+from app.data_version import bump_data_version
+from app.security import THRESHOLDS, load_thresholds
 import json
 from app.config import AD_DOMAINS, AD_ACCOUNT_TYPE_RULES, ACCOUNT_TYPES
 
@@ -78,6 +80,7 @@ async def update_ldap_settings(
         set_setting(db, "jwt.expire_hours", str(payload["jwt_expire_hours"]))
 
     db.commit()
+    bump_data_version()
     return {"ok": True}
 
 
@@ -167,6 +170,7 @@ async def add_user(
     )
     db.add(user)
     db.commit()
+    bump_data_version()
     db.refresh(user)
     return {"ok": True, "id": user.id}
 
@@ -198,6 +202,7 @@ async def update_user(
             raise HTTPException(400, "Нельзя заблокировать себя")
         user.is_active = payload["is_active"]
     db.commit()
+    bump_data_version()
     return {"ok": True}
 
 
@@ -214,6 +219,7 @@ async def delete_user(
         raise HTTPException(400, "Нельзя удалить себя")
     db.delete(user)
     db.commit()
+    bump_data_version()
     return {"ok": True}
 
 
@@ -264,6 +270,7 @@ async def update_ou_rules(
                 raise HTTPException(400, f"Недопустимый тип: {rule[1]}")
     set_setting(db, "ou_type_rules", json.dumps(rules, ensure_ascii=False))
     db.commit()
+    bump_data_version()
     return {"ok": True}
 
 
@@ -276,4 +283,35 @@ async def reset_ou_rules(
     defaults = {k: [list(t) for t in v] for k, v in AD_ACCOUNT_TYPE_RULES.items()}
     set_setting(db, "ou_type_rules", json.dumps(defaults, ensure_ascii=False))
     db.commit()
+    bump_data_version()
     return {"ok": True, "rules": defaults}
+
+
+# ── Security thresholds ───────────────────────────────────
+
+@router.get("/security")
+async def get_security_settings(
+    _user: dict = Depends(require_admin),
+    db: Session = Depends(get_db),
+):
+    """Пороги проверок безопасности (дни)."""
+    return load_thresholds(db)
+
+
+@router.put("/security")
+async def update_security_settings(
+    payload: dict[str, Any] = Body(...),
+    _user: dict = Depends(require_admin),
+    db: Session = Depends(get_db),
+):
+    """Обновить пороги проверок безопасности."""
+    for key, value in payload.items():
+        if key not in THRESHOLDS:
+            raise HTTPException(400, f"Неизвестный параметр: {key}")
+        if not isinstance(value, int) or isinstance(value, bool) or not 1 <= value <= 3650:
+            raise HTTPException(400, f"{key}: целое число дней от 1 до 3650")
+    for key, value in payload.items():
+        set_setting(db, THRESHOLDS[key][0], str(value))
+    db.commit()
+    bump_data_version()
+    return {"ok": True, **load_thresholds(db)}
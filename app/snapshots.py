@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Архив загрузок: снимок каждой загрузки в Parquet (zstd).
+
+Разобранные строки загрузки (AD-файл или LDAP-синхронизация, MFA, Кадры)
+записываются в DATA_DIR/snapshots с разбиением по источнику и домену:
+
+    snapshots/source=ad/domain=izhevsk/000042_20260101T120000.parquet
+    snapshots/source=mfa/000043_20260101T121500.parquet
+
+Путь и размер снимка хранятся в строке uploads (каталог). Повторный импорт
+и исторический анализ читают колоночный файл вместо повторного разбора
+CSV/XLSX. Схема файла повторяет колонки модели, в метаданных — id загрузки,
+источник и имя исходного файла.
+
+Требуется pyarrow; без него загрузки работают как раньше, без снимков.
+"""
+import json
+import logging
+import os
+
+from sqlalchemy import Boolean, DateTime, Integer
+
+from app.config import DATA_DIR
+from app.database import Upload
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    _HAS_PYARROW = True
+except ImportError:
+    _HAS_PYARROW = False
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = DATA_DIR / "snapshots"
+SNAPSHOT_COMPRESSION = "zstd"
+
+
+def is_available() -> bool:
+    return _HAS_PYARROW
+
+
+def _arrow_type(col):
+    if isinstance(col.type, Boolean):
+        return pa.bool_()
+    if isinstance(col.type, Integer):
+        return pa.int64()
+    if isinstance(col.type, DateTime):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def _schema(model, upload: Upload):
+    fields = [pa.field(c.name, _arrow_type(c)) for c in model.__table__.columns if c.name != "id"]
+    meta = {
+        "upload_id": str(upload.id),
+        "source": upload.source,
+        "filename": upload.filename or "",
+        "model": model.__tablename__,
+    }
+    return pa.schema(fields, metadata={"usersbi": json.dumps(meta, ensure_ascii=False)})
+
+
+def _partition(source: str) -> str:
+    """ad_izhevsk → source=ad/domain=izhevsk, mfa → source=mfa."""
+    if source.startswith("ad_"):
+        return os.path.join("source=ad", f"domain={source[3:]}")
+    return f"source={source}"
+
+
+def write_snapshot(upload: Upload, rows: list[dict], model) -> bool:
+    """
+    Пишет снимок загрузки и заполняет upload.snapshot_path / snapshot_bytes.
+    Ошибка записи не прерывает загрузку: снимка просто не будет (False).
+    """
+    if not _HAS_PYARROW:
+        return False
+    stamp = upload.uploaded_at.strftime("%Y%m%dT%H%M%S") if upload.uploaded_at else "0"
+    path = SNAPSHOT_DIR / _partition(upload.source) / f"{upload.id:06d}_{stamp}.parquet"
+    tmp = path.with_suffix(".tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        table = pa.Table.from_pylist(rows, schema=_schema(model, upload))
+        pq.write_table(table, tmp, compression=SNAPSHOT_COMPRESSION)
+        os.replace(tmp, path)
+    except Exception as e:
+        logger.warning("[snapshots] Снимок загрузки %s (%s) не записан: %s", upload.id, upload.source, e)
+        tmp.unlink(missing_ok=True)
+        return False
+    upload.snapshot_path = path.relative_to(DATA_DIR).as_posix()
+    upload.snapshot_bytes = path.stat().st_size
+    return True
+
+
+def snapshot_file(upload: Upload):
+    """Путь к файлу снимка или None, если снимка нет."""
+    if not upload.snapshot_path:
+        return None
+    path = DATA_DIR / upload.snapshot_path
+    return path if path.is_file() else None
+
+
+def read_snapshot(upload: Upload) -> list[dict]:
+    """Строки снимка (для повторного импорта)."""
+    path = snapshot_file(upload)
+    if path is None:
+        raise FileNotFoundError(upload.snapshot_path)
+    return pq.read_table(path).to_pylist()
@@ -1,13 +1,14 @@
 # -*- coding: utf-8 -*-
 """API-эндпоинты для анализа структуры OU Active Directory."""
 import re
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, Response
 from sqlalchemy.orm import Session
 
-from app.database import get_db, ADRecord
+from app.database import get_db
 from app.config import AD_DOMAINS
-from app.consolidation import load_ou_rules, compute_account_type
-from app.utils import norm, build_member_dict, sort_members
+from app.dataset import get_dataset
+from app.utils import build_member_dict, sort_members
+from app.responses import table_response, TABLE_FORMATS
 
 router = APIRouter(prefix="/api/structure", tags=["structure"])
 
@@ -23,10 +24,10 @@ def _parse_ou_path(dn: str) -> list[str]:
     return ous
 
 
-def _build_tree(records: list[tuple[str]]) -> dict:
+def _build_tree(dns) -> dict:
     """Строит вложенное дерево OU из списка distinguishedName."""
     root: dict = {"count": 0, "children": {}}
-    for (dn_str,) in records:
+    for dn_str in dns:
         path = _parse_ou_path(dn_str or "")
         if not path:
             continue
@@ -64,15 +65,13 @@ def _tree_to_list(node: dict) -> list[dict]:
 @router.get("/tree")
 def structure_tree(db: Session = Depends(get_db)):
     """Дерево OU по каждому домену AD."""
+    ds = get_dataset(db)
+    counts = ds.ad_count_by_source()
     domains = []
     for key, city in AD_DOMAINS.items():
-        records = db.query(ADRecord.distinguished_name).filter(
-            ADRecord.ad_source == key,
-            ADRecord.distinguished_name != "",
-            ADRecord.distinguished_name.isnot(None),
-        ).all()
-        tree = _build_tree(records)
-        total_users = db.query(ADRecord).filter(ADRecord.ad_source == key).count()
+        dns = ds.ad.loc[(ds.ad["ad_source"] == key) & (ds.ad["distinguished_name"] != ""), "distinguished_name"]
+        tree = _build_tree(dns)
+        total_users = counts.get(key, 0)
         domains.append({
             "key": key, "city": city,
             "total_users": total_users,
@@ -83,29 +82,26 @@ def structure_tree(db: Session = Depends(get_db)):
 
 @router.get("/members")
 def structure_members(
+    response: Response,
     path: str = Query(..., description="Путь OU через '/'"),
     domain: str = Query(..., description="Ключ домена"),
+    fmt: str = Query("rows", alias="format", pattern=TABLE_FORMATS, description="rows | columnar"),
     db: Session = Depends(get_db),
 ):
     """Список пользователей непосредственно в указанном OU."""
     city = AD_DOMAINS.get(domain, domain)
     target_parts = [p.strip() for p in path.split("/") if p.strip()]
 
-    records = db.query(ADRecord).filter(
-        ADRecord.ad_source == domain,
-        ADRecord.distinguished_name != "",
-        ADRecord.distinguished_name.isnot(None),
-    ).all()
-
-    ou_rules = load_ou_rules(db)
+    ds = get_dataset(db)
+    records = ds.take(ds.ad_rows, (ds.ad["ad_source"] == domain) & (ds.ad["distinguished_name"] != ""))
     members = [
-        build_member_dict(r, account_type=compute_account_type(r.ad_source or "", norm(r.distinguished_name), ou_rules))
+        build_member_dict(r, account_type=r.account_type)
         for r in records if _parse_ou_path(r.distinguished_name or "") == target_parts
     ]
     sort_members(members)
-    return {
+    return table_response({
         "path": "/".join(target_parts),
         "ou_name": target_parts[-1] if target_parts else "",
         "domain": domain, "city": city,
         "members": members, "count": len(members),
-    }
+    }, "members", fmt, response)
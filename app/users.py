@@ -1,27 +1,38 @@
 # -*- coding: utf-8 -*-
 """API-эндпоинты для анализа пользователей по StaffUUID."""
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy import or_, func
+from typing import Any, Dict
+
+from fastapi import APIRouter, Depends, Query, HTTPException, Body, Response
+from sqlalchemy import or_
 from sqlalchemy.orm import Session
 
-from app.database import get_db, ADRecord, MFARecord, PeopleRecord
+from app.database import get_db, ADRecord, MFARecord, PeopleRecord, SearchEntry
 from app.config import AD_LABELS, AD_SOURCE_LABELS
 from app.consolidation import load_ou_rules, compute_account_type
-from app.utils import norm, norm_email, enabled_str, fmt_date, fmt_datetime
+from app.dataset import get_dataset
+from app.hierarchy import person_link, manager_chains, reports as hierarchy_reports, span_of_control
+from app.utils import (
+    norm, norm_email, norm_fio_key, norm_key_dn, norm_key_login, norm_key_uuid, enabled_str, fmt_date, fmt_datetime,
+)
+from app.responses import fast_json
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 
+# Максимум ключей в одном пакетном запросе карточек
+MAX_BATCH_CARDS = 1000
+
 
 @router.get("/list")
-def users_list(db: Session = Depends(get_db)):
+def users_list(response: Response, db: Session = Depends(get_db)):
     """
     Список уникальных пользователей.
     Объединяем по StaffUUID (AD + People) и по login/identity (MFA).
     """
+    ds = get_dataset(db)
     users: dict[str, dict] = {}
 
     # 1) AD-записи
-    for r in db.query(ADRecord).all():
+    for r in ds.ad_rows:
         uuid = norm(r.staff_uuid)
         login = norm(r.login)
         key = uuid.lower() if uuid else f"_login_{login.lower()}" if login else None
@@ -43,11 +54,11 @@ def users_list(db: Session = Depends(get_db)):
             u["logins"].append(login)
         u["sources"].add(ad_label)
         # Если хотя бы одна УЗ активна — пользователь не «полностью отключён»
-        if enabled_str(r.enabled) == "Да":
+        if r.enabled_flag:
             u["all_disabled"] = False
 
     # 2) People-записи
-    for r in db.query(PeopleRecord).all():
+    for r in ds.people_rows:
         uuid = norm(r.staff_uuid)
         if not uuid:
             continue
@@ -72,7 +83,7 @@ def users_list(db: Session = Depends(get_db)):
         for login in u["logins"]:
             login_to_key[login.lower()] = key
 
-    for r in db.query(MFARecord).all():
+    for r in ds.mfa_rows:
         identity = norm(r.identity)
         if not identity:
             continue
@@ -113,32 +124,94 @@ def users_list(db: Session = Depends(get_db)):
     ]
     result.sort(key=lambda x: (x["fio"] or x["staff_uuid"] or "".join(x["logins"])).lower())
 
-    return {"users": result, "total": len(result)}
+    return fast_json({"users": result, "total": len(result)}, response)
 
 
-def _resolve_key(key: str, db: Session):
-    """Определяет staff_uuid и logins по ключу пользователя."""
-    staff_uuid = ""
-    logins: list[str] = []
-    ad_recs = []
 
-    if key.startswith("_login_"):
-        login_val = key[7:]
-        logins = [login_val]
-        ad_recs = db.query(ADRecord).filter(ADRecord.login.ilike(login_val)).all()
-        if ad_recs and norm(ad_recs[0].staff_uuid):
-            staff_uuid = norm(ad_recs[0].staff_uuid)
-            # Дополнить все AD-записи по UUID
-            ad_recs = db.query(ADRecord).filter(ADRecord.staff_uuid.ilike(staff_uuid)).all()
-            logins = list({norm(r.login).lower() for r in ad_recs if norm(r.login)})
-    elif key.startswith("_mfa_"):
-        logins = [key[5:]]
-    else:
-        staff_uuid = key
-        ad_recs = db.query(ADRecord).filter(ADRecord.staff_uuid.ilike(staff_uuid)).all()
-        logins = list({norm(r.login).lower() for r in ad_recs if norm(r.login)})
+def _resolve_keys(keys: list[str], db: Session) -> dict[str, tuple[str, list[str], list]]:
+    """
+    Определяет staff_uuid, logins и AD-записи для набора ключей пользователей.
+    Два запроса на весь набор по индексированным ключам: login_key (ключи
+    _login_) и uuid_key (StaffUUID).
+    """
+    login_of = {k: norm_key_login(k[7:]) for k in keys if k.startswith("_login_")}
+    by_login: dict[str, list] = {}
+    if login_of:
+        q = db.query(ADRecord).filter(ADRecord.login_key.in_(set(login_of.values())))
+        for r in q.order_by(ADRecord.id).all():
+            by_login.setdefault(r.login_key, []).append(r)
+
+    # Ключ → StaffUUID (для _login_ — UUID первой найденной AD-записи)
+    uuid_of: dict[str, str] = {}
+    for k in keys:
+        if k.startswith("_login_"):
+            recs = by_login.get(login_of[k], [])
+            if recs and norm(recs[0].staff_uuid):
+                uuid_of[k] = norm(recs[0].staff_uuid)
+        elif not k.startswith("_mfa_"):
+            uuid_of[k] = k
+    by_uuid: dict[str, list] = {}
+    if uuid_of:
+        q = db.query(ADRecord).filter(ADRecord.uuid_key.in_({norm_key_uuid(u) for u in uuid_of.values()}))
+        for r in q.order_by(ADRecord.id).all():
+            by_uuid.setdefault(r.uuid_key, []).append(r)
+
+    resolved = {}
+    for k in keys:
+        if k in uuid_of:
+            staff_uuid = uuid_of[k]
+            ad_recs = by_uuid.get(norm_key_uuid(staff_uuid), [])
+            logins = list(dict.fromkeys(norm(r.login).lower() for r in ad_recs if norm(r.login)))
+        elif k.startswith("_login_"):
+            staff_uuid, logins, ad_recs = "", [k[7:]], by_login.get(login_of[k], [])
+        else:
+            staff_uuid, logins, ad_recs = "", [k[5:]], []
+        resolved[k] = (staff_uuid, logins, ad_recs)
+    return resolved
 
-    return staff_uuid, logins, ad_recs
+
+def _lookup_keys(queries: list[str], db: Session) -> dict[str, str]:
+    """
+    Сопоставляет произвольные запросы (ключ карточки, логин, email) с ключами карточек.
+    Один запрос к поисковому индексу; запросы без совпадений в результат не попадают.
+    """
+    lowered = {q: q.lower() for q in queries}
+    emails = {v for v in lowered.values() if "@" in v}
+    plain = {v for v in lowered.values() if "@" not in v}
+    logins = {v[7:] if v.startswith("_login_") else v[5:] if v.startswith("_mfa_") else v for v in plain}
+    rows = db.query(SearchEntry.user_key, SearchEntry.source, SearchEntry.login, SearchEntry.email).filter(
+        or_(SearchEntry.user_key.in_(plain), SearchEntry.email.in_(emails), SearchEntry.login.in_(logins))
+    ).all()
+
+    # Приоритет источника при неоднозначности: AD → Кадры → MFA
+    prio = {"ad": 0, "people": 1, "mfa": 2}
+    known_keys = set()
+    by_login: dict[tuple[str, str], str] = {}
+    by_email: dict[str, tuple[int, str]] = {}
+    by_any_login: dict[str, tuple[int, str]] = {}
+    for user_key, source, login, email in sorted(rows, key=lambda r: prio.get(r[1], 9), reverse=True):
+        known_keys.add(user_key)
+        if login:
+            by_login[(source, login)] = user_key
+            by_any_login[login] = (prio[source], user_key)
+        if email:
+            by_email[email] = (prio[source], user_key)
+
+    result = {}
+    for q, v in lowered.items():
+        if v in known_keys:
+            key = v
+        elif v.startswith("_login_"):
+            key = by_login.get(("ad", v[7:]))
+        elif v.startswith("_mfa_"):
+            key = by_login.get(("mfa", v[5:]))
+        elif "@" in v:
+            key = by_email.get(v, (0, None))[1]
+        else:
+            key = by_any_login.get(v, (0, None))[1]
+        if key:
+            result[q] = key
+    return result
 
 
 def _resolve_managers(ad_cards: list[dict], db: Session):
@@ -151,7 +224,7 @@ def _resolve_managers(ad_cards: list[dict], db: Session):
     for c in ad_cards:
         mgr = c.get("manager", "")
         if mgr:
-            mgr_dns.add(mgr.lower())
+            mgr_dns.add(norm_key_dn(mgr))
 
     if not mgr_dns:
         for c in ad_cards:
@@ -159,13 +232,12 @@ def _resolve_managers(ad_cards: list[dict], db: Session):
             c["manager_name"] = ""
         return
 
-    # Один запрос: только AD-записи, чей DN совпадает с одним из manager DN
-    conditions = [ADRecord.distinguished_name.ilike(dn) for dn in mgr_dns]
-    mgr_recs = db.query(ADRecord).filter(or_(*conditions)).all()
+    # Один запрос по индексированному dn_key
+    mgr_recs = db.query(ADRecord).filter(ADRecord.dn_key.in_(mgr_dns)).all()
 
     dn_to_info: dict[str, dict] = {}
     for r in mgr_recs:
-        dn = norm(r.distinguished_name).lower()
+        dn = r.dn_key
         if not dn:
             continue
         uuid = norm(r.staff_uuid)
@@ -182,7 +254,7 @@ def _resolve_managers(ad_cards: list[dict], db: Session):
 
     for c in ad_cards:
         mgr = c.get("manager", "")
-        info = dn_to_info.get(mgr.lower(), {}) if mgr else {}
+        info = dn_to_info.get(norm_key_dn(mgr), {}) if mgr else {}
         c["manager_key"] = info.get("key", "")
         c["manager_name"] = info.get("name", "")
 
@@ -277,29 +349,18 @@ def _build_ad_cards(ad_recs, logins, ou_rules: dict | None = None):
     return cards, logins
 
 
-def _fetch_mfa_cards(logins: list[str], db: Session):
-    """Загружает MFA-карточки одним запросом. Точное совпадение логина (с учётом домена)."""
-    if not logins:
-        return []
-    # Точное совпадение: identity = 'login' ИЛИ identity заканчивается на '\login'
-    conditions = []
-    for login in logins:
-        conditions.append(MFARecord.identity.ilike(login))           # exact
-        conditions.append(MFARecord.identity.ilike(f"%\\{login}"))   # DOMAIN\login
-    recs = db.query(MFARecord).filter(or_(*conditions)).all()
-    seen_ids = set()
-    logins_lower = {l.lower() for l in logins}
-    cards = []
-    for r in recs:
-        if r.id in seen_ids:
-            continue
-        # Дополнительная проверка: identity (без домена) должен точно совпадать с одним из логинов
-        ident = norm(r.identity)
-        ident_clean = ident.split("\\")[-1].lower() if "\\" in ident else ident.lower()
-        if ident_clean not in logins_lower:
-            continue
-        seen_ids.add(r.id)
-        cards.append({
+
+def _fetch_mfa_cards(logins: list[str], db: Session) -> dict[str, list[tuple[int, dict]]]:
+    """
+    Загружает MFA-карточки одним запросом по индексированному identity_key
+    (identity без префикса домена). Возвращает identity_key → [(id, карточка)].
+    """
+    keys = {l.lower() for l in logins if l}
+    if not keys:
+        return {}
+    result: dict[str, list[tuple[int, dict]]] = {}
+    for r in db.query(MFARecord).filter(MFARecord.identity_key.in_(keys)).order_by(MFARecord.id).all():
+        result.setdefault(r.identity_key, []).append((r.id, {
             "identity": norm(r.identity),
             "name": norm(r.name),
             "email": norm(r.email),
@@ -311,8 +372,30 @@ def _fetch_mfa_cards(logins: list[str], db: Session):
             "created_at": fmt_datetime(r.created_at),
             "mfa_groups": norm(r.mfa_groups),
             "ldap": norm(r.ldap),
+        }))
+    return result
+
+
+def _fetch_people_cards(uuids: set[str], db: Session) -> dict[str, dict]:
+    """Загружает карточки кадров одним запросом. Возвращает staff_uuid (lower) → карточка."""
+    if not uuids:
+        return {}
+    result: dict[str, dict] = {}
+    q = db.query(PeopleRecord).filter(PeopleRecord.uuid_key.in_({norm_key_uuid(u) for u in uuids}))
+    for prec in q.order_by(PeopleRecord.id).all():
+        result.setdefault(prec.uuid_key, {
+            "staff_uuid": norm(prec.staff_uuid),
+            "fio": norm(prec.fio),
+            "email": norm(prec.email),
+            "phone": norm(prec.phone),
+            "unit": norm(prec.unit),
+            "hub": norm(prec.hub),
+            "employment_status": norm(prec.employment_status),
+            "unit_manager": norm(prec.unit_manager),
+            "work_format": norm(prec.work_format),
+            "hr_bp": norm(prec.hr_bp),
         })
-    return cards
+    return result
 
 
 @router.get("/by-dn")
@@ -325,9 +408,7 @@ def user_by_dn(
     if not dn_clean:
         return {"found": False}
 
-    rec = db.query(ADRecord).filter(
-        ADRecord.distinguished_name.ilike(dn_clean)
-    ).first()
+    rec = db.query(ADRecord).filter(ADRecord.dn_key == norm_key_dn(dn_clean)).first()
     if not rec:
         return {"found": False}
 
@@ -347,215 +428,294 @@ def user_by_dn(
     }
 
 
+
+def _load_cards(keys: list[str], db: Session) -> dict[str, dict]:
+    """
+    Полные карточки для набора ключей: все данные из AD, MFA, People и возможные совпадения.
+    Каждый шаг — один запрос на весь набор, независимо от числа ключей.
+    """
+    resolved = _resolve_keys(keys, db)
+
+    # --- AD ---
+    ou_rules = load_ou_rules(db)
+    ad_by_key: dict[str, list[dict]] = {}
+    for k, (staff_uuid, logins, ad_recs) in resolved.items():
+        ad_cards, logins = _build_ad_cards(ad_recs, logins, ou_rules)
+        ad_by_key[k] = ad_cards
+        resolved[k] = (staff_uuid, logins, ad_recs)
+
+    # --- Резолв руководителей (один запрос на все карточки) ---
+    _resolve_managers([c for cards in ad_by_key.values() for c in cards], db)
+
+    # --- MFA и People ---
+    mfa_by_login = _fetch_mfa_cards([l for _u, logins, _r in resolved.values() for l in logins], db)
+    people_by_uuid = _fetch_people_cards({u for u, _l, _r in resolved.values() if u}, db)
+
+    cards: dict[str, dict] = {}
+    for k, (staff_uuid, logins, _recs) in resolved.items():
+        ad_cards = ad_by_key[k]
+        mfa_items = {rid: c for l in logins for rid, c in mfa_by_login.get(l.lower(), [])}
+        mfa_cards = [mfa_items[rid] for rid in sorted(mfa_items)]
+        people_card = people_by_uuid.get(norm_key_uuid(staff_uuid)) if staff_uuid else None
+
+        # ФИО: приоритет People → AD → MFA
+        fio = ""
+        if people_card and people_card["fio"]:
+            fio = people_card["fio"]
+        elif ad_cards and ad_cards[0]["display_name"]:
+            fio = ad_cards[0]["display_name"]
+        elif mfa_cards and mfa_cards[0]["name"]:
+            fio = mfa_cards[0]["name"]
+
+        # Сводные поля для шапки карточки
+        city = ""
+        for c in ad_cards:
+            if c.get("location"):
+                city = c["location"]
+                break
+
+        cards[k] = {
+            "staff_uuid": staff_uuid,
+            "fio": fio,
+            "logins": logins,
+            "city": city,
+            "hub": people_card["hub"] if people_card else "",
+            "dp_unit": people_card["unit"] if people_card else "",
+            "rm": people_card["unit_manager"] if people_card else "",
+            "ad": ad_cards,
+            "mfa": mfa_cards,
+            "people": people_card,
+            "_emails": [c["email"] for c in ad_cards if c.get("email")] +
+                       ([people_card["email"]] if people_card and people_card.get("email") else []) +
+                       [c["email"] for c in mfa_cards if c.get("email")],
+        }
+
+    # --- Возможные совпадения (кандидаты — одним набором запросов на все карточки) ---
+    candidates = _fetch_match_candidates(
+        {norm_fio_key(c["fio"]) for c in cards.values()} - {""},
+        {norm_email(e) for c in cards.values() for e in c["_emails"]} - {""},
+        db,
+    )
+    for k, card in cards.items():
+        card["matches"] = _find_matches(k, card["staff_uuid"], card["logins"], card["fio"],
+                                        card.pop("_emails"), candidates)
+    return cards
+
+
 @router.get("/card")
 def user_card(
     key: str = Query(..., description="Ключ пользователя (staff_uuid или internal key)"),
     db: Session = Depends(get_db),
 ):
     """Полная карточка пользователя: все данные из AD, MFA, People."""
-    staff_uuid, logins, ad_recs = _resolve_key(key, db)
+    return _load_cards([key], db)[key]
 
-    # --- AD ---
-    ou_rules = load_ou_rules(db)
-    ad_cards, logins = _build_ad_cards(ad_recs, logins, ou_rules)
 
-    # --- Резолв руководителей ---
-    _resolve_managers(ad_cards, db)
+@router.post("/cards")
+def user_cards(payload: Dict[str, Any] = Body(...), db: Session = Depends(get_db)):
+    """
+    Пакетная загрузка карточек: {"keys": [...]} — ключи карточек, логины или email.
+    Все ключи разрешаются набором запросов на весь пакет (а не N × запросов на карточку).
+    """
+    raw = payload.get("keys") or []
+    if not isinstance(raw, list):
+        raise HTTPException(400, "keys должен быть списком")
+    queries = list(dict.fromkeys(norm(q) for q in raw if norm(q)))
+    if len(queries) > MAX_BATCH_CARDS:
+        raise HTTPException(400, f"Слишком много ключей ({len(queries)}). Максимум: {MAX_BATCH_CARDS}")
+
+    key_of = _lookup_keys(queries, db)
+    cards = _load_cards(list(dict.fromkeys(key_of.values())), db)
+    return {
+        "cards": [{"query": q, "key": key_of[q], "card": cards[key_of[q]]} for q in queries if q in key_of],
+        "not_found": [q for q in queries if q not in key_of],
+        "total": len(key_of),
+    }
 
-    # --- MFA (один запрос вместо N) ---
-    mfa_cards = _fetch_mfa_cards(logins, db)
 
-    # --- People ---
-    people_card = None
-    if staff_uuid:
-        prec = db.query(PeopleRecord).filter(PeopleRecord.staff_uuid.ilike(staff_uuid)).first()
-        if prec:
-            people_card = {
-                "staff_uuid": norm(prec.staff_uuid),
-                "fio": norm(prec.fio),
-                "email": norm(prec.email),
-                "phone": norm(prec.phone),
-                "unit": norm(prec.unit),
-                "hub": norm(prec.hub),
-                "employment_status": norm(prec.employment_status),
-                "unit_manager": norm(prec.unit_manager),
-                "work_format": norm(prec.work_format),
-                "hr_bp": norm(prec.hr_bp),
-            }
+def _account_ids(key: str, db: Session) -> list:
+    """AD-записи пользователя по ключу карточки (все домены)."""
+    return _resolve_keys([key], db)[key][2]
 
-    # ФИО: приоритет People → AD → MFA
-    fio = ""
-    if people_card and people_card["fio"]:
-        fio = people_card["fio"]
-    elif ad_cards and ad_cards[0]["display_name"]:
-        fio = ad_cards[0]["display_name"]
-    elif mfa_cards and mfa_cards[0]["name"]:
-        fio = mfa_cards[0]["name"]
-
-    # Сводные поля для шапки карточки
-    city = ""
-    for c in ad_cards:
-        if c.get("location"):
-            city = c["location"]
-            break
-    hub = people_card["hub"] if people_card else ""
-    dp_unit = people_card["unit"] if people_card else ""
-    rm = people_card["unit_manager"] if people_card else ""
-
-    # --- Возможные совпадения ---
-    matches = _find_matches(
-        key, staff_uuid, logins, fio,
-        [c["email"] for c in ad_cards if c.get("email")] +
-        ([people_card["email"]] if people_card and people_card.get("email") else []) +
-        [c["email"] for c in mfa_cards if c.get("email")],
-        db,
-    )
 
+@router.get("/manager-chain")
+def user_manager_chain(
+    key: str = Query(..., description="Ключ пользователя"),
+    db: Session = Depends(get_db),
+):
+    """Цепочка руководителей для каждой AD-учётки пользователя (от непосредственного вверх)."""
+    recs = _account_ids(key, db)
+    chains = manager_chains(db, [r.id for r in recs])
+    return {
+        "key": key,
+        "accounts": [{**person_link(r), "chain": chains[r.id]} for r in recs],
+    }
+
+
+@router.get("/reports")
+def user_reports(
+    key: str = Query(..., description="Ключ пользователя"),
+    recursive: bool = Query(False, description="Все уровни подчинения, а не только прямые"),
+    db: Session = Depends(get_db),
+):
+    """Подчинённые пользователя (по всем его AD-учёткам, включая другие домены)."""
+    items = hierarchy_reports(db, [r.id for r in _account_ids(key, db)], recursive=recursive)
+    return {"key": key, "recursive": recursive, "reports": items, "count": len(items)}
+
+
+@router.get("/span")
+def user_span(
+    key: str = Query(..., description="Ключ пользователя"),
+    db: Session = Depends(get_db),
+):
+    """Span of control: число прямых и всех подчинённых, глубина поддерева."""
+    recs = _account_ids(key, db)
+    spans = span_of_control(db, [r.id for r in recs])
     return {
-        "staff_uuid": staff_uuid,
-        "fio": fio,
-        "logins": logins,
-        "city": city,
-        "hub": hub,
-        "dp_unit": dp_unit,
-        "rm": rm,
-        "ad": ad_cards,
-        "mfa": mfa_cards,
-        "people": people_card,
-        "matches": matches,
+        "key": key,
+        "accounts": [{**person_link(r), **spans[r.id]} for r in recs],
     }
 
 
+def _fetch_match_candidates(fio_keys: set[str], emails: set[str], db: Session) -> dict[str, dict]:
+    """
+    Кандидаты в «возможные совпадения» для набора ФИО-ключей и email:
+    по одному запросу на источник, фильтрация по индексированным колонкам.
+    Возвращает источник → {"fio": ключ → [записи], "email": email → [записи]}.
+    """
+    candidates: dict[str, dict] = {}
+    for source, model in (("ad", ADRecord), ("people", PeopleRecord), ("mfa", MFARecord)):
+        idx: dict[str, dict[str, list]] = {"fio": {}, "email": {}}
+        candidates[source] = idx
+        conditions = []
+        if fio_keys:
+            conditions.append(model.fio_key.in_(fio_keys))
+        if emails:
+            conditions.append(model.email_key.in_(emails))
+        if not conditions:
+            continue
+        for r in db.query(model).filter(or_(*conditions)).order_by(model.id).all():
+            if r.fio_key and r.fio_key in fio_keys:
+                idx["fio"].setdefault(r.fio_key, []).append(r)
+            if r.email_key and r.email_key in emails:
+                idx["email"].setdefault(r.email_key, []).append(r)
+    return candidates
+
+
 def _find_matches(
     own_key: str,
     own_uuid: str,
     own_logins: list[str],
     fio: str,
     emails: list[str],
-    db: Session,
+    candidates: dict[str, dict],
 ) -> list[dict]:
     """
     Ищет «возможные совпадения» — записи из AD, People, MFA,
-    у которых совпадает ФИО (точно) или email с текущим пользователем,
-    но они НЕ принадлежат ему напрямую (другой StaffUUID / логин).
-    Фильтрация кандидатов выполняется на уровне SQL для производительности.
+    у которых совпадает ФИО (по каноническому ключу fio_key) или email
+    с текущим пользователем, но они НЕ принадлежат ему напрямую (другой StaffUUID / логин).
+    Кандидаты заранее выбраны из БД (_fetch_match_candidates).
     """
     if not fio and not emails:
         return []
 
-    fio_low = fio.strip().lower() if fio else ""
+    fio_key = norm_fio_key(fio)
     email_set = {norm_email(e) for e in emails if norm_email(e)}
     own_uuid_low = own_uuid.lower() if own_uuid else ""
     own_logins_low = {l.lower() for l in own_logins if l}
 
+    def _records(source: str) -> list:
+        idx = candidates[source]
+        found = {r.id: r for r in idx["fio"].get(fio_key, [])} if fio_key else {}
+        for e in email_set:
+            found.update((r.id, r) for r in idx["email"].get(e, []))
+        return [found[rid] for rid in sorted(found)]
+
     matches: list[dict] = []
     seen_keys: set[str] = set()
 
-    # --- AD: фильтрация кандидатов на уровне SQL ---
-    ad_conditions = []
-    if fio_low:
-        ad_conditions.append(func.lower(ADRecord.display_name) == fio_low)
-    if email_set:
-        ad_conditions.append(func.lower(ADRecord.email).in_(email_set))
-    if ad_conditions:
-        for r in db.query(ADRecord).filter(or_(*ad_conditions)).all():
-            r_uuid = norm(r.staff_uuid).lower()
-            r_login = norm(r.login).lower()
-            if own_uuid_low and r_uuid and r_uuid == own_uuid_low:
-                continue
-            if r_login and r_login in own_logins_low:
-                continue
-            r_fio = norm(r.display_name).strip().lower()
-            r_email = norm_email(r.email)
-            reason = []
-            if fio_low and r_fio and r_fio == fio_low:
-                reason.append("ФИО")
-            if r_email and r_email in email_set:
-                reason.append("Email")
-            if not reason:
-                continue
-            mkey = f"ad_{r.id}"
-            if mkey in seen_keys:
-                continue
-            seen_keys.add(mkey)
-            matches.append({
-                "source": AD_SOURCE_LABELS.get(r.ad_source, "AD"),
-                "fio": norm(r.display_name),
-                "email": norm(r.email),
-                "login": norm(r.login),
-                "staff_uuid": norm(r.staff_uuid),
-                "enabled": enabled_str(r.enabled),
-                "reason": ", ".join(reason),
-            })
-
-    # --- People: фильтрация кандидатов на уровне SQL ---
-    people_conditions = []
-    if fio_low:
-        people_conditions.append(func.lower(PeopleRecord.fio) == fio_low)
-    if email_set:
-        people_conditions.append(func.lower(PeopleRecord.email).in_(email_set))
-    if people_conditions:
-        for r in db.query(PeopleRecord).filter(or_(*people_conditions)).all():
-            r_uuid = norm(r.staff_uuid).lower()
-            if own_uuid_low and r_uuid and r_uuid == own_uuid_low:
-                continue
-            r_fio = norm(r.fio).strip().lower()
-            r_email = norm_email(r.email)
-            reason = []
-            if fio_low and r_fio and r_fio == fio_low:
-                reason.append("ФИО")
-            if r_email and r_email in email_set:
-                reason.append("Email")
-            if not reason:
-                continue
-            mkey = f"people_{r.id}"
-            if mkey in seen_keys:
-                continue
-            seen_keys.add(mkey)
-            matches.append({
-                "source": "Кадры",
-                "fio": norm(r.fio),
-                "email": norm(r.email),
-                "login": "",
-                "staff_uuid": norm(r.staff_uuid),
-                "enabled": "",
-                "reason": ", ".join(reason),
-            })
-
-    # --- MFA: фильтрация кандидатов на уровне SQL ---
-    mfa_conditions = []
-    if fio_low:
-        mfa_conditions.append(func.lower(MFARecord.name) == fio_low)
-    if email_set:
-        mfa_conditions.append(func.lower(MFARecord.email).in_(email_set))
-    if mfa_conditions:
-        for r in db.query(MFARecord).filter(or_(*mfa_conditions)).all():
-            r_identity = norm(r.identity)
-            r_ident_clean = r_identity.split("\\")[-1].lower() if "\\" in r_identity else r_identity.lower()
-            if r_ident_clean and r_ident_clean in own_logins_low:
-                continue
-            r_fio = norm(r.name).strip().lower()
-            r_email = norm_email(r.email)
-            reason = []
-            if fio_low and r_fio and r_fio == fio_low:
-                reason.append("ФИО")
-            if r_email and r_email in email_set:
-                reason.append("Email")
-            if not reason:
-                continue
-            mkey = f"mfa_{r.id}"
-            if mkey in seen_keys:
-                continue
-            seen_keys.add(mkey)
-            matches.append({
-                "source": "MFA",
-                "fio": norm(r.name),
-                "email": norm(r.email),
-                "login": r_identity,
-                "staff_uuid": "",
-                "enabled": "",
-                "reason": ", ".join(reason),
-            })
+    # --- AD ---
+    for r in _records("ad"):
+        r_uuid = norm(r.staff_uuid).lower()
+        r_login = norm(r.login).lower()
+        if own_uuid_low and r_uuid and r_uuid == own_uuid_low:
+            continue
+        if r_login and r_login in own_logins_low:
+            continue
+        r_email = norm_email(r.email)
+        reason = []
+        if fio_key and r.fio_key == fio_key:
+            reason.append("ФИО")
+        if r_email and r_email in email_set:
+            reason.append("Email")
+        if not reason:
+            continue
+        mkey = f"ad_{r.id}"
+        if mkey in seen_keys:
+            continue
+        seen_keys.add(mkey)
+        matches.append({
+            "source": AD_SOURCE_LABELS.get(r.ad_source, "AD"),
+            "fio": norm(r.display_name),
+            "email": norm(r.email),
+            "login": norm(r.login),
+            "staff_uuid": norm(r.staff_uuid),
+            "enabled": enabled_str(r.enabled),
+            "reason": ", ".join(reason),
+        })
+
+    # --- People ---
+    for r in _records("people"):
+        r_uuid = norm(r.staff_uuid).lower()
+        if own_uuid_low and r_uuid and r_uuid == own_uuid_low:
+            continue
+        r_email = norm_email(r.email)
+        reason = []
+        if fio_key and r.fio_key == fio_key:
+            reason.append("ФИО")
+        if r_email and r_email in email_set:
+            reason.append("Email")
+        if not reason:
+            continue
+        mkey = f"people_{r.id}"
+        if mkey in seen_keys:
+            continue
+        seen_keys.add(mkey)
+        matches.append({
+            "source": "Кадры",
+            "fio": norm(r.fio),
+            "email": norm(r.email),
+            "login": "",
+            "staff_uuid": norm(r.staff_uuid),
+            "enabled": "",
+            "reason": ", ".join(reason),
+        })
+
+    # --- MFA ---
+    for r in _records("mfa"):
+        if r.identity_key and r.identity_key in own_logins_low:
+            continue
+        r_email = norm_email(r.email)
+        reason = []
+        if fio_key and r.fio_key == fio_key:
+            reason.append("ФИО")
+        if r_email and r_email in email_set:
+            reason.append("Email")
+        if not reason:
+            continue
+        mkey = f"mfa_{r.id}"
+        if mkey in seen_keys:
+            continue
+        seen_keys.add(mkey)
+        matches.append({
+            "source": "MFA",
+            "fio": norm(r.name),
+            "email": norm(r.email),
+            "login": norm(r.identity),
+            "staff_uuid": "",
+            "enabled": "",
+            "reason": ", ".join(reason),
+        })
 
     matches.sort(key=lambda m: (m.get("reason", ""), m.get("fio", "").lower()))
     return matches
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """Общие утилиты, используемые во всех модулях бэкенда."""
 import re
+import unicodedata
 from datetime import datetime
 
 import pandas as pd
@@ -73,22 +74,68 @@ def norm_key_login(s) -> str:
     return k.lower()
 
 
+def norm_key_dn(s) -> str:
+    """Нормализация distinguishedName для сопоставления (без учёта регистра и пробелов по краям)."""
+    return norm(s).lower()
+
+
 def norm_key_uuid(s) -> str:
     """Нормализация StaffUUID для сопоставления."""
     k = norm(s)
     return k.lower() if k else ""
 
 
+# Транслитерация кириллицы (ICAO 9303, как в загранпаспортах РФ)
+_TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "ie", "ы": "y", "ь": "", "э": "e",
+    "ю": "iu", "я": "ia",
+})
+# Сглаживание вариантов латинского написания (Yuri/Iurii, Khabib/Habib)
+_LATIN_FOLDS = (("kh", "h"), ("y", "i"), ("w", "v"))
+_DOUBLE_LETTERS = re.compile(r"([a-z])\1+")
+
+
+def norm_fio_key(s) -> str:
+    """
+    Канонический ключ ФИО для сопоставления между источниками:
+    ё→е, транслитерация в латиницу, без диакритики, пунктуации и удвоенных букв,
+    слова отсортированы (порядок «Фамилия Имя» / «Имя Фамилия» не важен).
+    """
+    k = norm(s).lower().translate(_TRANSLIT)
+    if not k:
+        return ""
+    k = unicodedata.normalize("NFKD", k).encode("ascii", "ignore").decode("ascii")
+    for src, dst in _LATIN_FOLDS:
+        k = k.replace(src, dst)
+    k = _DOUBLE_LETTERS.sub(r"\1", k)
+    return " ".join(sorted(re.findall(r"[a-z0-9]+", k)))
+
+
+_TRUE_STRINGS = frozenset({"true", "1", "да", "yes"})
+_FALSE_STRINGS = frozenset({"false", "0", "нет", "no"})
+
+
+def parse_bool(val) -> bool | None:
+    """Строковый флаг ("True", "Да", "1", "нет"...) в bool; None, если значение не распознано."""
+    if isinstance(val, bool):
+        return val
+    low = norm(val).lower()
+    if low in _TRUE_STRINGS:
+        return True
+    if low in _FALSE_STRINGS:
+        return False
+    return None
+
+
 def enabled_str(val) -> str:
     """Преобразование значения enabled в 'Да'/'Нет'."""
-    if isinstance(val, bool):
-        return "Да" if val else "Нет"
-    en_low = norm(val).lower()
-    if en_low in ("true", "1", "да", "yes"):
-        return "Да"
-    if en_low in ("false", "0", "нет", "no"):
-        return "Нет"
-    return norm(val)
+    b = parse_bool(val)
+    if b is None:
+        return norm(val)
+    return "Да" if b else "Нет"
 
 
 def safe_datetime(x) -> datetime | None:
@@ -164,3 +211,33 @@ def build_member_dict(r, *, include_location: bool = False, include_domain_label
 def sort_members(members: list[dict]) -> None:
     """Сортировка списка участников по ФИО/логину (in-place)."""
     members.sort(key=lambda m: (m.get("display_name") or m.get("login") or "").lower())
+
+
+def sort_value(v):
+    """Ключ сортировки значения: строки без учёта регистра (str.lower), пустые и None — первыми."""
+    if v is None or v == "":
+        return (0, "")
+    return (1, v.lower() if isinstance(v, str) else v)
+
+
+def sorted_page(q, model, key_col, descending: bool = False, page: int = 1, page_size: int = 0,
+                then: tuple = ()) -> list:
+    """
+    Строки запроса q (model или кортежи с model первым элементом), отсортированные
+    по key_col, затем по колонкам then (по возрастанию) и id.
+
+    Сортировка — в Python, как у sort_members: lower() в SQLite меняет регистр
+    только у латиницы, и кириллица в ORDER BY упорядочивалась бы иначе. Из БД
+    для сортировки читаются только (id, ключи); полные строки — только страницы.
+    """
+    keyed = q.with_entities(model.id, key_col, *then).all()
+    keyed.sort(key=lambda r: (tuple(sort_value(v) for v in r[2:]), r[0]))
+    keyed.sort(key=lambda r: sort_value(r[1]), reverse=descending)
+    if page_size:
+        keyed = keyed[(page - 1) * page_size:page * page_size]
+    pos = {r[0]: i for i, r in enumerate(keyed)}
+    if not pos:
+        return []
+    rows = q.filter(model.id.in_(list(pos))).all() if page_size else q.all()
+    rows.sort(key=lambda row: pos[row.id if isinstance(row, model) else row[0].id])
+    return rows
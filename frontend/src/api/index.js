@@ -32,6 +32,38 @@ export async function fetchJSON(url) {
   return r.json()
 }
 
+/**
+ * Колоночный ответ ({columns, data, dicts}) → массив объектов.
+ * Значения колонок из dicts приходят индексами в словарь.
+ */
+export function fromColumnar(t) {
+  if (!t || !Array.isArray(t.columns)) return t || []
+  const cols = t.columns
+  const dicts = cols.map(c => (t.dicts && t.dicts[c]) || null)
+  const out = new Array(t.data.length)
+  for (let i = 0; i < t.data.length; i++) {
+    const row = t.data[i]
+    const obj = {}
+    for (let j = 0; j < cols.length; j++) {
+      const d = dicts[j]
+      obj[cols[j]] = d ? d[row[j]] : row[j]
+    }
+    out[i] = obj
+  }
+  return out
+}
+
+/**
+ * GET табличного эндпоинта в формате ?format=columnar.
+ * rowsKey — поле со строками (rows / members), оно разворачивается в массив объектов.
+ */
+export async function fetchTable(url, rowsKey = 'rows') {
+  const sep = /[?&]$/.test(url) ? '' : (url.includes('?') ? '&' : '?')
+  const data = await fetchJSON(url + sep + 'format=columnar')
+  if (data.format === 'columnar') data[rowsKey] = fromColumnar(data[rowsKey])
+  return data
+}
+
 /**
  * POST JSON and return parsed response.
  */
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк сериализации и сжатия сводной таблицы (/api/consolidated).
+
+Сравнивает путь FastAPI по умолчанию (jsonable_encoder + json.dumps) с
+FastJSONResponse и показывает размер ответа без сжатия, с gzip и brotli.
+
+Запуск из корня репозитория на текущей БД (DATABASE_URL):
+    python -m scripts.bench_json [--repeat 5] [--scale 1]
+--scale N размножает строки, чтобы оценить поведение на больших выгрузках.
+"""
+import argparse
+import gzip
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+from app.consolidation import build_consolidated
+from app.database import SessionLocal, init_db
+from app.dataset import get_dataset
+from app.responses import FastJSONResponse, _HAS_BROTLI, _HAS_ORJSON
+
+
+def _best(fn, repeat: int) -> tuple[float, bytes]:
+    best, out = float("inf"), b""
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t)
+    return best * 1000, out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--scale", type=int, default=1)
+    args = ap.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    try:
+        ds = get_dataset(db)
+        t = time.perf_counter()
+        rows = build_consolidated(ds)
+        build_ms = (time.perf_counter() - t) * 1000
+    finally:
+        db.close()
+    rows = rows * args.scale
+    if not rows:
+        print("Сводная пуста — загрузите данные или укажите DATABASE_URL")
+        return
+    payload = {"rows": rows, "total": len(rows)}
+
+    def default_path() -> bytes:
+        # Так кодирует JSONResponse по умолчанию
+        return json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False,
+                          indent=None, separators=(",", ":")).encode("utf-8")
+
+    def fast_path() -> bytes:
+        return FastJSONResponse(payload).body
+
+    print(f"Строк: {len(rows)}, build_consolidated: {build_ms:.0f} мс (без --scale)")
+    print(f"orjson: {'да' if _HAS_ORJSON else 'нет'}, brotli: {'да' if _HAS_BROTLI else 'нет'}")
+    print(f"{'путь':32s} {'мс':>8s} {'байт':>12s}")
+    ms, body = _best(default_path, args.repeat)
+    print(f"{'jsonable_encoder + json':32s} {ms:8.1f} {len(body):12d}")
+    ms, body = _best(fast_path, args.repeat)
+    print(f"{'FastJSONResponse':32s} {ms:8.1f} {len(body):12d}")
+
+    ms, gz = _best(lambda: gzip.compress(body, compresslevel=6), args.repeat)
+    print(f"{'  + gzip (6)':32s} {ms:8.1f} {len(gz):12d}")
+    if _HAS_BROTLI:
+        import brotli
+        ms, br = _best(lambda: brotli.compress(body, quality=4), args.repeat)
+        print(f"{'  + brotli (4)':32s} {ms:8.1f} {len(br):12d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк чтения XLSX при загрузке (выгрузка «Кадры» / AD в Excel).
+
+Генерирует книгу из N строк с колонками PEOPLE_COLUMNS (плюс числа, даты
+и пустые ячейки) и сравнивает:
+  - pd.read_excel с движком по умолчанию (openpyxl) — прежний путь;
+  - потоковое чтение openpyxl read_only (app.parsers, без calamine);
+  - движок calamine (если установлен python-calamine);
+  - parse_people целиком текущим путём.
+Для каждого способа проверяется, что DataFrame совпадает с pd.read_excel.
+
+Запуск из корня репозитория:
+    python -m scripts.bench_xlsx [--rows 50000] [--repeat 3]
+"""
+import argparse
+import io
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from app import parsers
+from app.config import PEOPLE_COLUMNS
+
+
+def _book(n: int) -> bytes:
+    base = datetime(2024, 1, 1)
+    rows = []
+    for i in range(n):
+        row = {col: f"{col} {i % 97}" for col in PEOPLE_COLUMNS.values()}
+        row.update({
+            "UUID": f"uuid-{i}",
+            "Employee": f"Иванов Пётр Сергеевич {i}",
+            "E-mail": f"user{i}@example.com",
+            "Мобильный": 89120000000 + i,
+            "Hub": "" if i % 3 else "Hub",
+            "Ставка": i * 0.25,
+            "Дата приёма": base + timedelta(days=i % 3000),
+        })
+        rows.append(row)
+    buf = io.BytesIO()
+    pd.DataFrame(rows).to_excel(buf, index=False)
+    return buf.getvalue()
+
+
+def _best(fn, repeat: int):
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t)
+    return best * 1000, out
+
+
+def _same(a: pd.DataFrame, b: pd.DataFrame) -> str:
+    try:
+        pd.testing.assert_frame_equal(a, b, check_dtype=False)
+    except AssertionError as e:
+        return "отличается: " + str(e).splitlines()[0]
+    return "совпадает"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rows", type=int, default=50000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    content = _book(args.rows)
+    print(f"Строк: {args.rows}, файл: {len(content) / 1024 / 1024:.1f} МБ, "
+          f"calamine: {'да' if parsers._HAS_CALAMINE else 'нет'}")
+    print(f"{'способ':34s} {'мс':>9s}  результат")
+
+    ms, expected = _best(lambda: pd.read_excel(io.BytesIO(content), sheet_name=0, keep_default_na=False), args.repeat)
+    print(f"{'pd.read_excel (openpyxl)':34s} {ms:9.0f}  эталон")
+
+    ms, df = _best(lambda: parsers._read_xlsx_rows(content), args.repeat)
+    print(f"{'openpyxl read_only':34s} {ms:9.0f}  {_same(expected, df)}")
+
+    if parsers._HAS_CALAMINE:
+        ms, df = _best(lambda: pd.read_excel(io.BytesIO(content), sheet_name=0, keep_default_na=False,
+                                             engine="calamine"), args.repeat)
+        print(f"{'calamine':34s} {ms:9.0f}  {_same(expected, df)}")
+
+    ms, (rows, err) = _best(lambda: parsers.parse_people(content, "people.xlsx"), args.repeat)
+    print(f"{'parse_people (текущий путь)':34s} {ms:9.0f}  {err or f'{len(rows)} строк'}")
+
+
+if __name__ == "__main__":
+    main()